@@ -0,0 +1,93 @@
+'''
+Benchmarks for the InstaPic preprocessing on a synthetic caption corpus.
+Captions mix words, hashtags, mentions, emoticons, punctuation and newlines like the real dumps, the TF-IDF
+context tokens are extracted from Zipf-distributed tokens over a full size vocabulary.
+'''
+import argparse
+import random
+import resource
+import time
+from collections import Counter
+import numpy as np
+from instapic_data_util import get_tfidf_words, tokenize
+from instapic_tokenizer import ParallelTokenizer, tokenize_fast
+
+WORDS = ['love', 'Summer', 'day', 'with', 'the', 'best', 'friends', 'coffee', 'time', 'New-York', 'sunset', 'so_happy',
+         "can't", 'wait', 'food', 'photo', 'of', 'today', '2017', 'BEACH']
+EXTRAS = ['#tbt', '#instagood', '@john.doe', '@mary_j', '\U0001f600', '❤', '\U0001f680', '!!', '...', ',', '?', '"', ' - ',
+          '\n', '\\u00e9']
+
+
+def synthetic_posts(num_posts, posts_per_user=20, seed=0):
+    # (user_id, post_id, post) records like instapic_stream.iter_posts yields
+    rng = random.Random(seed)
+    for i in range(num_posts):
+        words = [rng.choice(WORDS) if rng.random() < 0.8 else rng.choice(EXTRAS) for _ in range(rng.randint(3, 40))]
+        caption = ''.join(word + rng.choice([' ', ' ', ' ', '']) for word in words)
+        yield str(i // posts_per_user), str(i), dict(caption=caption, tags=[word.strip('#') for word in words if word.startswith('#')])
+
+
+def bench_tokenize(num_posts, max_processes, chunk_size):
+    posts = list(synthetic_posts(num_posts))
+    captions = [post['caption'] for _, _, post in posts]
+
+    start = time.time()
+    expected = [tokenize(caption) for caption in captions]
+    base_time = time.time() - start
+    print(f'tokenize               {num_posts / base_time:10.0f} posts/s')
+
+    start = time.time()
+    fast = [tokenize_fast(caption) for caption in captions]
+    fast_time = time.time() - start
+    print(f'tokenize_fast          {num_posts / fast_time:10.0f} posts/s  ({base_time / fast_time:.2f}x)  identical: {fast == expected}')
+
+    expected_counter = Counter(token for tokens in expected for token in tokens)
+    processes = 1
+    while processes <= max_processes:
+        tokenizer = ParallelTokenizer(processes, chunk_size)
+        counter = Counter()
+        start = time.time()
+        parallel = [tokens for _, _, tokens in tokenizer.tokenize_posts(posts, 'caption', counter)]
+        parallel_time = time.time() - start
+        tokenizer.close()
+        print(f'{processes:2d} processes           {num_posts / parallel_time:10.0f} posts/s  ({base_time / parallel_time:.2f}x)  '
+              f'identical: {parallel == expected and counter == expected_counter}')
+        processes *= 2
+
+
+def bench_tfidf(num_users, vocab_size, posts_per_user=20, tokens_per_post=15):
+    # Zipf-distributed tokens over a vocab_size vocabulary, test splits a tenth of the train users each
+    rng = np.random.RandomState(0)
+    vocab = ['_pad', '_go', '_eos', '_unk'] + [f'w{i}' for i in range(vocab_size)]
+    rev_vocab = {token: i for i, token in enumerate(vocab)}
+
+    def split(num_split_users):
+        ids = np.minimum(rng.zipf(1.2, [num_split_users, posts_per_user, tokens_per_post]), vocab_size) - 1
+        return {str(u): {str(p): [vocab[4 + i] for i in ids[u, p]] for p in range(posts_per_user)} for u in range(num_split_users)}
+
+    splits = [split(num_users), split(num_users // 10), split(num_users // 10)]
+    start = time.time()
+    get_tfidf_words(*splits, vocab, rev_vocab)
+    # A dense num_users x vocab_size float64 count matrix alone would take this much
+    dense_bytes = 8 * num_users * len(vocab)
+    print(f'get_tfidf_words        {time.time() - start:8.2f} s for {num_users} users, vocab {vocab_size}  '
+          f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:.0f} MB (dense counts {dense_bytes / 2 ** 20:.0f} MB)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-posts', type=int, default=200000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--tfidf-users', type=int, default=20000)
+    parser.add_argument('--vocab-size', type=int, default=100000)
+    args = parser.parse_args()
+
+    print('#### Tokenization ####')
+    bench_tokenize(args.num_posts, args.processes, args.chunk_size)
+    print('#### TF-IDF context tokens ####')
+    bench_tfidf(args.tfidf_users, args.vocab_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+'''
+CPU benchmarks for the SeqGAN building blocks.
+Models are built with random weights at the sizes used in seqGAN.py unless overridden on the command line.
+
+With --suite it instead measures samples/sec of every training step at the model scales in SCALES, and the
+scaling efficiency of data-parallel pretraining over 1 to --pretrain-workers local workers, and prints them as JSON. Given --baseline (the JSON of an earlier run) it exits with status 1 when any throughput dropped by
+more than --max-regression:
+    python bench_seqgan.py --suite --output bench.json
+    python bench_seqgan.py --suite --baseline bench.json
+'''
+import argparse
+import json
+import os
+import pickle
+import platform
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from generator import Generator
+from target_lstm import TARGET_LSTM
+from discriminator import Discriminator, bucket_filter_sizes
+from rollout import ROLLOUT
+from parallel_pretrain import DataParallelPretrainer
+from reward_scorer import PRECISIONS, RewardScorer
+from data_loader import Generator_Data_Loader, Discriminator_Data_Loader
+from token_store import load_tokens
+from lstm_cell import lstm_unit, split_lstm_params, zero_state
+
+EMB_DIM = 32
+HIDDEN_DIM = 32
+SEQ_LENGTH = 20
+START_TOKEN = 0
+BATCH_SIZE = 64
+VOCAB_SIZE = 19851
+ORACLE_FILE = 'data/real_data_oracle.txt'
+ORACLE_VOCAB_SIZE = 5000
+
+dis_embedding_dim = 64
+dis_filter_sizes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 15, 20]
+dis_num_filters = [100, 200, 200, 200, 200, 100, 100, 100, 100, 100, 160, 160]
+
+# Model sizes of the --suite benchmarks. 'oracle' is the synthetic data setup of seqGAN.py, with the
+# TARGET_LSTM loaded from target_params, 'instapic' the real data vocabulary.
+SCALES = {
+    'small': dict(vocab_size=1000, batch_size=32, emb_dim=16, hidden_dim=16, rollout_num=4,
+                  filter_sizes=[1, 2, 3, 5, 10, 20], num_filters=[50, 50, 50, 50, 80, 80]),
+    'oracle': dict(vocab_size=ORACLE_VOCAB_SIZE, batch_size=BATCH_SIZE, emb_dim=EMB_DIM, hidden_dim=HIDDEN_DIM, rollout_num=16,
+                   filter_sizes=dis_filter_sizes, num_filters=dis_num_filters, target_params='data/target_params_py3.pkl'),
+    'instapic': dict(vocab_size=VOCAB_SIZE, batch_size=BATCH_SIZE, emb_dim=EMB_DIM, hidden_dim=HIDDEN_DIM, rollout_num=16,
+                     filter_sizes=dis_filter_sizes, num_filters=dis_num_filters),
+}
+
+
+def timeit(fn, repeat):
+    # One warm-up call so graph optimisation is not counted
+    result = fn()
+    start = time.time()
+    for _ in range(repeat):
+        result = fn()
+    return (time.time() - start) / repeat, result
+
+
+def bench_rollout(sess, generator, rollout, discriminator, rollout_num, repeat):
+    samples = generator.generate(sess)
+    loop_time, loop_rewards = timeit(lambda: rollout.get_reward(sess, samples, rollout_num, discriminator), repeat)
+    batched_time, batched_rewards = timeit(lambda: rollout.get_reward_batched(sess, samples, rollout_num, discriminator), repeat)
+
+    print(f'get_reward          {loop_time:8.3f} s/call  reward mean {loop_rewards.mean():.5f} std {loop_rewards.std():.5f}')
+    print(f'get_reward_batched  {batched_time:8.3f} s/call  reward mean {batched_rewards.mean():.5f} std {batched_rewards.std():.5f}')
+    print(f'speed-up            {loop_time / batched_time:8.2f}x')
+    # Per given_num means should agree up to Monte Carlo noise
+    print('max |mean difference| per position:', np.abs(loop_rewards.mean(0) - batched_rewards.mean(0)).max())
+
+
+def bench_adaptive_rollout(sess, generator, rollout, discriminator, rollout_num, tolerance, repeat):
+    samples = generator.generate(sess)
+    fixed_time, fixed_rewards = timeit(lambda: rollout.get_reward_batched(sess, samples, rollout_num, discriminator), repeat)
+    adaptive_time, (adaptive_rewards, count) = timeit(lambda: rollout.get_reward_adaptive(sess, samples, discriminator, max_rollout_num=rollout_num, tolerance=tolerance), repeat)
+
+    print(f'fixed budget        {fixed_time:8.3f} s/call  rollouts {count.size * rollout_num}')
+    print(f'adaptive (tol {tolerance})  {adaptive_time:8.3f} s/call  rollouts {count.sum()}')
+    print(f'rollouts saved      {1 - count.sum() / (count.size * rollout_num):8.2%}')
+    print('max |reward difference|:', np.abs(fixed_rewards - adaptive_rewards).max())
+
+
+def bench_generation(sess, generator, num_samples, repeat):
+    # Training-sized batches against a few large runs of the same graph
+    def generate(rows):
+        return np.concatenate([generator.generate(sess, min(rows, num_samples - start)) for start in range(0, num_samples, rows)], 0)
+
+    small_time, _ = timeit(lambda: generate(generator.batch_size), repeat)
+    print(f'{generator.batch_size:5d} rows/run      {small_time:8.3f} s for {num_samples} samples')
+    for rows in (1024, 4096, 8192):
+        large_time, samples = timeit(lambda: generate(rows), repeat)
+        print(f'{rows:5d} rows/run      {large_time:8.3f} s for {len(samples)} samples  ({small_time / large_time:.2f}x)')
+
+
+def separate_gates_unit(W, b, emb_dim):
+    # The cell as it was before lstm_cell: 8 matmuls per step and a stacked [2, batch, hidden] state
+    W_i, U_i, b_i, W_f, U_f, b_f, W_o, U_o, b_o, W_c, U_c, b_c = [tf.constant(p) for p in split_lstm_params(W, b, emb_dim)]
+
+    def unit(x, hidden_mem_tm1):
+        prev_hidden_state, c_prev = tf.unstack(hidden_mem_tm1)
+        i = tf.sigmoid(tf.matmul(x, W_i) + tf.matmul(prev_hidden_state, U_i) + b_i)
+        f = tf.sigmoid(tf.matmul(x, W_f) + tf.matmul(prev_hidden_state, U_f) + b_f)
+        o = tf.sigmoid(tf.matmul(x, W_o) + tf.matmul(prev_hidden_state, U_o) + b_o)
+        c_ = tf.nn.tanh(tf.matmul(x, W_c) + tf.matmul(prev_hidden_state, U_c) + b_c)
+        c = f * c_prev + i * c_
+        return tf.stack([o * tf.nn.tanh(c), c])
+
+    return unit
+
+
+def bench_lstm_step(batch_size, repeat, steps=SEQ_LENGTH):
+    # Time per recurrence step of a steps long while_loop, separate gates against the fused cell
+    tf.reset_default_graph()
+    rng = np.random.RandomState(0)
+    W = rng.normal(0, 0.1, [EMB_DIM + HIDDEN_DIM, 4 * HIDDEN_DIM]).astype(np.float32)
+    b = rng.normal(0, 0.1, [4 * HIDDEN_DIM]).astype(np.float32)
+    x = tf.constant(rng.normal(0, 1, [steps, batch_size, EMB_DIM]).astype(np.float32))
+
+    def run(unit, h0):
+        _, h = tf.while_loop(lambda i, _: i < steps, lambda i, h: (i + 1, unit(x[i], h)), (tf.constant(0), h0))
+        return h
+
+    separate_h = run(separate_gates_unit(W, b, EMB_DIM), tf.zeros([2, batch_size, HIDDEN_DIM]))
+    fused_h = run(lstm_unit(tf.constant(W), tf.constant(b)), zero_state(batch_size, HIDDEN_DIM))
+
+    sess = tf.Session()
+    separate_time, separate_out = timeit(lambda: sess.run(separate_h), repeat)
+    fused_time, fused_out = timeit(lambda: sess.run(fused_h), repeat)
+    print(f'separate gates      {separate_time / steps * 1e6:8.1f} us/step  (batch {batch_size})')
+    print(f'fused cell          {fused_time / steps * 1e6:8.1f} us/step  ({separate_time / fused_time:.2f}x)')
+    print('max |state difference|:', np.abs(separate_out - np.stack(fused_out)).max())
+
+
+def bench_reward_cache(vocab_size, batch_size, rollout_num, repeat, temperature=0.005):
+    # A low temperature stands in for a trained, peaked generator that repeats its completions
+    tf.reset_default_graph()
+    generator = Generator(vocab_size, batch_size, EMB_DIM, HIDDEN_DIM, SEQ_LENGTH, START_TOKEN, temperature=temperature)
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim,
+                                  filter_sizes=dis_filter_sizes, num_filters=dis_num_filters)
+    rollout = ROLLOUT(generator, 0.8)
+    cached_rollout = ROLLOUT(generator, 0.8, reward_cache_size=100000)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    samples = generator.generate(sess)
+
+    plain_time, _ = timeit(lambda: rollout.get_reward_batched(sess, samples, rollout_num, discriminator), repeat)
+    # Fresh samples every call, so hits come from repeated completions and not from replaying one batch
+    cached_time, _ = timeit(lambda: cached_rollout.get_reward_batched(sess, generator.generate(sess), rollout_num, discriminator), repeat)
+    cache = cached_rollout.reward_cache
+    print(f'no cache            {plain_time:8.3f} s/call')
+    print(f'reward cache        {cached_time:8.3f} s/call  ({plain_time / cached_time:.2f}x)  hit rate {cache.hit_rate():.2%}  '
+          f'scored {cache.scored} of {cache.hits + cache.misses} rows')
+
+
+def bench_discriminator(vocab_size, batch_size, repeat):
+    # Forward latency of the per-width conv2d branches against fused buckets of a few padding budgets
+    tf.reset_default_graph()
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim,
+                                  filter_sizes=dis_filter_sizes, num_filters=dis_num_filters)
+    input_x = tf.placeholder(tf.int32, [None, SEQ_LENGTH])
+    scores = {}
+    with tf.variable_scope('discriminator', reuse=True):
+        discriminator.fused_conv = False
+        scores['per-width conv2d'] = discriminator.build_scores(input_x, 1.0)
+        discriminator.fused_conv = True
+        for max_pad_overhead in (0.0, 0.25, 0.5):
+            discriminator.conv_buckets = bucket_filter_sizes(dis_filter_sizes, dis_num_filters, SEQ_LENGTH, max_pad_overhead)
+            scores[f'fused, {len(discriminator.conv_buckets)} buckets'] = discriminator.build_scores(input_x, 1.0)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    feed = {input_x: np.random.randint(0, vocab_size, [batch_size, SEQ_LENGTH])}
+    base_time, base_scores = timeit(lambda: sess.run(scores['per-width conv2d'], feed), repeat)
+    for name, score in scores.items():
+        run_time, run_scores = timeit(lambda: sess.run(score, feed), repeat)
+        print(f'{name:22s} {run_time * 1e3:8.2f} ms  ({base_time / run_time:.2f}x)  max |score difference| {np.abs(run_scores - base_scores).max():.2e}')
+
+
+def bench_reward_scorer(vocab_size, batch_size, repeat):
+    # Rollout scoring throughput of the training discriminator against the inference-only scorers
+    tf.reset_default_graph()
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim,
+                                  filter_sizes=dis_filter_sizes, num_filters=dis_num_filters)
+    scorers = {precision: RewardScorer(discriminator, precision) for precision in PRECISIONS}
+    input_x = tf.placeholder(tf.int32, [None, SEQ_LENGTH])
+    rewards = {'discriminator': discriminator.build_reward(input_x)}
+    rewards.update({precision: scorer.build_reward(input_x) for precision, scorer in scorers.items()})
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    for scorer in scorers.values():
+        scorer.refresh(sess)
+    feed = {input_x: np.random.randint(0, vocab_size, [batch_size, SEQ_LENGTH])}
+    base_time, base_rewards = timeit(lambda: sess.run(rewards['discriminator'], feed), repeat)
+    for name, reward in rewards.items():
+        run_time, run_rewards = timeit(lambda: sess.run(reward, feed), repeat)
+        error = np.abs(run_rewards - base_rewards)
+        print(f'{name:14s} {batch_size / run_time:10.0f} rows/s  ({base_time / run_time:.2f}x)  reward error mean {error.mean():.2e} max {error.max():.2e}')
+
+
+def steps_per_sec(fn, steps):
+    fn()
+    start = time.time()
+    for _ in range(steps):
+        fn()
+    return steps / (time.time() - start)
+
+
+def bench_input_pipeline(batch_size, steps):
+    # Both pathways share one graph, the placeholders default to the tf.data iterators when not fed
+    tf.reset_default_graph()
+    gen_data_loader = Generator_Data_Loader(batch_size)
+    dis_data_loader = Discriminator_Data_Loader(batch_size)
+    gen_input_x = gen_data_loader.create_dataset(ORACLE_FILE, SEQ_LENGTH)
+    dis_input_x, dis_input_y = dis_data_loader.create_dataset(SEQ_LENGTH, 2)
+    generator = Generator(ORACLE_VOCAB_SIZE, batch_size, EMB_DIM, HIDDEN_DIM, SEQ_LENGTH, START_TOKEN, input_x=gen_input_x)
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=ORACLE_VOCAB_SIZE, emb_size=dis_embedding_dim,
+                                  filter_sizes=dis_filter_sizes, num_filters=dis_num_filters, input_x=dis_input_x, input_y=dis_input_y)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    gen_data_loader.create_batches(ORACLE_FILE)
+    positive_samples = load_tokens(ORACLE_FILE, SEQ_LENGTH)
+    dis_data_loader.load_train_arrays(positive_samples, np.random.randint(0, ORACLE_VOCAB_SIZE, positive_samples.shape))
+    steps = min(steps, gen_data_loader.num_batch - 1, dis_data_loader.num_batch - 1)
+
+    gen_data_loader.reset_pointer()
+    feed_rate = steps_per_sec(lambda: generator.pretrain_step(sess, gen_data_loader.next_batch()), steps)
+    gen_data_loader.init_epoch(sess)
+    data_rate = steps_per_sec(lambda: generator.pretrain_step(sess), steps)
+    print(f'generator pretrain     feed_dict {feed_rate:8.2f} steps/s  tf.data {data_rate:8.2f} steps/s')
+
+    def dis_feed_step():
+        x_batch, y_batch = dis_data_loader.next_batch()
+        sess.run(discriminator.train_op, {discriminator.input_x: x_batch, discriminator.input_y: y_batch, discriminator.dropout_keep_prob: 0.75})
+
+    dis_data_loader.reset_pointer()
+    feed_rate = steps_per_sec(dis_feed_step, steps)
+    dis_data_loader.init_epoch(sess)
+    data_rate = steps_per_sec(lambda: sess.run(discriminator.train_op, {discriminator.dropout_keep_prob: 0.75}), steps)
+    print(f'discriminator train    feed_dict {feed_rate:8.2f} steps/s  tf.data {data_rate:8.2f} steps/s')
+
+
+def throughput(fn, rows, min_time, min_calls=2):
+    # Samples/sec of fn, which handles rows samples per call, over at least min_time seconds after a warm-up call
+    fn()
+    calls = 0
+    start = time.perf_counter()
+    while calls < min_calls or time.perf_counter() - start < min_time:
+        fn()
+        calls += 1
+    elapsed = time.perf_counter() - start
+    return dict(samples_per_sec=rows * calls / elapsed, seconds_per_call=elapsed / calls, calls=calls)
+
+
+def bench_scale(scale, min_time, pretrain_workers=2):
+    """Throughput of the generator, rollout, discriminator and data loader steps at one of SCALES."""
+    config = SCALES[scale]
+    batch_size, vocab_size, rollout_num = config['batch_size'], config['vocab_size'], config['rollout_num']
+    tf.reset_default_graph()
+    tf.set_random_seed(88)
+    np.random.seed(88)
+    gen_data_loader = Generator_Data_Loader(batch_size)
+    dis_data_loader = Discriminator_Data_Loader(batch_size)
+    gen_batch = gen_data_loader.create_dataset(ORACLE_FILE, SEQ_LENGTH)
+    dis_batch = dis_data_loader.create_dataset(SEQ_LENGTH, 2)
+    # The models are fed, so their steps and the loaders are timed apart
+    generator = Generator(vocab_size, batch_size, config['emb_dim'], config['hidden_dim'], SEQ_LENGTH, START_TOKEN)
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim,
+                                  filter_sizes=config['filter_sizes'], num_filters=config['num_filters'])
+    rollout = ROLLOUT(generator, 0.8)
+    target_lstm = None
+    if 'target_params' in config:
+        with open(config['target_params'], 'rb') as f:
+            target_params = pickle.load(f)
+        target_lstm = TARGET_LSTM(vocab_size, batch_size, config['emb_dim'], config['hidden_dim'], SEQ_LENGTH, START_TOKEN, target_params)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    # Real data comes from the oracle when there is one and is uniform noise otherwise
+    real = target_lstm.generate(sess) if target_lstm is not None else np.random.randint(0, vocab_size, [batch_size, SEQ_LENGTH])
+    samples = generator.generate(sess)
+    dis_x = np.concatenate([real, samples], 0)
+    dis_y = np.zeros([2 * batch_size, 2], dtype=np.int64)
+    dis_y[:batch_size, 1] = 1
+    dis_y[batch_size:, 0] = 1
+
+    results = {}
+    results['generator.generate'] = throughput(lambda: generator.generate(sess), batch_size, min_time)
+    results['generator.pretrain_step'] = throughput(lambda: generator.pretrain_step(sess, real), batch_size, min_time)
+    # A reward row is one sequence scored at every prefix
+    results['rollout.get_reward'] = throughput(lambda: rollout.get_reward(sess, samples, rollout_num, discriminator), batch_size, min_time)
+    results['rollout.get_reward_batched'] = throughput(lambda: rollout.get_reward_batched(sess, samples, rollout_num, discriminator), batch_size, min_time)
+    train_feed = {discriminator.input_x: dis_x, discriminator.input_y: dis_y, discriminator.dropout_keep_prob: 0.75}
+    results['discriminator.train_step'] = throughput(lambda: sess.run(discriminator.train_op, train_feed), 2 * batch_size, min_time)
+    infer_feed = {discriminator.input_x: dis_x, discriminator.dropout_keep_prob: 1.0}
+    results['discriminator.inference'] = throughput(lambda: sess.run(discriminator.ypred_for_auc, infer_feed), 2 * batch_size, min_time)
+    if target_lstm is not None:
+        results['target_lstm.generate'] = throughput(lambda: target_lstm.generate(sess), batch_size, min_time)
+        results['target_lstm.nll'] = throughput(lambda: sess.run(target_lstm.pretrain_loss, {target_lstm.x: samples}), batch_size, min_time)
+
+    # Data loaders, one epoch per call over the oracle data (and as many negatives for the discriminator)
+    gen_data_loader.create_batches(ORACLE_FILE)
+    positive_samples = load_tokens(ORACLE_FILE, SEQ_LENGTH)
+    negative_samples = np.random.randint(0, vocab_size, positive_samples.shape)
+
+    def gen_epoch():
+        gen_data_loader.reset_pointer()
+        for _ in range(gen_data_loader.num_batch):
+            np.asarray(gen_data_loader.next_batch())
+
+    def gen_tf_data_epoch():
+        gen_data_loader.init_epoch(sess)
+        for _ in range(gen_data_loader.num_batch):
+            sess.run(gen_batch)
+
+    def dis_epoch():
+        dis_data_loader.load_train_arrays(positive_samples, negative_samples)
+        for _ in range(dis_data_loader.num_batch):
+            dis_data_loader.next_batch()
+
+    def dis_tf_data_epoch():
+        dis_data_loader.load_train_arrays(positive_samples, negative_samples)
+        dis_data_loader.init_epoch(sess)
+        for _ in range(dis_data_loader.num_batch):
+            sess.run(dis_batch)
+
+    gen_rows = gen_data_loader.num_batch * batch_size
+    dis_rows = (2 * len(positive_samples)) // batch_size * batch_size
+    results['gen_data_loader.next_batch'] = throughput(gen_epoch, gen_rows, min_time)
+    results['gen_data_loader.tf_data'] = throughput(gen_tf_data_epoch, gen_rows, min_time)
+    results['dis_data_loader.next_batch'] = throughput(dis_epoch, dis_rows, min_time)
+    results['dis_data_loader.tf_data'] = throughput(dis_tf_data_epoch, dis_rows, min_time)
+    # The pretraining shards are oracle data, which needs the oracle vocabulary
+    if vocab_size >= ORACLE_VOCAB_SIZE:
+        generator_config = dict(emb_num=vocab_size, batch_size=batch_size, emb_dim=config['emb_dim'], hidden_dim=config['hidden_dim'],
+                                seq_len=SEQ_LENGTH, start_token=START_TOKEN)
+        results.update(bench_parallel_pretrain(sess, generator, generator_config, pretrain_workers))
+    sess.close()
+    return dict(config=config, results=results)
+
+
+def bench_parallel_pretrain(sess, generator, generator_config, max_workers, sync_every=10):
+    # Pretraining epochs over the oracle data with 1, 2, 4, ... max_workers local replicas, efficiency is
+    # the throughput over the single worker throughput times the number of workers
+    worker_counts = sorted({min(2 ** k, max_workers) for k in range(max_workers.bit_length() + 1)})
+    results = {}
+    for num_workers in worker_counts:
+        pretrainer = DataParallelPretrainer(generator_config, ORACLE_FILE, ['localhost'] * num_workers, sync_every)
+        rows = pretrainer.steps_per_epoch * num_workers * generator.batch_size
+        try:
+            # One warm-up epoch, then one timed
+            stats = throughput(lambda: pretrainer.train_epoch(sess, generator), rows, 0, min_calls=1)
+        finally:
+            pretrainer.close()
+        stats['efficiency'] = stats['samples_per_sec'] / (num_workers * results['parallel_pretrain.1_workers']['samples_per_sec']) if results else 1.0
+        results[f'parallel_pretrain.{num_workers}_workers'] = stats
+    return results
+
+
+def find_regressions(report, baseline, max_regression):
+    # (scale/benchmark, baseline and current samples/sec) for every throughput more than max_regression below the baseline
+    regressions = []
+    for scale, scale_report in report['scales'].items():
+        baseline_results = baseline['scales'].get(scale, {}).get('results', {})
+        for name, stats in scale_report['results'].items():
+            if name not in baseline_results:
+                continue
+            before, after = baseline_results[name]['samples_per_sec'], stats['samples_per_sec']
+            if after < before * (1 - max_regression):
+                regressions.append((f'{scale}/{name}', before, after))
+    return regressions
+
+
+def run_suite(args):
+    report = dict(machine=dict(platform=platform.platform(), python=platform.python_version(), tensorflow=tf.__version__,
+                               cpu_count=os.cpu_count()),
+                  min_time=args.min_time, scales={})
+    for scale in args.scales:
+        print(f'#### {scale} ####', file=sys.stderr)
+        report['scales'][scale] = bench_scale(scale, args.min_time, args.pretrain_workers)
+        for name, stats in report['scales'][scale]['results'].items():
+            efficiency = f'  efficiency {stats["efficiency"]:.2f}' if 'efficiency' in stats else ''
+            print(f'{name:30s} {stats["samples_per_sec"]:12.1f} samples/s{efficiency}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.max_regression)
+        for name, before, after in regressions:
+            print(f'REGRESSION {name}: {before:.1f} -> {after:.1f} samples/s ({after / before - 1:+.1%})', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vocab-size', type=int, default=VOCAB_SIZE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--rollout-num', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--num-samples', type=int, default=10000)
+    parser.add_argument('--suite', action='store_true', help='Measure samples/sec at every scale and print them as JSON')
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES), default=['small', 'oracle'])
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds to time each benchmark for')
+    parser.add_argument('--pretrain-workers', type=int, default=max(2, min(4, os.cpu_count())),
+                        help='Measure data-parallel pretraining scaling from 1 up to this many local workers')
+    parser.add_argument('--output', help='Write the suite JSON here instead of stdout')
+    parser.add_argument('--baseline', help='Suite JSON of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='Fail when samples/sec drop by more than this fraction')
+    args = parser.parse_args()
+
+    if args.suite:
+        run_suite(args)
+        return
+
+    print('#### LSTM cell ####')
+    for batch_size in (args.batch_size, args.batch_size * args.rollout_num * (SEQ_LENGTH - 1)):
+        bench_lstm_step(batch_size, args.repeat * 100)
+
+    print('#### Discriminator forward ####')
+    for batch_size in (args.batch_size, args.batch_size * args.rollout_num):
+        bench_discriminator(args.vocab_size, batch_size, args.repeat * 10)
+
+    print('#### Reward cache ####')
+    bench_reward_cache(args.vocab_size, args.batch_size, args.rollout_num, args.repeat)
+    print('#### Reward scorer ####')
+    bench_reward_scorer(args.vocab_size, args.batch_size * args.rollout_num, args.repeat * 10)
+
+    tf.reset_default_graph()
+    tf.set_random_seed(88)
+    generator = Generator(args.vocab_size, args.batch_size, EMB_DIM, HIDDEN_DIM, SEQ_LENGTH, START_TOKEN)
+    discriminator = Discriminator(seq_len=SEQ_LENGTH, num_classes=2, vocab_size=args.vocab_size, emb_size=dis_embedding_dim, filter_sizes=dis_filter_sizes, num_filters=dis_num_filters)
+    rollout = ROLLOUT(generator, 0.8)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+
+    print('#### Rollout reward ####')
+    bench_rollout(sess, generator, rollout, discriminator, args.rollout_num, args.repeat)
+    print('#### Adaptive rollout reward ####')
+    bench_adaptive_rollout(sess, generator, rollout, discriminator, args.rollout_num, args.tolerance, args.repeat)
+    print('#### Sample generation ####')
+    bench_generation(sess, generator, args.num_samples, args.repeat)
+    print('#### Input pipeline, oracle data ####')
+    bench_input_pipeline(args.batch_size, args.steps)
+
+
+if __name__ == '__main__':
+    main()
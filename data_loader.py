@@ -1,4 +1,6 @@
 import numpy as np
+import tensorflow as tf
+from token_store import load_tokens
 
 # Data loader for Generator
 class Generator_Data_Loader():
@@ -7,28 +9,43 @@ class Generator_Data_Loader():
         self.word_stream = []
 
     def create_batches(self, data_file):
-        self.word_stream = []
-        with open(data_file, 'r') as f:
-            for line in f:
-                line = line.strip().split()
-                line_list = [int(x) for x in line]
-                # One can do padding or trim the line to length of 20
-                if len(line_list) == 20:
-                    self.word_stream.append(line_list)
+        # Memory-mapped, only lines of 20 tokens are kept
+        self.word_stream = load_tokens(data_file, 20)
 
         self.num_batch = int(len(self.word_stream)/self.batch_size)
         self.word_stream = self.word_stream[:self.num_batch*self.batch_size]
-        self.sequence_batch = np.split(np.array(self.word_stream), self.num_batch, axis=0)
         self.pointer = 0
 
     def next_batch(self):
-        retrieve = self.sequence_batch[self.pointer]
+        start = self.pointer*self.batch_size
+        retrieve = self.word_stream[start:start + self.batch_size]
         self.pointer = (self.pointer + 1) % self.num_batch
         return retrieve
 
     def reset_pointer(self):
         self.pointer = 0
 
+    def create_dataset(self, data_file, seq_len=20, shuffle_buffer=10000, prefetch=2):
+        """
+        tf.data alternative to create_batches/next_batch over the same memory-mapped token store: shuffles, batches and prefetches.
+        Returns the batch tensor to build the model on, run init_epoch before every epoch.
+        """
+        self.word_stream = load_tokens(data_file, seq_len)
+        self.num_batch = int(len(self.word_stream)/self.batch_size)
+        # A placeholder, so the rows are not stored as a constant in the graph
+        self.word_stream_input = tf.placeholder(tf.int32, [None, seq_len])
+
+        dataset = tf.data.Dataset.from_tensor_slices(self.word_stream_input)
+        dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(self.batch_size, drop_remainder=True)
+        dataset = dataset.prefetch(prefetch)
+
+        self.iterator = dataset.make_initializable_iterator()
+        return self.iterator.get_next()
+
+    def init_epoch(self, sess):
+        sess.run(self.iterator.initializer, {self.word_stream_input: self.word_stream})
+
 # Data loader for Discriminator
 class Discriminator_Data_Loader():
     def __init__(self, batch_size):
@@ -37,48 +54,52 @@ class Discriminator_Data_Loader():
         self.labels = np.array([])
 
     def load_train_data(self, pos_file, neg_file):
-        pos_examples = []
-        neg_examples = []
-
-        with open(pos_file, 'r') as f:
-            for line in f:
-                line = line.strip().split()
-                line_list = [int(x) for x in line]
-                pos_examples.append(line_list)
+        self.load_train_arrays(load_tokens(pos_file, 20), load_tokens(neg_file, 20))
 
-        with open(neg_file, 'r') as f:
-            for line in f:
-                line = line.strip().split()
-                line_list = [int(x) for x in line]
-                if len(line_list) == 20:
-                    neg_examples.append(line_list)
-
-        self.sentences = np.array(pos_examples + neg_examples)
+    def load_train_arrays(self, pos_examples, neg_examples):
+        # pos_examples, neg_examples: int arrays of shape [num_examples, seq_len], nothing is read from disk
+        self.sentences = np.concatenate([pos_examples, neg_examples], 0)
 
         # Generate labels
-        pos_labels = [[0, 1] for _ in pos_examples]
-        neg_labels = [[1, 0] for _ in neg_examples]
-
-        self.labels = np.concatenate([pos_labels, neg_labels], 0)
+        self.labels = np.zeros([len(self.sentences), 2], dtype=np.int64)
+        self.labels[:len(pos_examples), 1] = 1
+        self.labels[len(pos_examples):, 0] = 1
 
-        # Shuffle the data on shuffle_indexes
+        # Shuffle the data on shuffle_indexes, dropping the examples that do not fill a whole batch
         shuffle_ind = np.random.permutation(np.arange(len(self.labels)))
+        self.num_batch = int(len(self.labels)/self.batch_size)
+        shuffle_ind = shuffle_ind[:self.num_batch*self.batch_size]
         self.sentences = self.sentences[shuffle_ind]
         self.labels = self.labels[shuffle_ind]
 
-        # Split into batches
-        self.num_batch = int(len(self.labels)/self.batch_size)
-        self.sentences = self.sentences[:self.num_batch*self.batch_size]
-        self.labels = self.labels[:self.num_batch*self.batch_size]
-        self.sentences_batches = np.split(self.sentences, self.num_batch, axis=0)
-        self.labels_batches = np.split(self.labels, self.num_batch, axis=0)
-
         self.pointer = 0
 
     def next_batch(self):
-        retrieve = self.sentences_batches[self.pointer], self.labels_batches[self.pointer]
+        # Batches are views into the shuffled arrays
+        start = self.pointer*self.batch_size
+        retrieve = self.sentences[start:start + self.batch_size], self.labels[start:start + self.batch_size]
         self.pointer = (self.pointer + 1) % self.num_batch
         return retrieve
 
     def reset_pointer(self):
         self.pointer = 0
+
+    def create_dataset(self, seq_len=20, num_classes=2, shuffle_buffer=10000, prefetch=2):
+        """
+        tf.data alternative to next_batch over the arrays of the last load_train_arrays call.
+        Returns the (sentences, labels) batch tensors to build the model on, run init_epoch before every epoch.
+        """
+        # Placeholders so a new negative set does not add constants to the graph
+        self.sentences_input = tf.placeholder(tf.int32, [None, seq_len])
+        self.labels_input = tf.placeholder(tf.int32, [None, num_classes])
+
+        dataset = tf.data.Dataset.from_tensor_slices((self.sentences_input, self.labels_input))
+        dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(self.batch_size, drop_remainder=True)
+        dataset = dataset.prefetch(prefetch)
+
+        self.iterator = dataset.make_initializable_iterator()
+        return self.iterator.get_next()
+
+    def init_epoch(self, sess):
+        sess.run(self.iterator.initializer, {self.sentences_input: self.sentences, self.labels_input: self.labels})
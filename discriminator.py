@@ -28,28 +28,61 @@ def linear_function(inp, output_size, scope=None):
     input_size = shape[1]
 
     # Computation
-    with tf.variable_scope(scope or "SimpleLinear"):
-        matrix = tf.get_variable("Matrix", [output_size, input_size], dtype=inp.dtype)
-        bias = tf.get_variable("Bias", [output_size], dtype=inp.dtype)
+    matrix, bias = linear_params(input_size, output_size, scope or "SimpleLinear", dtype=inp.dtype)
 
     return tf.matmul(inp, tf.transpose(matrix)) + bias
 
-def highway(inp, size, num_layers=1, bias=2.0, f=tf.nn.relu, scope="Highway"):
+def linear_params(input_size, output_size, scope, dtype=tf.float32):
+    # The Matrix and Bias variables of linear_function under scope
+    with tf.variable_scope(scope):
+        matrix = tf.get_variable("Matrix", [output_size, input_size], dtype=dtype)
+        bias = tf.get_variable("Bias", [output_size], dtype=dtype)
+    return matrix, bias
+
+def highway_params(size, num_layers=1, scope="Highway"):
+    # (transform matrix, transform bias, gate matrix, gate bias) of each highway layer, named as linear_function names them
+    params = []
+    with tf.variable_scope(scope):
+        for i in range(num_layers):
+            params.append(linear_params(size, size, f'highway_lin_{i}') + linear_params(size, size, f'highway_gate_{i}'))
+    return params
+
+def highway(inp, params, bias=2.0, f=tf.nn.relu):
     """Highway Network (cf. http://arxiv.org/abs/1505.00387).
     t = sigmoid(Wy + b)
     z = t * g(Wy + b) + (1 - t) * y
     where g is nonlinearity, t is transform gate, and (1 - t) is carry gate.
+    params holds the weights of each layer, see highway_params.
     """
-    with tf.variable_scope(scope):
-        for i in range(num_layers):
-            g = f(linear_function(inp, size, scope=f'highway_lin_{i}'))
-            t = tf.sigmoid(linear_function(inp, size, scope=f'highway_gate_{i}') + bias)
+    for W_lin, b_lin, W_gate, b_gate in params:
+        g = f(tf.matmul(inp, tf.transpose(W_lin)) + b_lin)
+        t = tf.sigmoid(tf.matmul(inp, tf.transpose(W_gate)) + b_gate + bias)
 
-            output = t*g + (1. - t)*inp
-            inp = output
+        output = t*g + (1. - t)*inp
+        inp = output
 
     return output
 
+def bucket_filter_sizes(filter_sizes, num_filters, seq_len, max_pad_overhead):
+    # Greedily groups consecutive filter sizes (as indices) for fused_conv_features. A filter size joins the current
+    # bucket while zero-padding every kernel of the bucket to its widest one costs at most max_pad_overhead more
+    # multiply-adds than the separate convolutions. The features keep the filter_sizes order.
+    def flops(bucket):
+        widths = [filter_sizes[k] for k in bucket]
+        padded = max(widths) * sum(num_filters[k] for k in bucket) * (seq_len - min(widths) + 1)
+        separate = sum(filter_sizes[k] * num_filters[k] * (seq_len - filter_sizes[k] + 1) for k in bucket)
+        return padded, separate
+
+    buckets = []
+    for k in range(len(filter_sizes)):
+        if buckets:
+            padded, separate = flops(buckets[-1] + [k])
+            if padded <= (1 + max_pad_overhead) * separate:
+                buckets[-1].append(k)
+                continue
+        buckets.append([k])
+    return buckets
+
 class Discriminator(object):
     """
     A CNN for text classification.
@@ -61,11 +94,25 @@ class Discriminator(object):
     # embedding_size – The dimensionality of our embeddings.
     # filter_sizes – The number of words we want our convolutional filters to cover
     # num_filters – The number of filters per filter size.
-    def __init__(self, seq_len, num_classes, vocab_size, emb_size, filter_sizes, num_filters, l2_reg_lambda=0.0):
+    # input_x, input_y – Optional tensors (e.g. from a tf.data iterator) the placeholders default to when they are not fed
+    # fused_conv – Compute the filter sizes with one conv1d per bucket of filter sizes (see bucket_filter_sizes) instead of one conv2d each
+    # highway_layers – Number of highway layers between the pooled features and the output layer
+    def __init__(self, seq_len, num_classes, vocab_size, emb_size, filter_sizes, num_filters, l2_reg_lambda=0.0, input_x=None, input_y=None,
+                 fused_conv=True, max_pad_overhead=0.25, highway_layers=1):
+        self.seq_len = seq_len
+        self.filter_sizes = filter_sizes
+        self.num_filters = num_filters
+        self.fused_conv = fused_conv
+        self.conv_buckets = bucket_filter_sizes(filter_sizes, num_filters, seq_len, max_pad_overhead)
+
         # Placeholders for input, output and dropout
         # The first dimension is the batch size, and using None allows the network to handle arbitrarily sized batches.
-        self.input_x = tf.placeholder(tf.int32, [None, seq_len], name="input_x")
-        self.input_y = tf.placeholder(tf.int32, [None, num_classes], name="input_y")
+        if input_x is None:
+            self.input_x = tf.placeholder(tf.int32, [None, seq_len], name="input_x")
+            self.input_y = tf.placeholder(tf.int32, [None, num_classes], name="input_y")
+        else:
+            self.input_x = tf.placeholder_with_default(input_x, [None, seq_len], name="input_x")
+            self.input_y = tf.placeholder_with_default(input_y, [None, num_classes], name="input_y")
         self.dropout_keep_prob = tf.placeholder(tf.float32, name="dropout_keep_prob")
 
         # Keeping track of l2 regularization loss (optional)
@@ -76,63 +123,34 @@ class Discriminator(object):
             # tf.name_scope creates a new Name Scope with the name “embedding”. The scope adds all operations into a top-level node called “embedding” so that we get a nice hierarchy when visualizing our network in TensorBoard.
             with tf.device('/cpu:0'), tf.name_scope("embedding"):
                 # W is embedding matrix that we learn during training. We initialize it using a random uniform distribution.
-                # tf.nn.embedding_lookup creates the actual embedding operation. The result of the embedding operation is a 3-dimensional tensor of shape [None, sequence_length, embedding_size].
-                # TensorFlow’s convolutional conv2d operation expects a 4-dimensional tensor with dimensions corresponding to batch, width, height and channel. The result of the embedding doesn’t contain the channel dimension, so we add it manually, leaving us with a layer of shape [None, sequence_length, embedding_size, 1].
                 self.W = tf.Variable(tf.random_uniform([vocab_size, emb_size], -1.0, 1.0), name="W")
-                self.embedded_chars = tf.nn.embedding_lookup(self.W, self.input_x)
-                self.embedded_chars_expanded = tf.expand_dims(self.embedded_chars, -1)
 
-            # Convolution + Maxpooling for each filter size.
-            # Because each convolution produces tensors of different shapes, we need to iterate through them, create a layer for each of them and then merge the results into a big feature vector
-            pooled_outputs = []
+            # Convolution weights for each filter size.
+            # W - filter matrix. Each filter slides over the whole embedding, but varies in how many words it covers.
+            self.conv_params = []
             for filter_size, num_filter in zip(filter_sizes, num_filters):
                 with tf.name_scope(f"conv-maxpool-{filter_size}"):
-                    # Convolution layer
-                    # W - filter matrix, h - result of applying nonlinearity to convolution output. Each filter slides over the whole embedding, but varies in how many words it covers. "VALID" padding means we slide over our sentence without padding the edges, performing a narrow convolution that gives an output of shape [1, seq_len - filter_size + 1, 1, 1].
                     filter_shape = [filter_size, emb_size, 1, num_filter]
                     W = tf.Variable(tf.truncated_normal(filter_shape, stddev=0.1), name="W")
                     b = tf.Variable(tf.constant(0.1, shape=[num_filter]), name="b")
-                    conv = tf.nn.conv2d(self.embedded_chars_expanded,
-                                        W,
-                                        strides=[1, 1, 1, 1],
-                                        padding="VALID",
-                                        name="conv")
-                    # Apply non-linearity
-                    h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
-                    # Max-pooling
-                    # Performing max-pooling over the output of a specific filter size leaves us with a tensor of shape [batch_size, 1, 1, num_filters]. This is essentially a feature vector, where the last dimension corresponds to our features.
-                    pooled = tf.nn.max_pool(h,
-                                            ksize=[1, seq_len - filter_size + 1, 1, 1],
-                                            strides=[1, 1, 1, 1],
-                                            padding="VALID",
-                                            name="pool")
-                    pooled_outputs.append(pooled)
-
-            # Combine all pooled features
-            # Once we have all the pooled output tensors from each filter size we combine them into one long feature vector of shape [batch_size, num_filters_total]. Using -1 in tf.reshape tells TensorFlow to flatten the dimension when possible.
-            num_filters_total = sum(num_filters)
-            self.h_pool = tf.concat(pooled_outputs, 3)
-            self.h_pool_flat = tf.reshape(self.h_pool, [-1, num_filters_total])
+                    self.conv_params.append((W, b))
 
-            # Add highway
-            with tf.name_scope("highway"):
-                self.h_highway = highway(self.h_pool_flat, self.h_pool_flat.get_shape()[1], 1, 0)
+            # Output layer weights
+            num_filters_total = sum(num_filters)
+            with tf.name_scope("output"):
+                self.W_out = tf.Variable(tf.truncated_normal([num_filters_total, num_classes], stddev=0.1), name="W")
+                self.b_out = tf.Variable(tf.constant(0.1, shape=[num_classes]), name="b")
+                l2_loss += tf.nn.l2_loss(self.W_out)
+                l2_loss += tf.nn.l2_loss(self.b_out)
 
-            # Add dropout
-            with tf.name_scope("dropout"):
-                self.h_drop = tf.nn.dropout(self.h_highway, self.dropout_keep_prob)
+            # Highway weights, relu and no gate bias
+            self.highway_params = highway_params(num_filters_total, highway_layers)
+            self.highway_bias = 0.0
 
             # Final (unnormalized) scores and predictions
-            with tf.name_scope("output"):
-                W = tf.Variable(tf.truncated_normal([num_filters_total, num_classes], stddev=0.1), name="W")
-                b = tf.Variable(tf.constant(0.1, shape=[num_classes]), name="b")
-                l2_loss += tf.nn.l2_loss(W)
-                l2_loss += tf.nn.l2_loss(b)
-                # Using the feature vector from max-pooling (with dropout applied) we can generate predictions by doing a matrix multiplication and picking the class with the highest score.
-                # tf.nn.xw_plus_b is a convenience wrapper to perform the Wx + b matrix multiplication.
-                self.scores = tf.nn.xw_plus_b(self.h_drop, W, b, name="scores")
-                self.ypred_for_auc = tf.nn.softmax(self.scores)
-                self.predictions = tf.argmax(self.scores, 1, name="predictions")
+            self.scores = self.build_scores(self.input_x, self.dropout_keep_prob)
+            self.ypred_for_auc = tf.nn.softmax(self.scores)
+            self.predictions = tf.argmax(self.scores, 1, name="predictions")
 
             # Calculate mean cross-entropy loss
             with tf.name_scope("loss"):
@@ -141,6 +159,103 @@ class Discriminator(object):
                 self.loss = tf.reduce_mean(losses) + l2_reg_lambda + l2_loss
 
             self.params = [param for param in tf.trainable_variables() if 'discriminator' in param.name]
+            # Counts training steps, anything derived from the weights (e.g. cached rewards) is stale once it moves
+            self.global_step = tf.Variable(0, trainable=False, name="global_step")
             d_optimizer = tf.train.AdamOptimizer(1e-4)
             grads_and_vars = d_optimizer.compute_gradients(self.loss, self.params, aggregation_method=2)
-            self.train_op = d_optimizer.apply_gradients(grads_and_vars)
+            self.train_op = d_optimizer.apply_gradients(grads_and_vars, global_step=self.global_step)
+
+    def build_scores(self, input_x, dropout_keep_prob):
+        """Builds the conv stack on input_x, a [batch, seq_len] int32 tensor, and returns the unnormalized class scores."""
+        # tf.nn.embedding_lookup creates the actual embedding operation. The result of the embedding operation is a 3-dimensional tensor of shape [None, sequence_length, embedding_size].
+        # TensorFlow’s convolutional conv2d operation expects a 4-dimensional tensor with dimensions corresponding to batch, width, height and channel. The result of the embedding doesn’t contain the channel dimension, so conv_features adds it, leaving it with a layer of shape [None, sequence_length, embedding_size, 1].
+        with tf.device('/cpu:0'), tf.name_scope("embedding"):
+            embedded_chars = tf.nn.embedding_lookup(self.W, input_x)
+
+        if self.fused_conv:
+            h_pool_flat = self.fused_conv_features(embedded_chars)
+        else:
+            h_pool_flat = self.conv_features(tf.expand_dims(embedded_chars, -1))
+
+        # Add highway
+        with tf.name_scope("highway"):
+            h_highway = highway(h_pool_flat, self.highway_params, self.highway_bias)
+
+        # Add dropout
+        with tf.name_scope("dropout"):
+            h_drop = tf.nn.dropout(h_highway, dropout_keep_prob)
+
+        with tf.name_scope("output"):
+            # Using the feature vector from max-pooling (with dropout applied) we can generate predictions by doing a matrix multiplication and picking the class with the highest score.
+            # tf.nn.xw_plus_b is a convenience wrapper to perform the Wx + b matrix multiplication.
+            scores = tf.nn.xw_plus_b(h_drop, self.W_out, self.b_out, name="scores")
+
+        return scores
+
+    def conv_features(self, embedded_chars_expanded):
+        """One conv2d + max-pool branch per filter size, [batch, num_filters_total] features."""
+        # Convolution + Maxpooling for each filter size.
+        # Because each convolution produces tensors of different shapes, we need to iterate through them, create a layer for each of them and then merge the results into a big feature vector
+        pooled_outputs = []
+        for filter_size, (W, b) in zip(self.filter_sizes, self.conv_params):
+            with tf.name_scope(f"conv-maxpool-{filter_size}"):
+                # Convolution layer
+                # h - result of applying nonlinearity to convolution output. "VALID" padding means we slide over our sentence without padding the edges, performing a narrow convolution that gives an output of shape [1, seq_len - filter_size + 1, 1, 1].
+                conv = tf.nn.conv2d(embedded_chars_expanded,
+                                    W,
+                                    strides=[1, 1, 1, 1],
+                                    padding="VALID",
+                                    name="conv")
+                # Apply non-linearity
+                h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
+                # Max-pooling
+                # Performing max-pooling over the output of a specific filter size leaves us with a tensor of shape [batch_size, 1, 1, num_filters]. This is essentially a feature vector, where the last dimension corresponds to our features.
+                pooled = tf.nn.max_pool(h,
+                                        ksize=[1, self.seq_len - filter_size + 1, 1, 1],
+                                        strides=[1, 1, 1, 1],
+                                        padding="VALID",
+                                        name="pool")
+                pooled_outputs.append(pooled)
+
+        # Combine all pooled features
+        # Once we have all the pooled output tensors from each filter size we combine them into one long feature vector of shape [batch_size, num_filters_total]. Using -1 in tf.reshape tells TensorFlow to flatten the dimension when possible.
+        num_filters_total = sum(self.num_filters)
+        h_pool = tf.concat(pooled_outputs, 3)
+        return tf.reshape(h_pool, [-1, num_filters_total])
+
+    def fused_conv_features(self, embedded_chars):
+        """Same features as conv_features with one conv1d + max per bucket of filter sizes."""
+        pooled_outputs = []
+        for bucket in self.conv_buckets:
+            W, b = self.bucket_kernel(bucket)
+            pooled_outputs.append(self.bucket_features(embedded_chars, bucket, W, b))
+        return tf.concat(pooled_outputs, 1)
+
+    def bucket_kernel(self, bucket):
+        # Kernels zero-padded at the end to the widest filter and stacked along the output channels, max_width x emb_size x filters
+        max_width = max(self.filter_sizes[k] for k in bucket)
+        W = tf.concat([tf.pad(self.conv_params[k][0][:, :, 0, :], [[0, max_width - self.filter_sizes[k]], [0, 0], [0, 0]])
+                       for k in bucket], 2)
+        b = tf.concat([self.conv_params[k][1] for k in bucket], 0)
+        return W, b
+
+    def bucket_features(self, embedded_chars, bucket, W, b):
+        # Max-pooled ReLU features [batch, filters] of one bucket, computed in the dtype of embedded_chars and W
+        widths = [self.filter_sizes[k] for k in bucket]
+        min_width, max_width = min(widths), max(widths)
+        with tf.name_scope(f"conv-maxpool-{min_width}-{max_width}"):
+            # Zero rows after the sentence, so every output position of the narrowest filter is computed
+            inputs = tf.pad(embedded_chars, [[0, 0], [0, max_width - min_width], [0, 0]])
+            # batch x (seq_len - min_width + 1) x filters
+            h = tf.nn.relu(tf.nn.bias_add(tf.nn.conv1d(inputs, W, stride=1, padding="VALID"), b))
+            # Positions past the end of the sentence for a filter are zeroed, the ReLU output is never negative so the max is unchanged
+            positions = np.arange(self.seq_len - min_width + 1)[:, np.newaxis]
+            mask = np.concatenate([np.broadcast_to(positions <= self.seq_len - self.filter_sizes[k], [len(positions), self.num_filters[k]])
+                                   for k in bucket], 1)
+            return tf.reduce_max(h * tf.constant(mask, dtype=h.dtype), 1)
+
+    def build_reward(self, input_x):
+        """Positive-class probability for each row of an existing int32 tensor, sharing this discriminator's weights with dropout disabled."""
+        with tf.variable_scope('discriminator', reuse=True):
+            scores = self.build_scores(input_x, 1.0)
+        return tf.nn.softmax(scores)[:, 1]
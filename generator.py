@@ -6,9 +6,17 @@ import tensorflow as tf
 import numpy as np
 # Get to know use of these functions
 from tensorflow.python.ops import tensor_array_ops, control_flow_ops
+from lstm_cell import lstm_unit, zero_state
+from sampling import sample_from_logits, token_prob
 
 class Generator(object):
-    def __init__(self, emb_num, batch_size, emb_dim, hidden_dim, seq_len, start_token, lr=0.01, reward_gamma=0.95):
+    # softmax – 'full' (exact), 'sampled' (sampled softmax training loss with num_sampled candidates drawn from a
+    #   log-uniform distribution, which assumes ids sorted by decreasing frequency as create_vocabulary writes them)
+    #   or 'adaptive' (frequency clusters split at cutoffs, rarer clusters get smaller projections)
+    # temperature, top_k, top_p – Sampling settings, see sampling.sample_from_logits
+    # track_probs – Also record the probability of every sampled token in gen_o
+    def __init__(self, emb_num, batch_size, emb_dim, hidden_dim, seq_len, start_token, lr=0.01, reward_gamma=0.95, input_x=None,
+                 softmax='full', num_sampled=64, cutoffs=(2000, 10000), temperature=1.0, top_k=0, top_p=1.0, track_probs=False):
         self.emb_num = emb_num
         self.batch_size = batch_size
         self.emb_dim = emb_dim
@@ -19,9 +27,15 @@ class Generator(object):
         self.reward_gamma = reward_gamma
         self.g_params = []
         self.d_params = []
-        # What are these variables for?
-        self.temperature = 1.0
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.track_probs = track_probs
         self.grad_clip = 5.0
+        self.softmax = softmax
+        self.num_sampled = num_sampled
+        # Cluster boundaries, the last cluster ends at the vocabulary size
+        self.cutoffs = [cutoff for cutoff in cutoffs if cutoff < self.emb_num] + [self.emb_num]
 
         self.expected_reward = tf.Variable(tf.zeros([self.seq_len]))
 
@@ -35,8 +49,11 @@ class Generator(object):
             self.g_output_unit = self.create_output_unit(self.g_params)
 
         # Placeholders
-        # Sequence of tokens generated by generator
-        self.x = tf.placeholder(tf.int32, shape=[self.batch_size, self.seq_len])
+        # Sequence of tokens generated by generator, read from input_x (e.g. a tf.data iterator) unless fed
+        if input_x is None:
+            self.x = tf.placeholder(tf.int32, shape=[self.batch_size, self.seq_len])
+        else:
+            self.x = tf.placeholder_with_default(input_x, shape=[self.batch_size, self.seq_len])
         # Rewards will come from rollout policy and discriminator as discussed in paper
         self.rewards = tf.placeholder(tf.float32, shape=[self.batch_size, self.seq_len])
 
@@ -46,8 +63,12 @@ class Generator(object):
             self.processed_x = tf.transpose(tf.nn.embedding_lookup(self.g_emb, self.x), perm=[1, 0, 2])
 
         # Initial states
-        self.h0 = tf.zeros([self.batch_size, self.hidden_dim])
-        self.h0 = tf.stack([self.h0, self.h0])
+        self.h0 = zero_state(self.batch_size, self.hidden_dim)
+
+        # Rows sampled per run of gen_x, batch_size unless fed, so generation is not tied to the training batch
+        self.gen_num = tf.placeholder_with_default(self.batch_size, shape=[])
+        gen_start_token = tf.fill([self.gen_num], start_token)
+        gen_h0 = zero_state(self.gen_num, self.hidden_dim)
 
         # gen_o is in float because it stores probability, gen_x stores token values which are integers
         gen_o = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len, dynamic_size=False, infer_shape=True)
@@ -59,13 +80,13 @@ class Generator(object):
             h_t = self.g_recurrent_unit(x_t, h_tm1)
             # batch x vocabulary
             o_t = self.g_output_unit(h_t)
-            log_prob = tf.log(tf.nn.softmax(o_t))
-            # Generates next sequence of data through multinomial distribution and casts to integer values
-            next_token = tf.cast(tf.reshape(tf.multinomial(log_prob, 1), [self.batch_size]), tf.int32)
+            # Generates next sequence of data through multinomial distribution straight from the logits
+            next_token = sample_from_logits(o_t, self.temperature, self.top_k, self.top_p)
             # Embeddings for next token (batch x emb_dim)
             x_tp1 = tf.nn.embedding_lookup(self.g_emb, next_token)
-            # Save probability of the select token ([batch_size])
-            gen_o = gen_o.write(i, tf.reduce_sum(tf.multiply(tf.one_hot(next_token, self.emb_num, 1.0, 0.0), tf.nn.softmax(o_t)), 1))
+            # Save probability of the select token ([batch_size]), only when asked for
+            if self.track_probs:
+                gen_o = gen_o.write(i, token_prob(o_t, next_token))
             # Save token generated - indices, batch_size
             gen_x = gen_x.write(i, next_token)
             return i+1, x_tp1, h_t, gen_o, gen_x
@@ -74,43 +95,43 @@ class Generator(object):
         _, _, _, self.gen_o, self.gen_x = control_flow_ops.while_loop(
             cond=lambda i, _1, _2, _3, _4: i < self.seq_len,
             body=g_recurrence,
-            loop_vars=(tf.constant(0, dtype=tf.int32), tf.nn.embedding_lookup(self.g_emb, self.start_token), self.h0, gen_o, gen_x)
+            loop_vars=(tf.constant(0, dtype=tf.int32), tf.nn.embedding_lookup(self.g_emb, gen_start_token), gen_h0, gen_o, gen_x)
         )
 
         # seq_length x batch_size
         self.gen_x = self.gen_x.stack()
         # batch_size x seq_length
         self.gen_x = tf.transpose(self.gen_x, perm=[1, 0])
+        self.gen_o = tf.transpose(self.gen_o.stack(), perm=[1, 0]) if self.track_probs else None
 
         # Supervised pretraining for generator
-        g_pred = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len, dynamic_size=False, infer_shape=True)
+        g_log_prob = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len, dynamic_size=False, infer_shape=True)
         ta_emb_x = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len)
         # embedded x : seq * batch_size *  emb_size
         ta_emb_x = ta_emb_x.unstack(self.processed_x)
+        ta_x = tensor_array_ops.TensorArray(dtype=tf.int32, size=self.seq_len)
+        ta_x = ta_x.unstack(tf.transpose(self.x, perm=[1, 0]))
 
-        def pretrain_recurrence(i, x_t, h_tm1, g_pred):
+        def pretrain_recurrence(i, x_t, h_tm1, g_log_prob):
             h_t = self.g_recurrent_unit(x_t, h_tm1)
             o_t = self.g_output_unit(h_t)
-            # batch x vocabulary_size
-            g_pred = g_pred.write(i, tf.nn.softmax(o_t))
+            # Log-probability of the target token only (batch), the full softmax is never stored
+            log_prob = self.target_log_prob(h_t, ta_x.read(i))
+            # Same floor as clipping the probability to 1e-20
+            g_log_prob = g_log_prob.write(i, tf.maximum(log_prob, np.log(1e-20)))
             x_tp1 = ta_emb_x.read(i)
-            return i+1, x_tp1, h_t, g_pred
+            return i+1, x_tp1, h_t, g_log_prob
 
-        _, _, _, self.g_pred = control_flow_ops.while_loop(
+        _, _, _, self.g_log_prob = control_flow_ops.while_loop(
             cond=lambda i, _1, _2, _3: i < self.seq_len,
             body=pretrain_recurrence,
-            loop_vars=(tf.constant(0, dtype=tf.int32), tf.nn.embedding_lookup(self.g_emb, self.start_token), self.h0, g_pred)
+            loop_vars=(tf.constant(0, dtype=tf.int32), tf.nn.embedding_lookup(self.g_emb, self.start_token), self.h0, g_log_prob)
         )
-        # batch_size x seq_length x vocab_size
-        self.g_pred = tf.transpose(self.g_pred.stack(), perm=[1, 0, 2])
+        # batch_size x seq_length
+        self.g_log_prob = tf.transpose(self.g_log_prob.stack(), perm=[1, 0])
 
         # pretraining loss
-        self.pretrain_loss = -tf.reduce_sum(
-                                tf.one_hot(
-                                tf.to_int32(
-                                tf.reshape(self.x, [-1])), self.emb_num, 1.0, 0.0) * tf.log(
-                                tf.clip_by_value(
-                                tf.reshape(self.g_pred, [-1, self.emb_num]), 1e-20, 1.0)))/(self.seq_len*self.batch_size)
+        self.pretrain_loss = -tf.reduce_sum(self.g_log_prob)/(self.seq_len*self.batch_size)
 
         # training updates
         pretrain_opt = self.g_optimizer(self.lr)
@@ -119,25 +140,23 @@ class Generator(object):
         self.pretrain_updates = pretrain_opt.apply_gradients(list(zip(self.pretrain_grad, self.g_params)))
 
         # UNSUPERVISED LEARNING
-        self.g_loss = -tf.reduce_sum(
-                        tf.reduce_sum(
-                        tf.one_hot(
-                        tf.to_int32(
-                        tf.reshape(self.x, [-1])), self.emb_num, 1.0, 0.0) * tf.log(
-                        tf.clip_by_value(
-                        tf.reshape(self.g_pred, [-1, self.emb_num]), 1e-20, 1.0)), 1) * tf.reshape(self.rewards, [-1]))
+        self.g_loss = -tf.reduce_sum(self.g_log_prob * self.rewards)
 
         g_opt = self.g_optimizer(self.lr)
 
         self.g_grad, _ = tf.clip_by_global_norm(tf.gradients(self.g_loss, self.g_params), self.grad_clip)
         self.g_updates = g_opt.apply_gradients(list(zip(self.g_grad, self.g_params)))
 
-    def generate(self, sess):
-        outputs = sess.run(self.gen_x)
+    def generate(self, sess, num_samples=None):
+        # num_samples x seq_len tokens in one run, batch_size rows by default
+        feed = {} if num_samples is None else {self.gen_num: num_samples}
+        outputs = sess.run(self.gen_x, feed_dict=feed)
         return outputs
 
-    def pretrain_step(self, sess, x):
-        outputs = sess.run([self.pretrain_updates, self.pretrain_loss], feed_dict={self.x: x})
+    def pretrain_step(self, sess, x=None):
+        # Without x the batch comes from the input_x tensor given at construction
+        feed_dict = {} if x is None else {self.x: x}
+        outputs = sess.run([self.pretrain_updates, self.pretrain_loss], feed_dict=feed_dict)
         return outputs
 
     def init_matrix(self, shape):
@@ -147,60 +166,92 @@ class Generator(object):
         return tf.zeros(shape)
 
     def create_lstm_unit(self, params):
-        # Weights and bias for input, forget, output and carry gates
-        self.W_i = tf.Variable(self.init_matrix([self.emb_dim, self.hidden_dim]))
-        self.U_i = tf.Variable(self.init_matrix([self.hidden_dim, self.hidden_dim]))
-        self.b_i = tf.Variable(self.init_matrix([self.hidden_dim]))
-
-        self.W_f = tf.Variable(self.init_matrix([self.emb_dim, self.hidden_dim]))
-        self.U_f = tf.Variable(self.init_matrix([self.hidden_dim, self.hidden_dim]))
-        self.b_f = tf.Variable(self.init_matrix([self.hidden_dim]))
-
-        self.W_o = tf.Variable(self.init_matrix([self.emb_dim, self.hidden_dim]))
-        self.U_o = tf.Variable(self.init_matrix([self.hidden_dim, self.hidden_dim]))
-        self.b_o = tf.Variable(self.init_matrix([self.hidden_dim]))
-
-        self.W_c = tf.Variable(self.init_matrix([self.emb_dim, self.hidden_dim]))
-        self.U_c = tf.Variable(self.init_matrix([self.hidden_dim, self.hidden_dim]))
-        self.b_c = tf.Variable(self.init_matrix([self.hidden_dim]))
-
-        params.extend([
-                        self.W_i, self.U_i, self.b_i,
-                        self.W_f, self.U_f, self.b_f,
-                        self.W_o, self.U_o, self.b_o,
-                        self.W_c, self.U_c, self.b_c])
-
-        def unit(x, hidden_mem_tm1):
-            prev_hidden_state, c_prev = tf.unstack(hidden_mem_tm1)
-            # Input gate
-            i = tf.sigmoid(tf.matmul(x, self.W_i) + tf.matmul(prev_hidden_state, self.U_i) + self.b_i)
-            # Forget Gate
-            f = tf.sigmoid(tf.matmul(x, self.W_f) + tf.matmul(prev_hidden_state, self.U_f) + self.b_f)
-            # Output Gate
-            o = tf.sigmoid(tf.matmul(x, self.W_o) + tf.matmul(prev_hidden_state, self.U_o) + self.b_o)
-            # New Memory Cell
-            c_ = tf.nn.tanh(tf.matmul(x, self.W_c) + tf.matmul(prev_hidden_state, self.U_c) + self.b_c)
-            # Final Memory cell
-            c = f*c_prev + i*c_
-            # Current Hidden state
-            current_hidden_state = o * tf.nn.tanh(c)
-
-            return tf.stack([current_hidden_state, c])
+        # Fused weights and bias of the input, forget, output and carry gates, see lstm_cell
+        self.W_lstm = tf.Variable(self.init_matrix([self.emb_dim + self.hidden_dim, 4 * self.hidden_dim]))
+        self.b_lstm = tf.Variable(self.init_matrix([4 * self.hidden_dim]))
+        params.extend([self.W_lstm, self.b_lstm])
 
-        return unit
+        return lstm_unit(self.W_lstm, self.b_lstm)
 
     def create_output_unit(self, params):
-        self.Wo = tf.Variable(self.init_matrix([self.hidden_dim, self.emb_num]))
-        self.bo = tf.Variable(self.init_matrix([self.emb_num]))
-        params.extend([self.Wo, self.bo])
-
+        if self.softmax == 'adaptive':
+            self.output_params = self.create_adaptive_params()
+        else:
+            self.Wo = tf.Variable(self.init_matrix([self.hidden_dim, self.emb_num]))
+            self.bo = tf.Variable(self.init_matrix([self.emb_num]))
+            self.output_params = [self.Wo, self.bo]
+            # vocab x hidden_dim, the layout sampled_softmax_loss expects
+            self.Wo_t = tf.transpose(self.Wo)
+        params.extend(self.output_params)
+
+        return self.make_output_unit(self.output_params)
+
+    def make_output_unit(self, output_params):
+        # Also used by the rollout policy on its own copies of output_params
         def unit(hidden_mem_tuple):
-            hidden_state, c_prev = tf.unstack(hidden_mem_tuple)
+            hidden_state, c_prev = hidden_mem_tuple
             # hidden_state: batch x hidden_dim
-            logits = tf.matmul(hidden_state, self.Wo) + self.bo
+            if self.softmax == 'adaptive':
+                # Normalized log-probabilities over the whole vocabulary, usable as logits
+                return self.adaptive_log_prob(hidden_state, output_params)
+            Wo, bo = output_params
+            logits = tf.matmul(hidden_state, Wo) + bo
             return logits
 
         return unit
 
+    def target_log_prob(self, hidden_mem_tuple, labels):
+        # Log-probability of labels (batch) under the training softmax
+        hidden_state, c_prev = hidden_mem_tuple
+        if self.softmax == 'sampled':
+            return -tf.nn.sampled_softmax_loss(weights=self.Wo_t, biases=self.bo, labels=tf.to_int64(labels[:, tf.newaxis]),
+                                               inputs=hidden_state, num_sampled=self.num_sampled, num_classes=self.emb_num)
+        if self.softmax == 'adaptive':
+            return self.adaptive_target_log_prob(hidden_state, labels, self.output_params)
+        return -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=self.g_output_unit(hidden_mem_tuple))
+
+    def create_adaptive_params(self):
+        # The head scores the cutoffs[0] most frequent tokens plus one entry per tail cluster,
+        # tail cluster k goes through a hidden_dim / 4^(k+1) projection
+        num_tails = len(self.cutoffs) - 1
+        params = [tf.Variable(self.init_matrix([self.hidden_dim, self.cutoffs[0] + num_tails])),
+                  tf.Variable(self.init_matrix([self.cutoffs[0] + num_tails]))]
+        for k in range(num_tails):
+            proj_dim = max(1, self.hidden_dim // 4 ** (k + 1))
+            cluster_size = self.cutoffs[k + 1] - self.cutoffs[k]
+            params.extend([tf.Variable(self.init_matrix([self.hidden_dim, proj_dim])),
+                           tf.Variable(self.init_matrix([proj_dim, cluster_size])),
+                           tf.Variable(self.init_matrix([cluster_size]))])
+        return params
+
+    def adaptive_log_prob(self, hidden_state, output_params):
+        head_size = self.cutoffs[0]
+        head = tf.nn.log_softmax(tf.matmul(hidden_state, output_params[0]) + output_params[1])
+        log_probs = [head[:, :head_size]]
+        for k in range(len(self.cutoffs) - 1):
+            proj, W, b = output_params[2 + 3 * k: 5 + 3 * k]
+            tail = tf.nn.log_softmax(tf.matmul(tf.matmul(hidden_state, proj), W) + b)
+            log_probs.append(head[:, head_size + k:head_size + k + 1] + tail)
+        # batch x vocab
+        return tf.concat(log_probs, 1)
+
+    def adaptive_target_log_prob(self, hidden_state, labels, output_params):
+        # Only the head and the target's own cluster are evaluated, for the rows that need it
+        head_size = self.cutoffs[0]
+        batch = tf.shape(hidden_state, out_type=tf.int64)[0]
+        head = tf.nn.log_softmax(tf.matmul(hidden_state, output_params[0]) + output_params[1])
+        # 0 for head tokens, k + 1 for tokens of tail cluster k
+        cluster = tf.reduce_sum(tf.to_int32(labels[:, tf.newaxis] >= tf.constant(self.cutoffs[:-1], dtype=tf.int32)), 1)
+        head_index = tf.where(tf.equal(cluster, 0), labels, head_size + cluster - 1)
+        log_prob = tf.gather_nd(head, tf.stack([tf.range(tf.shape(labels)[0]), head_index], 1))
+        for k in range(len(self.cutoffs) - 1):
+            proj, W, b = output_params[2 + 3 * k: 5 + 3 * k]
+            rows = tf.where(tf.equal(cluster, k + 1))[:, 0]
+            tail = tf.nn.log_softmax(tf.matmul(tf.matmul(tf.gather(hidden_state, rows), proj), W) + b)
+            target = tf.gather(labels, rows) - self.cutoffs[k]
+            tail_log_prob = tf.gather_nd(tail, tf.stack([tf.range(tf.shape(target)[0]), target], 1))
+            log_prob += tf.scatter_nd(rows[:, tf.newaxis], tail_log_prob, tf.reshape(batch, [1]))
+        return log_prob
+
     def g_optimizer(self, *args, **kwargs):
         return tf.train.AdamOptimizer(*args, **kwargs)
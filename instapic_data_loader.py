@@ -10,6 +10,8 @@ from itertools import islice
 from collections import Counter
 import operator
 
+from instapic_stream import first_users, iter_posts
+
 
 NUMBER_OF_SENTENCES = 500
 MAX_SENTENCE_LEN = 20
@@ -69,11 +71,11 @@ def tokenize(sentence):
     sentence = re.sub(r'@@byeongchang', r' \\', sentence)
     return sentence
 
-def tokenize_all(train_json, key='caption'):
+def tokenize_all(train_posts, key='caption'):
     """
     Tokenize sentences in raw dataset
     Args:
-    train_json, test1_json, test2_json: raw json object
+    train_posts: (user_id, post_id, post) records, e.g. streamed by iter_posts
     key: 'caption' or 'tags'
     """
 
@@ -82,14 +84,11 @@ def tokenize_all(train_json, key='caption'):
     train_tokens = {}
 
     # Train data
-    for user_id, posts in tqdm(list(train_json.items()), ncols=70, desc="train data"):
-        train_tokens[user_id] = {}
-        for post_id, post in list(posts.items()):
-            post_tokens = tokenize(post[key])
-            post_tokens = post_tokens.split()
-            train_tokens[user_id][post_id] = post_tokens
-            for post_token in post_tokens:
-                token_counter[post_token] += 1
+    for user_id, post_id, post in tqdm(train_posts, ncols=70, desc="train data"):
+        post_tokens = tokenize(post[key])
+        post_tokens = post_tokens.split()
+        train_tokens.setdefault(user_id, {})[post_id] = post_tokens
+        token_counter.update(post_tokens)
 
     return token_counter, train_tokens
 
@@ -153,35 +152,28 @@ def main():
       format="%(log_color)s[%(levelname)s:%(asctime)s]%(reset)s %(message)s",
     )
 
-    # Load raw data
-    caption_train_json = load_json(CAPTION_TRAIN_JSON_FNAME)
-    caption_train_json_1 = take(500, caption_train_json.items())
-
-    caption_counter, caption_train_tokens = tokenize_all(caption_train_json_1, 'caption')
+    # Raw data is streamed, the vocabulary comes from the first 500 users, those without posts included
+    colorlog.info("Stream %s" % (CAPTION_TRAIN_JSON_FNAME))
+    caption_counter, caption_train_tokens = tokenize_all(first_users(iter_posts(CAPTION_TRAIN_JSON_FNAME, empty_users=True), 500), 'caption')
     caption_vocab = create_vocabulary(caption_counter, VOCAB_FILE)
 
     word_2_idx, idx_2_word = vocab_mapping()
-    post_caption_dict = {}
-    i = 0
-    for user_id, posts in caption_train_json_1.items():
-        if i < 2:
-            j = 0
-            for post_id, post in list(posts.items()):
-                if j < NUMBER_OF_SENTENCES:
-                    if post['m_id'] not in post_caption_dict:
-                        post_tokens = tokenize(post['caption'])
-                        post_caption_dict[post['m_id']] = post_tokens
-                    j += 1
-        i += 1
 
+    # Second pass over the first 2 users, writing up to NUMBER_OF_SENTENCES posts of each, every m_id once
+    seen_ids = set()
+    user_posts = Counter()
     out_file = open(REAL_TEXT, "w")
-    for _, post in post_caption_dict.items():
-        post = pad_sentences(post)
-        sep = ''
-        for word in post:
-            out_file.write(sep + str(word_2_idx[word.lower()]+1))
-            sep = ' '
-        out_file.write('\n')
+    for user_id, post_id, post in first_users(iter_posts(CAPTION_TRAIN_JSON_FNAME, empty_users=True), 2):
+        if user_posts[user_id] < NUMBER_OF_SENTENCES:
+            user_posts[user_id] += 1
+            if post['m_id'] not in seen_ids:
+                seen_ids.add(post['m_id'])
+                post = pad_sentences(tokenize(post['caption']))
+                sep = ''
+                for word in post:
+                    out_file.write(sep + str(word_2_idx[word.lower()]+1))
+                    sep = ' '
+                out_file.write('\n')
 
     out_file.close()
 
@@ -12,12 +12,20 @@ from tqdm import tqdm
 import colorlog
 from sklearn.feature_extraction.text import TfidfTransformer
 import numpy as np
+from scipy import sparse
+
+from instapic_stream import iter_posts
+from instapic_tokenizer import ParallelTokenizer
 
 # Hyperparameters
 CONTEXT_LENGTH = 100
+# Users per TF-IDF transform and top-k extraction, None does all users at once
+TFIDF_CHUNK_SIZE = 10000
 CAPTION_VOCAB_SIZE = 100000
 HASHTAG_VOCAB_SIZE = 60000
 DATA_ROOT_PATH = 'instapic'
+# Processes tokenizing posts, None uses every core
+TOKENIZE_PROCESSES = None
 
 # For dataset
 CAPTION_TRAIN_JSON_FNAME = os.path.join(
@@ -103,89 +111,96 @@ def tokenize(sentence):
     sentence = re.sub(r'@@byeongchang', r' \\', sentence)
     return sentence.split()
 
-def tokenize_all(train_json, test1_json, test2_json, key='caption'):
+def tokenize_all(train_posts, test1_posts, test2_posts, key='caption', processes=None):
     """
-    Tokenize sentences in raw dataset
+    Tokenize sentences in raw dataset, in parallel with the same tokens as tokenize (see instapic_tokenizer)
     Args:
-    train_json, test1_json, test2_json: raw json object
+    train_posts, test1_posts, test2_posts: (user_id, post_id, post) records, e.g. streamed by iter_posts
     key: 'caption' or 'tags'
+    processes: tokenizing processes, TOKENIZE_PROCESSES by default
     """
 
     colorlog.info("Tokenize %s data" % (key))
     token_counter = Counter()
-    train_tokens = {}
-    test1_tokens = {}
-    test2_tokens = {}
-
-    # Train data
-    for user_id, posts in tqdm(list(train_json.items()), ncols=70, desc="train data"):
-        train_tokens[user_id] = {}
-        for post_id, post in list(posts.items()):
-            post_tokens = tokenize(post[key])
-            train_tokens[user_id][post_id] = post_tokens
-            for post_token in post_tokens:
-                token_counter[post_token] += 1
-
-    # Test1 data
-    for user_id, posts in tqdm(list(test1_json.items()), ncols=70, desc="test1 data"):
-        test1_tokens[user_id] = {}
-        for post_id, post in list(posts.items()):
-            post_tokens = tokenize(post[key])
-            test1_tokens[user_id][post_id] = post_tokens
-
-    # Test2 data
-    for user_id, posts in tqdm(list(test2_json.items()), ncols=70, desc="test2 data"):
-        test2_tokens[user_id] = {}
-        for post_id, post in list(posts.items()):
-            post_tokens = tokenize(post[key])
-            test2_tokens[user_id][post_id] = post_tokens
+    tokenizer = ParallelTokenizer(processes or TOKENIZE_PROCESSES)
+
+    def _tokenize(posts, desc, counter=None):
+        # Only the tokens are kept, the raw posts are dropped as they stream past
+        all_tokens = {}
+        for user_id, post_id, post_tokens in tqdm(tokenizer.tokenize_posts(posts, key, counter), ncols=70, desc=desc):
+            all_tokens.setdefault(user_id, {})[post_id] = post_tokens
+        return all_tokens
+
+    # The vocabulary is counted on train data only
+    train_tokens = _tokenize(train_posts, "train data", token_counter)
+    test1_tokens = _tokenize(test1_posts, "test1 data")
+    test2_tokens = _tokenize(test2_posts, "test2 data")
+    tokenizer.close()
 
     return token_counter, train_tokens, test1_tokens, test2_tokens
 
 
-def get_tfidf_words(train_tokens, test1_tokens, test2_tokens, vocab, rev_vocab):
+def top_k_tfidf(tfidf, k):
+    """
+    Token ids of the k largest positive weights of every row of a CSR matrix, by decreasing weight and
+    increasing token id among equal weights.
+    """
+    top_ids = []
+    for i in range(tfidf.shape[0]):
+        start, end = tfidf.indptr[i], tfidf.indptr[i + 1]
+        weights, token_ids = tfidf.data[start:end], tfidf.indices[start:end]
+        positive = weights > 0.0
+        weights, token_ids = weights[positive], token_ids[positive]
+        if len(weights) > k:
+            # Everything at least as heavy as the k-th largest weight, ties at the cut included
+            kth_weight = weights[np.argpartition(-weights, k - 1)[k - 1]]
+            keep = weights >= kth_weight
+            weights, token_ids = weights[keep], token_ids[keep]
+        order = np.lexsort((token_ids, -weights))[:k]
+        top_ids.append(token_ids[order])
+    return top_ids
+
+def get_tfidf_words(train_tokens, test1_tokens, test2_tokens, vocab, rev_vocab, chunk_size=None):
     colorlog.info("Get tfidf words")
+    chunk_size = chunk_size or TFIDF_CHUNK_SIZE
     def _preprocess(all_tokens, rev_vocab):
-        counter = np.zeros([len(all_tokens), len(rev_vocab)])
+        # Sparse num_users x vocab token counts, built row by row in CSR form
+        indptr = [0]
+        indices = []
         user_ids = []
-        for i, (user_id, posts) in enumerate(tqdm(list(all_tokens.items()), ncols=70, desc="preprocess")):
+        for user_id, posts in tqdm(list(all_tokens.items()), ncols=70, desc="preprocess"):
             user_ids.append(user_id)
             for post_id, tokens in list(posts.items()):
-                token_ids = [rev_vocab.get(token, UNK_ID) for token in tokens]
-                for token_id in token_ids:
-                    counter[i, token_id] += 1
+                indices.extend(rev_vocab.get(token, UNK_ID) for token in tokens)
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.float64)
+        counter = sparse.csr_matrix((data, np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                                    shape=(len(user_ids), len(rev_vocab)))
+        # Repeated tokens of a user become one entry holding their count
+        counter.sum_duplicates()
         return counter, user_ids
 
     train_counter, train_user_ids = _preprocess(train_tokens, rev_vocab)
     test1_counter, test1_user_ids = _preprocess(test1_tokens, rev_vocab)
     test2_counter, test2_user_ids = _preprocess(test2_tokens, rev_vocab)
 
-    colorlog.info("Fit and transform train tfidf")
+    colorlog.info("Fit train tfidf")
     vectorizer = TfidfTransformer()
-    train_tfidf = vectorizer.fit_transform(train_counter).toarray()
-    test1_tfidf = vectorizer.transform(test1_counter).toarray()
-    test2_tfidf = vectorizer.transform(test2_counter).toarray()
+    vectorizer.fit(train_counter)
 
-    def _extract_tokens(tfidfs, user_ids, vocab):
+    def _extract_tokens(counter, user_ids, vocab):
+        # Transformed chunk_size users at a time, the tfidf matrices stay sparse
         user_tokens = {}
-        for i, user_id in enumerate(user_ids):
-            tfidf = np.argsort(-tfidfs[i])[:CONTEXT_LENGTH]
-            weight = np.sort(-tfidfs[i])[:CONTEXT_LENGTH]
-            tokens = []
-            for j, (index, token_weight) in enumerate(zip(tfidf, weight)):
-                token = vocab[index]
-                if token_weight < 0.0:
-                    if index != UNK_ID:
-                        tokens.append(token)
-                else:
-                    break
-            user_tokens[user_id] = tokens
+        for start in range(0, len(user_ids), chunk_size):
+            tfidf = vectorizer.transform(counter[start:start + chunk_size]).tocsr()
+            for user_id, token_ids in zip(user_ids[start:start + chunk_size], top_k_tfidf(tfidf, CONTEXT_LENGTH)):
+                user_tokens[user_id] = [vocab[index] for index in token_ids if index != UNK_ID]
         return user_tokens
 
     colorlog.info("Extract tokens from tfidf matrix")
-    train_user_tokens = _extract_tokens(train_tfidf, train_user_ids, vocab)
-    test1_user_tokens = _extract_tokens(test1_tfidf, test1_user_ids, vocab)
-    test2_user_tokens = _extract_tokens(test2_tfidf, test2_user_ids, vocab)
+    train_user_tokens = _extract_tokens(train_counter, train_user_ids, vocab)
+    test1_user_tokens = _extract_tokens(test1_counter, test1_user_ids, vocab)
+    test2_user_tokens = _extract_tokens(test2_counter, test2_user_ids, vocab)
 
     return train_user_tokens, test1_user_tokens, test2_user_tokens
 
@@ -257,25 +272,17 @@ def main():
         colorlog.info("Create directory %s" % (HASHTAG_OUTPUT_PATH))
         os.makedirs(HASHTAG_OUTPUT_PATH)
 
-    # Load raw data
-    caption_train_json = load_json(CAPTION_TRAIN_JSON_FNAME)
-    caption_test1_json = load_json(CAPTION_TEST1_JSON_FNAME)
-    caption_test2_json = load_json(CAPTION_TEST2_JSON_FNAME)
-    hashtag_train_json = load_json(HASHTAG_TRAIN_JSON_FNAME)
-    hashtag_test1_json = load_json(HASHTAG_TEST1_JSON_FNAME)
-    hashtag_test2_json = load_json(HASHTAG_TEST2_JSON_FNAME)
-
-    # Tokenize all
+    # Tokenize all, streaming the raw posts so no JSON dump is ever loaded whole
     caption_counter, caption_train_tokens, caption_test1_tokens, caption_test2_tokens = tokenize_all(
-                caption_train_json,
-                caption_test1_json,
-                caption_test2_json,
+                iter_posts(CAPTION_TRAIN_JSON_FNAME),
+                iter_posts(CAPTION_TEST1_JSON_FNAME),
+                iter_posts(CAPTION_TEST2_JSON_FNAME),
                 'caption'
                 )
     hashtag_counter, hashtag_train_tokens, hashtag_test1_tokens, hashtag_test2_tokens = tokenize_all(
-                hashtag_train_json,
-                hashtag_test1_json,
-                hashtag_test2_json,
+                iter_posts(HASHTAG_TRAIN_JSON_FNAME),
+                iter_posts(HASHTAG_TEST1_JSON_FNAME),
+                iter_posts(HASHTAG_TEST2_JSON_FNAME),
                 'tags'
                 )
 
@@ -283,37 +290,37 @@ def main():
     caption_vocab, caption_rev_vocab = create_vocabulary(caption_counter, CAPTION_VOCAB_FNAME, CAPTION_VOCAB_SIZE)
     hashtag_vocab, hashtag_rev_vocab = create_vocabulary(hashtag_counter, HASHTAG_VOCAB_FNAME, HASHTAG_VOCAB_SIZE)
 
-    # Get tfidf weighted tokens
-    # caption_train_tfidf_tokens, caption_test1_tfidf_tokens, caption_test2_tfidf_tokens = get_tfidf_words(
-    #                 caption_train_tokens,
-    #                 caption_test1_tokens,
-    #                 caption_test2_tokens,
-    #                 caption_vocab,
-    #                 caption_rev_vocab
-    #                 )
-    # hashtag_train_tfidf_tokens, hashtag_test1_tfidf_tokens, hashtag_test2_tfidf_tokens = get_tfidf_words(
-    #                 hashtag_train_tokens,
-    #                 hashtag_test1_tokens,
-    #                 hashtag_test2_tokens,
-    #                 hashtag_vocab,
-    #                 hashtag_rev_vocab
-    #                 )
-    #
-    # # Save data
-    # save_data(
-    #             (caption_train_tokens, caption_train_tfidf_tokens),
-    #             (caption_test1_tokens, caption_test1_tfidf_tokens),
-    #             (caption_test2_tokens, caption_test2_tfidf_tokens),
-    #             CAPTION_OUTPUT_PATH,
-    #             caption_rev_vocab
-    #         )
-    # save_data(
-    #             (hashtag_train_tokens, hashtag_train_tfidf_tokens),
-    #             (hashtag_test1_tokens, hashtag_test1_tfidf_tokens),
-    #             (hashtag_test2_tokens, hashtag_test2_tfidf_tokens),
-    #             HASHTAG_OUTPUT_PATH,
-    #             hashtag_rev_vocab
-    #         )
+    # Get tfidf weighted tokens, sparse and chunked by user so it fits the full dataset
+    caption_train_tfidf_tokens, caption_test1_tfidf_tokens, caption_test2_tfidf_tokens = get_tfidf_words(
+                    caption_train_tokens,
+                    caption_test1_tokens,
+                    caption_test2_tokens,
+                    caption_vocab,
+                    caption_rev_vocab
+                    )
+    hashtag_train_tfidf_tokens, hashtag_test1_tfidf_tokens, hashtag_test2_tfidf_tokens = get_tfidf_words(
+                    hashtag_train_tokens,
+                    hashtag_test1_tokens,
+                    hashtag_test2_tokens,
+                    hashtag_vocab,
+                    hashtag_rev_vocab
+                    )
+
+    # Save data
+    save_data(
+                (caption_train_tokens, caption_train_tfidf_tokens),
+                (caption_test1_tokens, caption_test1_tfidf_tokens),
+                (caption_test2_tokens, caption_test2_tfidf_tokens),
+                CAPTION_OUTPUT_PATH,
+                caption_rev_vocab
+            )
+    save_data(
+                (hashtag_train_tokens, hashtag_train_tfidf_tokens),
+                (hashtag_test1_tokens, hashtag_test1_tfidf_tokens),
+                (hashtag_test2_tokens, hashtag_test2_tfidf_tokens),
+                HASHTAG_OUTPUT_PATH,
+                hashtag_rev_vocab
+            )
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,107 @@
+'''
+Streaming reader for the InstaPic JSON dumps, {user_id: {post_id: post}}.
+iter_posts parses one post at a time out of a chunked read buffer with json.JSONDecoder.raw_decode,
+so memory stays at about one chunk plus one post however large the dump is.
+'''
+import json
+import re
+
+WHITESPACE = re.compile(r'\s*')
+
+
+class JsonStream(object):
+    """Cursor over a JSON text file that decodes values at the current position, reading more as needed."""
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        # Drops the consumed part of the buffer and appends the next chunk, False at the end of the file
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Next non-whitespace character
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON')
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}' in JSON")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_posts(json_fname, chunk_size=1 << 20, empty_users=False):
+    """
+    Yields (user_id, post_id, post) for every post of a {user_id: {post_id: post}} JSON file, in file order.
+    With empty_users, a user without posts yields one (user_id, None, None) marker so it can still be counted.
+    """
+    with open(json_fname, 'r') as f:
+        stream = JsonStream(f, chunk_size)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            user_id = stream.value()
+            stream.expect(':')
+            stream.expect('{')
+            if stream.peek() == '}':
+                stream.pos += 1
+                if empty_users:
+                    yield user_id, None, None
+            else:
+                while True:
+                    post_id = stream.value()
+                    stream.expect(':')
+                    yield user_id, post_id, stream.value()
+                    if stream.peek() != ',':
+                        break
+                    stream.pos += 1
+                stream.expect('}')
+            if stream.peek() != ',':
+                break
+            stream.pos += 1
+        stream.expect('}')
+
+
+def first_users(posts, num_users):
+    # The records of the first num_users users of a (user_id, post_id, post) stream, whose users come one after another.
+    # Users without posts only count when the stream has their markers (iter_posts(..., empty_users=True)), which are dropped
+    count = 0
+    current_user_id = None
+    for user_id, post_id, post in posts:
+        if count == 0 or user_id != current_user_id:
+            if count == num_users:
+                return
+            count += 1
+            current_user_id = user_id
+        if post_id is not None:
+            yield user_id, post_id, post
@@ -0,0 +1,97 @@
+'''
+Fast and parallel tokenization of InstaPic posts.
+tokenize_fast gives the same tokens as instapic_data_util.tokenize with fewer and cheaper passes: passes that cannot
+change the string are skipped (no '@', no backslash, no '-', nothing outside ASCII), punctuation is dropped in one
+regex, and the emoticon marker round trip (@@byeongchang) becomes a direct substitution of emoticons by a '\\' token.
+ParallelTokenizer runs it on chunks of posts in a process pool, each chunk's token counts are merged in the parent.
+'''
+import multiprocessing
+import re
+from collections import Counter
+
+EMOTICON = re.compile('[\U00002600-\U000027BF\U0001f300-\U0001f64F\U0001f680-\U0001f6FF]')
+NOT_EMOTICON = re.compile(r'(\\U([0-9A-Fa-f]){8})|(\\u([0-9A-Fa-f]){4})')
+USERNAME = re.compile(r"@[a-zA-Z0-9._]+")
+# Dropped punctuation, and backslashes that are not part of an emoticon token
+SEPARATORS = re.compile(r'[!?,.\"\\]+')
+LONE_HYPHEN = re.compile(r"(?<![a-zA-Z0-9])\-(?![a-zA-Z0-9])")
+TOKEN = re.compile(r"[a-zA-Z0-9#@'\\\-]+")
+
+
+def tokenize_fast(sentence):
+    if isinstance(sentence, list):
+        sentence = ' '.join(sentence)
+
+    sentence = sentence.replace('#', ' #').replace('@', ' @').replace('\n', ' ').lower()
+    if '@' in sentence:
+        sentence = USERNAME.sub("@username", sentence)  # change username
+    if '\\' in sentence:
+        sentence = NOT_EMOTICON.sub(' ', sentence)
+    sentence = SEPARATORS.sub(' ', sentence.replace('_', '-'))  # incorporate - and _, remove . , ! ?
+    if not sentence.isascii():
+        # Every emoticon is a token of its own
+        sentence = EMOTICON.sub(r' \\ ', sentence)
+    if '-' in sentence:
+        sentence = LONE_HYPHEN.sub('', sentence)  # remove - if there is no preceding or following
+    return TOKEN.findall(sentence)
+
+
+def tokenize_chunk(texts):
+    # Runs in the pool, returns the tokens of every text and their counts
+    counter = Counter()
+    all_tokens = []
+    for text in texts:
+        tokens = tokenize_fast(text)
+        counter.update(tokens)
+        all_tokens.append(tokens)
+    return all_tokens, counter
+
+
+class ParallelTokenizer(object):
+    """
+    processes workers (all cores by default) tokenizing chunk_size posts per task. At most max_pending chunks are
+    in flight, so a streamed input (see instapic_stream) is not read ahead without bound. With one process the
+    chunks are tokenized in this process.
+    """
+    def __init__(self, processes=None, chunk_size=1000, max_pending=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.processes
+        self.pool = multiprocessing.Pool(self.processes) if self.processes > 1 else None
+
+    def submit(self, texts):
+        # Returns a function that waits for the chunk's (tokens, counter)
+        if self.pool is None:
+            result = tokenize_chunk(texts)
+            return lambda: result
+        return self.pool.apply_async(tokenize_chunk, (texts,)).get
+
+    def tokenize_posts(self, posts, key, counter=None):
+        """Yields (user_id, post_id, tokens) for the (user_id, post_id, post) records of posts in order, adding the token counts to counter."""
+        pending = []
+
+        def finish(ids, result):
+            all_tokens, chunk_counter = result()
+            if counter is not None:
+                counter.update(chunk_counter)
+            for (user_id, post_id), tokens in zip(ids, all_tokens):
+                yield user_id, post_id, tokens
+
+        ids, texts = [], []
+        for user_id, post_id, post in posts:
+            ids.append((user_id, post_id))
+            texts.append(post[key])
+            if len(texts) == self.chunk_size:
+                pending.append((ids, self.submit(texts)))
+                ids, texts = [], []
+                if len(pending) >= self.max_pending:
+                    yield from finish(*pending.pop(0))
+        if texts:
+            pending.append((ids, self.submit(texts)))
+        for chunk_ids, result in pending:
+            yield from finish(chunk_ids, result)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
@@ -0,0 +1,112 @@
+'''
+Fused four-gate LSTM cell shared by Generator, ROLLOUT and TARGET_LSTM.
+All gates come out of one [x, h] x W matmul, W is (emb_dim + hidden_dim) x (4 * hidden_dim) with the
+gates in input, forget, output, carry order. The state is an (h, c) tuple.
+
+Older weights kept the 12 gate matrices apart (W_i, U_i, b_i, W_f, ...), convert them with
+    python lstm_cell.py pickle data/target_params_py3.pkl data/target_params_fused.pkl
+    python lstm_cell.py checkpoint <old checkpoint prefix> <new checkpoint prefix>
+'''
+import pickle
+import sys
+import numpy as np
+import tensorflow as tf
+
+def zero_state(batch_size, hidden_dim):
+    return tf.zeros([batch_size, hidden_dim]), tf.zeros([batch_size, hidden_dim])
+
+
+def lstm_unit(W, b):
+    # Maps (x_t, (h_tm1, c_tm1)) to (h_t, c_t)
+    def unit(x, hidden_memory_tm1):
+        previous_hidden_state, c_prev = hidden_memory_tm1
+        # batch x 4 * hidden_dim, pre-activations of the input, forget, output and carry gates
+        gates = tf.matmul(tf.concat([x, previous_hidden_state], 1), W) + b
+        i, f, o, c_ = tf.split(gates, 4, axis=1)
+        # Final Memory cell
+        c = tf.sigmoid(f) * c_prev + tf.sigmoid(i) * tf.nn.tanh(c_)
+        # Current Hidden state
+        current_hidden_state = tf.sigmoid(o) * tf.nn.tanh(c)
+        return current_hidden_state, c
+
+    return unit
+
+
+def fuse_lstm_params(W_i, U_i, b_i, W_f, U_f, b_f, W_o, U_o, b_o, W_c, U_c, b_c):
+    """Fused (W, b) from the 12 separate gate weights, as numpy arrays."""
+    W = np.concatenate([np.concatenate([W_i, W_f, W_o, W_c], 1),
+                        np.concatenate([U_i, U_f, U_o, U_c], 1)], 0)
+    b = np.concatenate([b_i, b_f, b_o, b_c])
+    return W, b
+
+
+def split_lstm_params(W, b, emb_dim):
+    """Inverse of fuse_lstm_params, the 12 gate weights in W_i, U_i, b_i, W_f, ... order."""
+    params = []
+    for W_gate, b_gate in zip(np.split(W, 4, axis=1), np.split(b, 4)):
+        params.extend([W_gate[:emb_dim], W_gate[emb_dim:], b_gate])
+    return params
+
+
+def fuse_model_params(params):
+    # [emb, W_i, U_i, b_i, ..., b_c, Wo, bo] -> [emb, W, b, Wo, bo], the layout of target_params
+    return [params[0], *fuse_lstm_params(*params[1:13]), *params[13:]]
+
+
+def convert_pickle(input_file, output_file):
+    with open(input_file, 'rb') as f:
+        params = pickle.load(f)
+    with open(output_file, 'wb') as f:
+        pickle.dump(fuse_model_params(params), f)
+
+
+def parse_legacy_name(name, scopes):
+    # 'generator/Variable_3/Adam_1' -> ('generator', 3, '/Adam_1'), None for variables of no model
+    for scope in scopes:
+        if not name.startswith(scope + '/Variable'):
+            continue
+        base, _, slot = name[len(scope) + 1:].partition('/')
+        if base == 'Variable':
+            return scope, 0, '/' + slot if slot else ''
+        if base.startswith('Variable_') and base[len('Variable_'):].isdigit():
+            return scope, int(base[len('Variable_'):]), '/' + slot if slot else ''
+    return None
+
+
+def convert_checkpoint(input_prefix, output_prefix, scopes=('generator', 'rollout')):
+    """
+    Rewrites a checkpoint saved before the fused cell. Under each scope the variables are the unnamed
+    tf.Variables of the model in creation order: Variable (embedding), Variable_1 ... Variable_12 (gates),
+    then the output layer. The gates become Variable_1 (W) and Variable_2 (b) and later variables shift
+    down, optimizer slots (e.g. Adam moments) are fused the same way. Everything else is copied unchanged.
+    """
+    reader = tf.train.load_checkpoint(input_prefix)
+    converted = {}
+    groups = {}
+    for name in reader.get_variable_to_shape_map():
+        parsed = parse_legacy_name(name, scopes)
+        if parsed is None:
+            converted[name] = reader.get_tensor(name)
+        else:
+            scope, k, slot = parsed
+            groups.setdefault((scope, slot), {})[k] = reader.get_tensor(name)
+    for (scope, slot), legacy in groups.items():
+        fused = fuse_model_params([legacy[k] for k in range(len(legacy))])
+        for k, value in enumerate(fused):
+            converted[f'{scope}/Variable' + (f'_{k}' if k else '') + slot] = value
+
+    with tf.Graph().as_default():
+        variables = [tf.Variable(value, name=name) for name, value in converted.items()]
+        with tf.Session() as sess:
+            sess.run(tf.variables_initializer(variables))
+            tf.train.Saver(variables).save(sess, output_prefix, write_meta_graph=False)
+
+
+if __name__ == '__main__':
+    kind, input_path, output_path = sys.argv[1:4]
+    if kind == 'pickle':
+        convert_pickle(input_path, output_path)
+    elif kind == 'checkpoint':
+        convert_checkpoint(input_path, output_path)
+    else:
+        sys.exit(f'Unknown kind {kind}, expected pickle or checkpoint')
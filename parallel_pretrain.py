@@ -0,0 +1,218 @@
+'''
+Data-parallel MLE pretraining of the generator.
+One Generator replica per entry of the host list, each training on its own shard (every world_size-th row) of the data
+file with its own optimizer state. Every sync_every steps the replicas send their parameters to the coordinator in the
+main process, which averages them and sends the average back, so the collective is a star over TCP connections.
+
+Connections are multiprocessing.connection ones authenticated with a random key of the run, so nothing is unpickled
+from a peer that does not hold it. The coordinator only listens on 127.0.0.1 when every host is local.
+
+Local hosts ('localhost', '127.0.0.1') are spawned as processes, other hosts are started over ssh with
+    ssh <host> cd <cwd> && python parallel_pretrain.py worker <coordinator host:port> <rank>
+which reads the hex key from stdin and assumes the code and the data file are at the same path on every node
+(e.g. a shared filesystem).
+'''
+import multiprocessing
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing.connection import AuthenticationError, Client, Connection, answer_challenge, deliver_challenge
+import numpy as np
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1')
+# Seconds between checks that the workers are still alive while waiting on them
+POLL_SECONDS = 1.0
+
+
+def shard(rows, rank, world_size):
+    # Worker rank's rows, the shards of all ranks are disjoint and cover every row
+    return rows[rank::world_size]
+
+
+def run_worker(coordinator_address, rank, authkey, num_threads=0):
+    # TensorFlow is imported in the worker so every local worker owns its own runtime
+    import tensorflow as tf
+    from generator import Generator
+    from token_store import load_tokens
+
+    host, port = coordinator_address.rsplit(':', 1)
+    connection = Client((host, int(port)), authkey=authkey)
+    connection.send(('hello', rank))
+    _, setup = connection.recv()
+
+    generator = Generator(**setup['generator_config'])
+    rows = shard(load_tokens(setup['data_file'], generator.seq_len), rank, setup['world_size'])
+    num_batch = len(rows) // generator.batch_size
+    connection.send(('ready', (num_batch, len(rows))))
+
+    config = tf.ConfigProto()
+    if num_threads:
+        config.intra_op_parallelism_threads = num_threads
+        config.inter_op_parallelism_threads = num_threads
+    sess = tf.Session(config=config)
+    sess.run(tf.global_variables_initializer())
+
+    pointer = 0
+    while True:
+        kind, payload = connection.recv()
+        if kind == 'stop':
+            break
+        # Start every round from the averaged parameters
+        params, num_steps = payload
+        for param, value in zip(generator.g_params, params):
+            param.load(value, sess)
+        losses = []
+        for _ in range(num_steps):
+            start = pointer * generator.batch_size
+            _, loss = generator.pretrain_step(sess, rows[start:start + generator.batch_size])
+            losses.append(loss)
+            pointer = (pointer + 1) % num_batch
+        connection.send(('params', (sess.run(generator.g_params), float(np.mean(losses)))))
+
+    sess.close()
+    connection.close()
+
+
+class DataParallelPretrainer(object):
+    """
+    Coordinator of len(hosts) pretraining workers, generator_config are the keyword arguments of the Generator
+    (the same as the one trained in the main process). An epoch is one pass over the data across all workers,
+    so with N workers each one takes 1/N of the steps of pre_train_epoch, on batch_size rows each.
+    Waiting on a worker raises RuntimeError as soon as one has exited and TimeoutError after timeout seconds.
+    """
+    def __init__(self, generator_config, data_file, hosts, sync_every=10, coordinator_host=None, port=0, timeout=600):
+        self.world_size = len(hosts)
+        self.sync_every = sync_every
+        self.timeout = timeout
+        self.authkey = os.urandom(32)
+        self.workers = []
+        self.connections = []
+        all_local = all(host in LOCAL_HOSTS for host in hosts)
+        self.server = socket.create_server(('127.0.0.1' if all_local else '', port))
+        self.server.listen(self.world_size)
+        self.server.settimeout(POLL_SECONDS)
+        port = self.server.getsockname()[1]
+
+        try:
+            num_local = sum(host in LOCAL_HOSTS for host in hosts)
+            num_threads = max(1, multiprocessing.cpu_count() // max(1, num_local))
+            # Spawn, so the children do not inherit the parent's TensorFlow runtime
+            context = multiprocessing.get_context('spawn')
+            for rank, host in enumerate(hosts):
+                if host in LOCAL_HOSTS:
+                    process = context.Process(target=run_worker, args=(f'127.0.0.1:{port}', rank, self.authkey, num_threads), daemon=True)
+                    process.start()
+                    self.workers.append((rank, host, process))
+                else:
+                    address = f'{coordinator_host or socket.getfqdn()}:{port}'
+                    command = ' '.join(shlex.quote(arg) for arg in [sys.executable, os.path.abspath(__file__), 'worker', address, str(rank)])
+                    # The key goes over stdin, not the command line that other users of the host can see
+                    remote = subprocess.Popen(['ssh', host, f'cd {shlex.quote(os.getcwd())} && {command}'], stdin=subprocess.PIPE)
+                    remote.stdin.write(self.authkey.hex().encode() + b'\n')
+                    remote.stdin.close()
+                    self.workers.append((rank, host, remote))
+
+            self.connections = self.accept_workers()
+            setup = dict(generator_config=generator_config, data_file=data_file, world_size=self.world_size)
+            for connection in self.connections:
+                connection.send(('setup', setup))
+            ready = self.receive_all()
+            # Every worker takes as many steps per epoch as the smallest shard has batches
+            self.steps_per_epoch = min(num_batch for num_batch, _ in ready)
+            self.shard_rows = [num_rows for _, num_rows in ready]
+        except BaseException:
+            self.close()
+            raise
+
+    def check_workers(self):
+        for rank, host, worker in self.workers:
+            exitcode = worker.exitcode if isinstance(worker, multiprocessing.process.BaseProcess) else worker.poll()
+            if exitcode is not None:
+                raise RuntimeError(f'Pretraining worker {rank} on {host} exited with code {exitcode}')
+
+    def accept_workers(self):
+        # Authenticated connections in rank order, connections that fail the challenge are dropped
+        connections = {}
+        deadline = time.monotonic() + self.timeout
+        while len(connections) < self.world_size:
+            try:
+                sock, _ = self.server.accept()
+            except socket.timeout:
+                self.check_workers()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Only {len(connections)} of {self.world_size} pretraining workers connected within {self.timeout} s')
+                continue
+            sock.setblocking(True)
+            connection = Connection(sock.detach())
+            try:
+                deliver_challenge(connection, self.authkey)
+                answer_challenge(connection, self.authkey)
+            except (AuthenticationError, EOFError, OSError):
+                connection.close()
+                continue
+            _, rank = connection.recv()
+            connections[rank] = connection
+        return [connections[rank] for rank in range(self.world_size)]
+
+    def receive_all(self):
+        # The payloads of one message from every worker, in rank order
+        deadline = time.monotonic() + self.timeout
+        payloads = []
+        for rank, connection in enumerate(self.connections):
+            while not connection.poll(POLL_SECONDS):
+                self.check_workers()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Pretraining worker {rank} did not reply within {self.timeout} s')
+            try:
+                payloads.append(connection.recv()[1])
+            except EOFError:
+                raise RuntimeError(f'Pretraining worker {rank} closed its connection')
+        return payloads
+
+    def train_epoch(self, sess, generator):
+        """Pretrains from generator's current parameters for one epoch, loads the averaged result back and returns the mean loss."""
+        params = sess.run(generator.g_params)
+        losses = []
+        for start in range(0, self.steps_per_epoch, self.sync_every):
+            num_steps = min(self.sync_every, self.steps_per_epoch - start)
+            for connection in self.connections:
+                connection.send(('train', (params, num_steps)))
+            replies = self.receive_all()
+            params = [np.mean(values, 0) for values in zip(*(worker_params for worker_params, _ in replies))]
+            losses.append(np.mean([loss for _, loss in replies]))
+        for param, value in zip(generator.g_params, params):
+            param.load(value, sess)
+        return np.mean(losses)
+
+    def close(self):
+        # Also cleans up after a failed start or a dead worker. The server closes first, so a worker that has not
+        # connected yet fails instead of waiting on a challenge that never comes
+        self.server.close()
+        for connection in self.connections:
+            try:
+                connection.send(('stop', None))
+            except OSError:
+                pass
+            connection.close()
+        self.connections = []
+        for _, _, worker in self.workers:
+            if isinstance(worker, multiprocessing.process.BaseProcess):
+                worker.join(self.timeout if worker.exitcode is None else None)
+                if worker.is_alive():
+                    worker.terminate()
+            else:
+                try:
+                    worker.wait(self.timeout)
+                except subprocess.TimeoutExpired:
+                    worker.terminate()
+        self.workers = []
+
+
+if __name__ == '__main__':
+    kind, coordinator_address, rank = sys.argv[1:4]
+    if kind != 'worker':
+        sys.exit(f'Unknown kind {kind}, expected worker')
+    run_worker(coordinator_address, int(rank), bytes.fromhex(sys.stdin.readline().strip()))
@@ -0,0 +1,74 @@
+'''
+Bounded producer/consumer pipeline, used to generate the next negative set while the discriminator trains on the previous one.
+The producer runs in a thread and stays at most queue_size items ahead of the consumer, which runs in the calling thread.
+The counters show which side is the bottleneck: a large consumer_wait_seconds means the consumer starves for items
+(producer bound), a large producer_wait_seconds means the queue is full (consumer bound).
+'''
+import queue
+import threading
+import time
+from tqdm import tqdm
+
+
+class Pipeline(object):
+    """Runs consume(produce()) num_items times per run() with production overlapped, items are consumed in order."""
+    def __init__(self, produce, consume, queue_size=1):
+        self.produce = produce
+        self.consume = consume
+        self.queue_size = queue_size
+        # Cumulative over all runs
+        self.counters = dict(items=0, produce_seconds=0.0, consume_seconds=0.0, producer_wait_seconds=0.0,
+                             consumer_wait_seconds=0.0, wall_seconds=0.0)
+
+    def run(self, num_items, progress=False):
+        items = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(target=self.producer_loop, args=(num_items, items, stop), daemon=True)
+        start = time.perf_counter()
+        producer.start()
+        try:
+            for _ in tqdm(range(num_items), disable=not progress):
+                wait_start = time.perf_counter()
+                ok, item = items.get()
+                self.counters['consumer_wait_seconds'] += time.perf_counter() - wait_start
+                if not ok:
+                    # The producer failed, item is its exception
+                    raise item
+                consume_start = time.perf_counter()
+                self.consume(item)
+                self.counters['consume_seconds'] += time.perf_counter() - consume_start
+                self.counters['items'] += 1
+        finally:
+            # Unblocks a producer waiting on a full queue when the consumer failed
+            stop.set()
+            producer.join()
+            self.counters['wall_seconds'] += time.perf_counter() - start
+
+    def producer_loop(self, num_items, items, stop):
+        try:
+            for _ in range(num_items):
+                if stop.is_set():
+                    return
+                produce_start = time.perf_counter()
+                item = self.produce()
+                self.counters['produce_seconds'] += time.perf_counter() - produce_start
+                self.put(items, (True, item), stop)
+        except Exception as e:
+            self.put(items, (False, e), stop)
+
+    def put(self, items, entry, stop):
+        wait_start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.counters['producer_wait_seconds'] += time.perf_counter() - wait_start
+
+    def summary(self):
+        # overlap is (produce + consume) / wall time, 1 when nothing overlapped and up to 2 when both sides were always busy
+        summary = dict(self.counters)
+        wall_seconds = summary['wall_seconds']
+        summary['overlap'] = (summary['produce_seconds'] + summary['consume_seconds']) / wall_seconds if wall_seconds else 0.0
+        return summary
@@ -0,0 +1,120 @@
+'''
+Phase timings and TensorFlow step traces for the training loop.
+Wrap each phase in `with profiler.phase('name'):` and write profiler.summary() to the log now and then.
+Run the session through profiler.session(sess) and every sess.run of a traced iteration is saved as a Chrome
+trace (open chrome://tracing and load the file).
+Phases may also be opened in other threads (e.g. a pipeline's producer), they nest under the phases the thread that
+created the profiler has open, so overlapping phases can add up to more than their parent.
+'''
+import contextlib
+import json
+import os
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+PERCENTILES = [50, 90, 99]
+
+
+class ProfiledSession(object):
+    """Session proxy that records a full trace of every run while the profiler is tracing."""
+    def __init__(self, sess, profiler):
+        self.sess = sess
+        self.profiler = profiler
+
+    def run(self, fetches, feed_dict=None, options=None, run_metadata=None):
+        if not self.profiler.tracing() or options is not None or run_metadata is not None:
+            return self.sess.run(fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+        run_metadata = tf.RunMetadata()
+        # TensorFlow traces one run at a time, so traced runs from several threads take turns
+        with self.profiler.trace_lock:
+            result = self.sess.run(fetches, feed_dict=feed_dict, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                                   run_metadata=run_metadata)
+        self.profiler.save_trace(run_metadata)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.sess, name)
+
+
+class Profiler(object):
+    """
+    Wall time per phase, accumulated across calls. Iterations listed in trace_iterations (see start_iteration)
+    are traced into trace_dir, one Chrome trace JSON file per sess.run.
+    """
+    def __init__(self, trace_dir=None, trace_iterations=()):
+        self.trace_dir = trace_dir
+        self.trace_iterations = set(trace_iterations)
+        self.timings = {}
+        self.phases = []
+        self.thread_phases = threading.local()
+        self.main_thread = threading.get_ident()
+        # Guards timings and trace_count, which several threads update
+        self.lock = threading.Lock()
+        self.trace_lock = threading.Lock()
+        self.iteration = None
+        self.trace_count = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Nested phases are recorded under their full path, e.g. 'adversarial/rollout'
+        if threading.get_ident() == self.main_thread:
+            phases, parents = self.phases, []
+        else:
+            if not hasattr(self.thread_phases, 'phases'):
+                self.thread_phases.phases = []
+            phases, parents = self.thread_phases.phases, list(self.phases)
+        phases.append(name)
+        path = '/'.join(parents + phases)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.timings.setdefault(path, []).append(elapsed)
+            phases.pop()
+
+    def session(self, sess):
+        return ProfiledSession(sess, self)
+
+    def start_iteration(self, iteration):
+        self.iteration = iteration
+        self.trace_count = 0
+
+    def tracing(self):
+        return self.trace_dir is not None and self.iteration in self.trace_iterations
+
+    def save_trace(self, run_metadata):
+        with self.lock:
+            trace_count = self.trace_count
+            self.trace_count += 1
+        os.makedirs(self.trace_dir, exist_ok=True)
+        trace_file = os.path.join(self.trace_dir, f'iteration-{self.iteration}-run-{trace_count}.json')
+        with open(trace_file, 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+
+    def summary(self):
+        """Per phase call count, total and mean seconds, percentiles and max, in first-seen order."""
+        summary = {}
+        with self.lock:
+            timings = {path: list(times) for path, times in self.timings.items()}
+        for path, times in timings.items():
+            times = np.asarray(times)
+            stats = dict(calls=len(times), total=float(times.sum()), mean=float(times.mean()))
+            for percentile, value in zip(PERCENTILES, np.percentile(times, PERCENTILES)):
+                stats[f'p{percentile}'] = float(value)
+            stats['max'] = float(times.max())
+            summary[path] = stats
+        return summary
+
+    def write(self, log, label):
+        # One JSON object per line, so the log can be grepped for 'Profile' and parsed
+        log.write(f"Profile:\t{json.dumps(dict(label=label, phases=self.summary()))}\n")
+        log.flush()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
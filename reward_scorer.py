@@ -0,0 +1,88 @@
+'''
+Inference-only copy of the Discriminator for scoring rollouts.
+The scorer keeps its own snapshot of the discriminator weights, taken by refresh(), with the embedding and the
+convolution filters stored in reduced precision. There is no dropout, loss or optimizer in its graph.
+    float32   exact copy
+    bfloat16, float16   embedding and filters stored and convolved in that dtype
+    int8   embedding and filters quantized with one scale per embedding row / output channel,
+           dequantized to float32 before the convolution (smaller weights, float32 arithmetic)
+The highway and output layers stay in float32.
+'''
+import tensorflow as tf
+from discriminator import highway
+
+PRECISIONS = ('float32', 'bfloat16', 'float16', 'int8')
+
+
+class RewardScorer(object):
+    def __init__(self, discriminator, precision='bfloat16'):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+        self.discriminator = discriminator
+        self.precision = precision
+        self.compute_dtype = tf.float32 if precision in ('float32', 'int8') else tf.as_dtype(precision)
+
+        self.params = []
+        self.updates = []
+        with tf.variable_scope('reward_scorer'):
+            # Embedding, one int8 scale per row
+            self.emb = self.snapshot(discriminator.W, reduced=True, scale_axes=[1])
+            # Padded kernels of the discriminator's conv buckets, one int8 scale per output channel
+            self.conv_params = []
+            for bucket in discriminator.conv_buckets:
+                W, b = discriminator.bucket_kernel(bucket)
+                self.conv_params.append((self.snapshot(W, reduced=True, scale_axes=[0, 1]), self.snapshot(b)))
+            # Every highway layer, as (transform matrix, transform bias, gate matrix, gate bias)
+            self.highway_params = [[self.snapshot(value)[0] for value in layer] for layer in discriminator.highway_params]
+            self.W_out = self.snapshot(discriminator.W_out)
+            self.b_out = self.snapshot(discriminator.b_out)
+            # Discriminator step the snapshot was taken at
+            self.global_step = tf.Variable(0, trainable=False, name="global_step")
+            self.params.append(self.global_step)
+            self.updates.append(tf.assign(self.global_step, discriminator.global_step))
+        # Copies the discriminator's current weights, run after every discriminator training phase
+        self.refresh_op = tf.group(*self.updates)
+
+    def snapshot(self, value, reduced=False, scale_axes=None):
+        # Non-trainable copy of value written by refresh_op, as (weights, int8 scale or None)
+        if not reduced or self.precision == 'float32':
+            var = tf.Variable(tf.zeros(value.shape), trainable=False)
+            self.params.append(var)
+            self.updates.append(tf.assign(var, value))
+            return var, None
+        if self.precision == 'int8':
+            scale = tf.maximum(tf.reduce_max(tf.abs(value), axis=scale_axes, keepdims=True), 1e-12) / 127.0
+            var = tf.Variable(tf.zeros(value.shape, dtype=tf.int8), trainable=False)
+            scale_var = tf.Variable(tf.ones(scale.shape), trainable=False)
+            self.params.extend([var, scale_var])
+            self.updates.extend([tf.assign(var, tf.cast(tf.round(value / scale), tf.int8)), tf.assign(scale_var, scale)])
+            return var, scale_var
+        var = tf.Variable(tf.zeros(value.shape, dtype=self.compute_dtype), trainable=False)
+        self.params.append(var)
+        self.updates.append(tf.assign(var, tf.cast(value, self.compute_dtype)))
+        return var, None
+
+    def refresh(self, sess):
+        sess.run(self.refresh_op)
+
+    def build_reward(self, input_x):
+        """Positive-class probability for each row of an int32 [batch, seq_len] tensor, like Discriminator.build_reward."""
+        with tf.name_scope('reward_scorer'):
+            emb, emb_scale = self.emb
+            embedded_chars = tf.nn.embedding_lookup(emb, input_x)
+            if emb_scale is not None:
+                embedded_chars = tf.cast(embedded_chars, tf.float32) * tf.nn.embedding_lookup(emb_scale, input_x)
+
+            pooled_outputs = []
+            for bucket, ((W, W_scale), (b, _)) in zip(self.discriminator.conv_buckets, self.conv_params):
+                if W_scale is not None:
+                    W = tf.cast(W, tf.float32) * W_scale
+                pooled = self.discriminator.bucket_features(embedded_chars, bucket, W, tf.cast(b, self.compute_dtype))
+                pooled_outputs.append(tf.cast(pooled, tf.float32))
+            h_pool_flat = tf.concat(pooled_outputs, 1)
+
+            # Same highway as Discriminator.build_scores
+            h_highway = highway(h_pool_flat, self.highway_params, self.discriminator.highway_bias)
+
+            scores = tf.nn.xw_plus_b(h_highway, self.W_out[0], self.b_out[0])
+            return tf.nn.softmax(scores)[:, 1]
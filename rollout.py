@@ -1,9 +1,58 @@
 import tensorflow as tf
 import numpy as np
+from collections import OrderedDict
 from tensorflow.python.ops import tensor_array_ops, control_flow_ops
+from lstm_cell import lstm_unit, zero_state
+from sampling import sample_from_logits
+
+class RewardCache(object):
+    """
+    LRU map from complete token sequences (their bytes) to discriminator rewards, holding at most max_size entries.
+    Entries belong to one discriminator global_step, sync() drops them all when the step moves.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.step = None
+        # rows served from the cache, rows looked up and missing, rows actually scored (misses deduplicated)
+        self.hits = 0
+        self.misses = 0
+        self.scored = 0
+        self.invalidations = 0
+
+    def sync(self, step):
+        if step != self.step:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.step = step
+
+    def lookup(self, keys):
+        # Rewards for keys, NaN where missing
+        rewards = np.full(len(keys), np.nan)
+        for n, key in enumerate(keys):
+            reward = self.entries.get(key)
+            if reward is not None:
+                self.entries.move_to_end(key)
+                rewards[n] = reward
+        found = int(np.count_nonzero(~np.isnan(rewards)))
+        self.hits += found
+        self.misses += len(keys) - found
+        return rewards
+
+    def insert(self, keys, rewards):
+        self.scored += len(keys)
+        for key, reward in zip(keys, rewards):
+            self.entries[key] = reward
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
 
 class ROLLOUT(object):
-    def __init__(self, lstm, update_rate):
+    def __init__(self, lstm, update_rate, reward_cache_size=0):
         self.lstm = lstm
         self.update_rate = update_rate
 
@@ -15,11 +64,24 @@ class ROLLOUT(object):
         self.start_token = tf.identity(self.lstm.start_token)
         self.lr = self.lstm.lr
 
-        self.g_emb = tf.identity(self.lstm.g_emb)
-        # maps h_tm1 to h_t for generator
-        self.g_recurrent_unit = self.create_recurrent_unit()
-        # maps h_t to o_t
-        self.g_output_unit = self.create_output_unit()
+        # Reward tensors built on top of batch_gen_x, one set per discriminator
+        self.reward_graphs = {}
+        # With a cache, completed rows are fetched and only the ones not seen since the discriminator last trained are scored
+        self.reward_cache = RewardCache(reward_cache_size) if reward_cache_size > 0 else None
+        self.score_x = tf.placeholder(tf.int32, shape=[None, self.seq_len])
+        self.score_graphs = {}
+
+        # The rollout policy keeps its own copy of the generator weights, delayed by update_rate
+        self.params = []
+        self.lstm_params = []
+        with tf.variable_scope('rollout'):
+            self.g_emb = self.mirror_variable(self.lstm.g_emb)
+            # maps h_tm1 to h_t for generator
+            self.g_recurrent_unit = self.create_recurrent_unit()
+            # maps h_t to o_t
+            self.g_output_unit = self.create_output_unit()
+            # Built once so update_params does not grow the graph
+            self.update_op = self.create_update_op()
 
         # Placeholders
         # sequence of tokens generated by generator
@@ -37,8 +99,7 @@ class ROLLOUT(object):
         ta_x = tensor_array_ops.TensorArray(dtype=tf.int32, size=self.seq_len)
         ta_x = ta_x.unstack(tf.transpose(self.x, perm=[1, 0]))
 
-        self.h0 = tf.zeros([self.batch_size, self.hidden_dim])
-        self.h0 = tf.stack([self.h0, self.h0])
+        self.h0 = zero_state(self.batch_size, self.hidden_dim)
 
         gen_x = tensor_array_ops.TensorArray(dtype=tf.int32, size=self.seq_len, dynamic_size=False, infer_shape=True)
 
@@ -56,8 +117,7 @@ class ROLLOUT(object):
             h_t = self.g_recurrent_unit(x_t, h_tm1)
             # batch x vocab
             o_t = self.g_output_unit(h_t)
-            log_prob = tf.log(tf.nn.softmax(o_t))
-            next_token = tf.cast(tf.reshape(tf.multinomial(log_prob, 1), [self.batch_size]), tf.int32)
+            next_token = sample_from_logits(o_t, self.lstm.temperature, self.lstm.top_k, self.lstm.top_p)
             # batch x emb_dim
             x_tp1 = tf.nn.embedding_lookup(self.g_emb, next_token)
             # indices, batch_size
@@ -79,6 +139,85 @@ class ROLLOUT(object):
         # batch_size x seq_length
         self.gen_x = tf.transpose(self.gen_x, perm=[1, 0])
 
+        # Batched roll-out: every (rollout, given_num) pair is one row of a single batch.
+        # batch_x holds the sampled sequences, each row points at one of them through batch_src
+        # and carries its own given_num. Rows must be sorted by ascending given_num.
+        self.batch_x = tf.placeholder(tf.int32, shape=[None, self.seq_len])
+        self.batch_src = tf.placeholder(tf.int32, shape=[None])
+        self.batch_given_num = tf.placeholder(tf.int32, shape=[None])
+        num_samples = tf.shape(self.batch_x)[0]
+        num_rows = tf.shape(self.batch_src)[0]
+
+        with tf.device("/cpu:0"):
+            # seq_length x num_samples x emb_dim
+            processed_batch_x = tf.transpose(tf.nn.embedding_lookup(self.g_emb, self.batch_x), perm=[1, 0, 2])
+
+        ta_emb_batch_x = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len)
+        ta_emb_batch_x = ta_emb_batch_x.unstack(processed_batch_x)
+
+        prefix_h0 = zero_state(num_samples, self.hidden_dim)
+
+        prefix_states = tensor_array_ops.TensorArray(dtype=tf.float32, size=self.seq_len - 1, dynamic_size=False, infer_shape=True)
+
+        # Run the LSTM over the sampled sequences once and cache the (h, c) state after every step
+        def prefix_recurrence(i, x_t, h_tm1, states):
+            h_t = self.g_recurrent_unit(x_t, h_tm1)
+            states = states.write(i, tf.stack(h_t))
+            x_tp1 = ta_emb_batch_x.read(i)
+            return i + 1, x_tp1, h_t, states
+
+        _, _, _, prefix_states = control_flow_ops.while_loop(
+            cond=lambda i, _1, _2, _3: i < self.seq_len - 1,
+            body=prefix_recurrence,
+            loop_vars=(tf.constant(0, dtype=tf.int32),
+                       tf.nn.embedding_lookup(self.g_emb, tf.fill([num_samples], self.start_token[0])),
+                       prefix_h0, prefix_states))
+
+        # (seq_length - 1) x num_samples x 2 x hidden_dim
+        self.prefix_states = tf.transpose(prefix_states.stack(), perm=[0, 2, 1, 3])
+
+        # A row with given_num g resumes from the state cached after step g - 1, fed with token g - 1
+        resume_index = tf.stack([self.batch_given_num - 1, self.batch_src], axis=1)
+        rollout_h0 = tuple(tf.unstack(tf.gather_nd(self.prefix_states, resume_index), axis=1))
+        rollout_x0 = tf.nn.embedding_lookup(self.g_emb, tf.gather_nd(self.batch_x, tf.stack([self.batch_src, self.batch_given_num - 1], axis=1)))
+
+        min_given_num = tf.reduce_min(self.batch_given_num)
+        rollout_tokens = tensor_array_ops.TensorArray(dtype=tf.int32, size=self.seq_len - min_given_num, dynamic_size=False, infer_shape=True)
+
+        # Step k samples position given_num + k for every row that still has tokens left.
+        # Rows are sorted by given_num, so the active rows are always a leading slice of the batch.
+        def g_recurrence_batch(k, x_t, h_tm1, tokens):
+            num_active = tf.reduce_sum(tf.cast(self.batch_given_num < self.seq_len - k, tf.int32))
+            h_t = self.g_recurrent_unit(x_t[:num_active], tuple(state[:num_active] for state in h_tm1))
+            # active rows x vocab
+            o_t = self.g_output_unit(h_t)
+            next_token = sample_from_logits(o_t, self.lstm.temperature, self.lstm.top_k, self.lstm.top_p)
+            x_tp1 = tf.concat([tf.nn.embedding_lookup(self.g_emb, next_token), x_t[num_active:]], 0)
+            h_t = tuple(tf.concat([state_t, state_tm1[num_active:]], 0) for state_t, state_tm1 in zip(h_t, h_tm1))
+            tokens = tokens.write(k, tf.concat([next_token, tf.zeros([num_rows - num_active], dtype=tf.int32)], 0))
+            return k + 1, x_tp1, h_t, tokens
+
+        _, _, _, rollout_tokens = control_flow_ops.while_loop(
+            cond=lambda k, _1, _2, _3: k < self.seq_len - min_given_num,
+            body=g_recurrence_batch,
+            loop_vars=(tf.constant(0, dtype=tf.int32), rollout_x0, rollout_h0, rollout_tokens),
+            shape_invariants=(tf.TensorShape([]), tf.TensorShape([None, self.emb_dim]),
+                              (tf.TensorShape([None, self.hidden_dim]),) * 2, tf.TensorShape(None)))
+
+        # (seq_length - min_given_num) x rows
+        rollout_tokens = rollout_tokens.stack()
+
+        # Stitch the cached prefix and the sampled suffix back together, rows x seq_length
+        positions = tf.range(self.seq_len)[tf.newaxis, :]
+        given_num = self.batch_given_num[:, tf.newaxis]
+        suffix_index = tf.stack([
+            tf.maximum(positions - given_num, 0),
+            tf.tile(tf.range(num_rows)[:, tf.newaxis], [1, self.seq_len])], axis=2)
+        self.batch_gen_x = tf.where(
+            positions < given_num,
+            tf.gather(self.batch_x, self.batch_src),
+            tf.gather_nd(rollout_tokens, suffix_index))
+
     def get_reward(self, sess, input_x, rollout_num, discriminator):
         rewards = []
         for i in range(rollout_num):
@@ -108,143 +247,156 @@ class ROLLOUT(object):
         rewards = np.transpose(np.array(rewards)) / (1.0 * rollout_num)
         return rewards
 
-    def create_recurrent_unit(self):
-        # Weights and Bias for input and hidden tensor
-        self.W_i = tf.identity(self.lstm.W_i)
-        self.U_i = tf.identity(self.lstm.U_i)
-        self.b_i = tf.identity(self.lstm.b_i)
-
-        self.W_f = tf.identity(self.lstm.W_f)
-        self.U_f = tf.identity(self.lstm.U_f)
-        self.b_f = tf.identity(self.lstm.b_f)
-
-        self.W_o = tf.identity(self.lstm.W_o)
-        self.U_o = tf.identity(self.lstm.U_o)
-        self.b_o = tf.identity(self.lstm.b_o)
-
-        self.W_c = tf.identity(self.lstm.W_c)
-        self.U_c = tf.identity(self.lstm.U_c)
-        self.b_c = tf.identity(self.lstm.b_c)
-
-        def unit(x, hidden_memory_tm1):
-            previous_hidden_state, c_prev = tf.unstack(hidden_memory_tm1)
-
-            # Input Gate
-            i = tf.sigmoid(
-                tf.matmul(x, self.W_i) +
-                tf.matmul(previous_hidden_state, self.U_i) + self.b_i
-            )
-
-            # Forget Gate
-            f = tf.sigmoid(
-                tf.matmul(x, self.W_f) +
-                tf.matmul(previous_hidden_state, self.U_f) + self.b_f
-            )
-
-            # Output Gate
-            o = tf.sigmoid(
-                tf.matmul(x, self.W_o) +
-                tf.matmul(previous_hidden_state, self.U_o) + self.b_o
-            )
-
-            # New Memory Cell
-            c_ = tf.nn.tanh(
-                tf.matmul(x, self.W_c) +
-                tf.matmul(previous_hidden_state, self.U_c) + self.b_c
-            )
-
-            # Final Memory cell
-            c = f * c_prev + i * c_
-
-            # Current Hidden state
-            current_hidden_state = o * tf.nn.tanh(c)
-
-            return tf.stack([current_hidden_state, c])
-
-        return unit
-
-    def update_recurrent_unit(self):
-        # Weights and Bias for input and hidden tensor
-        self.W_i = self.update_rate * self.W_i + (1 - self.update_rate) * tf.identity(self.lstm.W_i)
-        self.U_i = self.update_rate * self.U_i + (1 - self.update_rate) * tf.identity(self.lstm.U_i)
-        self.b_i = self.update_rate * self.b_i + (1 - self.update_rate) * tf.identity(self.lstm.b_i)
-
-        self.W_f = self.update_rate * self.W_f + (1 - self.update_rate) * tf.identity(self.lstm.W_f)
-        self.U_f = self.update_rate * self.U_f + (1 - self.update_rate) * tf.identity(self.lstm.U_f)
-        self.b_f = self.update_rate * self.b_f + (1 - self.update_rate) * tf.identity(self.lstm.b_f)
-
-        self.W_o = self.update_rate * self.W_o + (1 - self.update_rate) * tf.identity(self.lstm.W_o)
-        self.U_o = self.update_rate * self.U_o + (1 - self.update_rate) * tf.identity(self.lstm.U_o)
-        self.b_o = self.update_rate * self.b_o + (1 - self.update_rate) * tf.identity(self.lstm.b_o)
-
-        self.W_c = self.update_rate * self.W_c + (1 - self.update_rate) * tf.identity(self.lstm.W_c)
-        self.U_c = self.update_rate * self.U_c + (1 - self.update_rate) * tf.identity(self.lstm.U_c)
-        self.b_c = self.update_rate * self.b_c + (1 - self.update_rate) * tf.identity(self.lstm.b_c)
-
-        def unit(x, hidden_memory_tm1):
-            previous_hidden_state, c_prev = tf.unstack(hidden_memory_tm1)
-
-            # Input Gate
-            i = tf.sigmoid(
-                tf.matmul(x, self.W_i) +
-                tf.matmul(previous_hidden_state, self.U_i) + self.b_i
-            )
-
-            # Forget Gate
-            f = tf.sigmoid(
-                tf.matmul(x, self.W_f) +
-                tf.matmul(previous_hidden_state, self.U_f) + self.b_f
-            )
-
-            # Output Gate
-            o = tf.sigmoid(
-                tf.matmul(x, self.W_o) +
-                tf.matmul(previous_hidden_state, self.U_o) + self.b_o
-            )
-
-            # New Memory Cell
-            c_ = tf.nn.tanh(
-                tf.matmul(x, self.W_c) +
-                tf.matmul(previous_hidden_state, self.U_c) + self.b_c
-            )
-
-            # Final Memory cell
-            c = f * c_prev + i * c_
-
-            # Current Hidden state
-            current_hidden_state = o * tf.nn.tanh(c)
+    def build_reward(self, discriminator):
+        # Scores the batched roll-outs in the same graph run, discriminator reads batch_gen_x directly.
+        # Sums the positive-class probabilities (and their squares) into num_samples x (seq_length - 1)
+        # matrices, the last token reward comes from the complete sequences instead.
+        if discriminator not in self.reward_graphs:
+            ypred = discriminator.build_reward(self.batch_gen_x)
+            num_samples = tf.shape(self.batch_x)[0]
+            segment_ids = self.batch_src * (self.seq_len - 1) + self.batch_given_num - 1
+            reward_sum = tf.reshape(tf.unsorted_segment_sum(ypred, segment_ids, num_samples * (self.seq_len - 1)), [num_samples, self.seq_len - 1])
+            reward_sq_sum = tf.reshape(tf.unsorted_segment_sum(tf.square(ypred), segment_ids, num_samples * (self.seq_len - 1)), [num_samples, self.seq_len - 1])
+            last_reward = discriminator.build_reward(self.batch_x)
+            self.reward_graphs[discriminator] = (reward_sum, reward_sq_sum, last_reward)
+        return self.reward_graphs[discriminator]
+
+    def score_rows(self, sess, input_x, src, given_num, discriminator, max_rows):
+        """Completes and scores the rows (src, given_num), sorted by given_num, in chunks of at most max_rows.
+        Returns the per (sample, given_num) sums of the rewards and of their squares, and the last token reward."""
+        if self.reward_cache is not None:
+            return self.score_rows_cached(sess, input_x, src, given_num, discriminator, max_rows)
+        reward_sum, reward_sq_sum, last_reward = self.build_reward(discriminator)
+        max_rows = max_rows or len(given_num)
+        total = np.zeros([len(input_x), self.seq_len - 1])
+        total_sq = np.zeros([len(input_x), self.seq_len - 1])
+        last = None
+        for start in range(0, max(len(given_num), 1), max_rows):
+            feed = {self.batch_x: input_x, self.batch_src: src[start:start + max_rows], self.batch_given_num: given_num[start:start + max_rows]}
+            if start == 0:
+                # the last token reward comes with the first chunk
+                chunk_sum, chunk_sq_sum, last = sess.run([reward_sum, reward_sq_sum, last_reward], feed)
+            else:
+                chunk_sum, chunk_sq_sum = sess.run([reward_sum, reward_sq_sum], feed)
+            total += chunk_sum
+            total_sq += chunk_sq_sum
+        return total, total_sq, last
+
+    def score_rows_cached(self, sess, input_x, src, given_num, discriminator, max_rows):
+        # score_rows through the reward cache: completions are fetched, only cache misses go to the discriminator
+        self.reward_cache.sync(sess.run(discriminator.global_step))
+        max_rows = max_rows or len(given_num)
+        total = np.zeros([len(input_x), self.seq_len - 1])
+        total_sq = np.zeros([len(input_x), self.seq_len - 1])
+        for start in range(0, len(given_num), max_rows):
+            feed = {self.batch_x: input_x, self.batch_src: src[start:start + max_rows], self.batch_given_num: given_num[start:start + max_rows]}
+            rewards = self.cached_reward(sess, sess.run(self.batch_gen_x, feed), discriminator, max_rows)
+            np.add.at(total, (src[start:start + max_rows], given_num[start:start + max_rows] - 1), rewards)
+            np.add.at(total_sq, (src[start:start + max_rows], given_num[start:start + max_rows] - 1), rewards ** 2)
+        last = self.cached_reward(sess, input_x, discriminator, max_rows)
+        return total, total_sq, last
+
+    def cached_reward(self, sess, rows, discriminator, max_rows):
+        # Rewards of complete sequences, scoring each distinct sequence missing from the cache once
+        if discriminator not in self.score_graphs:
+            self.score_graphs[discriminator] = discriminator.build_reward(self.score_x)
+        rows = np.ascontiguousarray(rows, dtype=np.int32)
+        keys = [row.tobytes() for row in rows]
+        rewards = self.reward_cache.lookup(keys)
+        missing = {}
+        for n in np.flatnonzero(np.isnan(rewards)):
+            missing.setdefault(keys[n], n)
+        if missing:
+            first = np.fromiter(missing.values(), dtype=np.int64, count=len(missing))
+            scored = np.concatenate([sess.run(self.score_graphs[discriminator], {self.score_x: rows[first[start:start + max_rows]]})
+                                     for start in range(0, len(first), max_rows)])
+            self.reward_cache.insert(list(missing), scored)
+            found = dict(zip(missing, scored))
+            for n in np.flatnonzero(np.isnan(rewards)):
+                rewards[n] = found[keys[n]]
+        return rewards
+
+    def get_reward_batched(self, sess, input_x, rollout_num, discriminator, max_rows=2048):
+        """Same rewards as get_reward, but every (rollout, given_num) pair is completed and
+        scored as one large batch, split into chunks of at most max_rows rows per sess.run."""
+        input_x = np.asarray(input_x)
+        batch_size = input_x.shape[0]
+        # rows are ordered given_num major, then rollout, then sample
+        given_num = np.repeat(np.arange(1, self.seq_len, dtype=np.int32), rollout_num * batch_size)
+        src = np.tile(np.arange(batch_size, dtype=np.int32), (self.seq_len - 1) * rollout_num)
 
-            return tf.stack([current_hidden_state, c])
+        total, _, last_reward = self.score_rows(sess, input_x, src, given_num, discriminator, max_rows)
+
+        # batch_size x seq_length, averaged over the rollouts
+        rewards = np.hstack([total / rollout_num, last_reward[:, np.newaxis]])
+        return rewards
+
+    def get_reward_adaptive(self, sess, input_x, discriminator, max_rollout_num=16, min_rollout_num=4,
+                            tolerance=0.01, z=1.96, rollouts_per_round=4, max_rows=2048):
+        """
+        Monte Carlo rewards with a per-prefix budget. Every (sample, given_num) prefix gets min_rollout_num
+        rollouts, then rollouts_per_round more per round until the z confidence interval half-width of its
+        mean reward is below tolerance or max_rollout_num is reached, so tolerance=0 always spends max_rollout_num.
+        Returns the batch_size x seq_length rewards and the batch_size x (seq_length - 1) rollout counts.
+        """
+        input_x = np.asarray(input_x)
+        batch_size = input_x.shape[0]
+        total = np.zeros([batch_size, self.seq_len - 1])
+        total_sq = np.zeros([batch_size, self.seq_len - 1])
+        count = np.zeros([batch_size, self.seq_len - 1], dtype=np.int32)
+        active = np.ones([batch_size, self.seq_len - 1], dtype=bool)
+        last_reward = None
+
+        num_rollouts = min(min_rollout_num, max_rollout_num)
+        while active.any():
+            # prefixes still sampling, given_num major so the rows stay sorted
+            given_idx, sample_idx = np.nonzero(active.T)
+            reps = np.minimum(num_rollouts, max_rollout_num - count[sample_idx, given_idx])
+            src = np.repeat(sample_idx, reps).astype(np.int32)
+            given_num = np.repeat(given_idx + 1, reps).astype(np.int32)
+
+            round_sum, round_sq_sum, round_last = self.score_rows(sess, input_x, src, given_num, discriminator, max_rows)
+            if last_reward is None:
+                last_reward = round_last
+            total += round_sum
+            total_sq += round_sq_sum
+            count[sample_idx, given_idx] += reps
+
+            mean = total / np.maximum(count, 1)
+            var = np.maximum(total_sq - count * mean ** 2, 0.0) / np.maximum(count - 1, 1)
+            half_width = z * np.sqrt(var / np.maximum(count, 1))
+            active = (count < max_rollout_num) & ((count < 2) | (half_width >= tolerance))
+            num_rollouts = rollouts_per_round
+
+        rewards = np.hstack([total / count, last_reward[:, np.newaxis]])
+        return rewards, count
+
+    def mirror_variable(self, lstm_param):
+        # Rollout-owned copy of a generator weight, initialised from its current value
+        param = tf.Variable(lstm_param.initialized_value(), trainable=False)
+        self.params.append(param)
+        self.lstm_params.append(lstm_param)
+        return param
+
+    def create_recurrent_unit(self):
+        # Fused gate weights and bias, same cell as the generator
+        self.W_lstm = self.mirror_variable(self.lstm.W_lstm)
+        self.b_lstm = self.mirror_variable(self.lstm.b_lstm)
 
-        return unit
+        return lstm_unit(self.W_lstm, self.b_lstm)
 
     def create_output_unit(self):
-        self.Wo = tf.identity(self.lstm.Wo)
-        self.bo = tf.identity(self.lstm.bo)
-
-        def unit(hidden_memory_tuple):
-            hidden_state, c_prev = tf.unstack(hidden_memory_tuple)
-            # hidden_state : batch x hidden_dim
-            logits = tf.matmul(hidden_state, self.Wo) + self.bo
-            # output = tf.nn.softmax(logits)
-            return logits
-
-        return unit
-
-    def update_output_unit(self):
-        self.Wo = self.update_rate * self.Wo + (1 - self.update_rate) * tf.identity(self.lstm.Wo)
-        self.bo = self.update_rate * self.bo + (1 - self.update_rate) * tf.identity(self.lstm.bo)
-
-        def unit(hidden_memory_tuple):
-            hidden_state, c_prev = tf.unstack(hidden_memory_tuple)
-            # hidden_state : batch x hidden_dim
-            logits = tf.matmul(hidden_state, self.Wo) + self.bo
-            # output = tf.nn.softmax(logits)
-            return logits
-
-        return unit
-
-    def update_params(self):
-        self.g_emb = tf.identity(self.lstm.g_emb)
-        self.g_recurrent_unit = self.update_recurrent_unit()
-        self.g_output_unit = self.update_output_unit()
+        # Same output layer as the generator (full or adaptive softmax) on the rollout's own weights
+        self.output_params = [self.mirror_variable(param) for param in self.lstm.output_params]
+        return self.lstm.make_output_unit(self.output_params)
+
+    def create_update_op(self):
+        # The embedding is copied as is, every other weight moves towards the generator by (1 - update_rate)
+        updates = [tf.assign(self.g_emb, self.lstm.g_emb)]
+        for param, lstm_param in zip(self.params, self.lstm_params):
+            if param is not self.g_emb:
+                updates.append(tf.assign(param, self.update_rate * param + (1 - self.update_rate) * lstm_param))
+        return tf.group(*updates)
+
+    def update_params(self, sess):
+        sess.run(self.update_op)
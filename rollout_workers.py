@@ -0,0 +1,152 @@
+'''
+Pool of local processes computing rollout rewards off the main training loop.
+Every worker builds its own rollout policy and discriminator and keeps them in sync with the weight snapshots pushed from the main process.
+A worker that fails sends its traceback back on the result queue, result() raises it and also notices workers that died without one.
+'''
+import multiprocessing
+import queue
+import time
+import traceback
+import numpy as np
+
+# Seconds between checks that the workers are still alive while waiting on them
+POLL_SECONDS = 1.0
+
+
+def rollout_worker(generator_config, discriminator_config, num_threads, task_queue, result_queue, rank,
+                   reward_precision=None, reward_cache_size=0):
+    try:
+        # TensorFlow is imported in the child so every worker owns its own runtime
+        import tensorflow as tf
+        from generator import Generator
+        from discriminator import Discriminator
+        from reward_scorer import RewardScorer
+        from rollout import ROLLOUT
+
+        generator = Generator(**generator_config)
+        discriminator = Discriminator(**discriminator_config)
+        rollout = ROLLOUT(generator, 0.8, reward_cache_size=reward_cache_size)
+        # Same reward model as the main process would use, see REWARD_PRECISION in seqGAN
+        reward_model = discriminator if reward_precision is None else RewardScorer(discriminator, reward_precision)
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=num_threads, inter_op_parallelism_threads=num_threads)
+        sess = tf.Session(config=config)
+        sess.run(tf.global_variables_initializer())
+
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            kind, payload = task
+            if kind == 'rollout_weights':
+                for param, value in zip(rollout.params, payload):
+                    param.load(value, sess)
+            elif kind == 'discriminator_weights':
+                for param, value in zip(discriminator.params, payload):
+                    param.load(value, sess)
+                if reward_model is not discriminator:
+                    reward_model.refresh(sess)
+            elif kind == 'reward':
+                ticket, samples, rollout_num = payload
+                rewards = rollout.get_reward_batched(sess, samples, rollout_num, reward_model)
+                result_queue.put(('reward', ticket, rewards))
+
+        sess.close()
+    except Exception:
+        result_queue.put(('error', rank, traceback.format_exc()))
+
+
+class RolloutWorkerPool(object):
+    """
+    num_workers processes, each holding a copy of the rollout policy and the discriminator.
+    generator_config and discriminator_config are the keyword arguments used to build the models in the main process,
+    reward_precision and reward_cache_size are those of the main process' reward model and ROLLOUT.
+    A sample batch is split by rows across the workers, the reward matrix is stitched back together in result().
+    Waiting on a worker raises RuntimeError as soon as one failed or exited and TimeoutError after timeout seconds.
+    """
+    def __init__(self, num_workers, generator_config, discriminator_config, reward_precision=None, reward_cache_size=0, timeout=600):
+        self.num_workers = num_workers
+        self.timeout = timeout
+        num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+
+        # Spawn, so the children do not inherit the parent's TensorFlow runtime
+        context = multiprocessing.get_context('spawn')
+        self.result_queue = context.Queue()
+        # One task queue per worker keeps weight snapshots ordered with the reward requests that follow them
+        self.task_queues = [context.Queue() for _ in range(num_workers)]
+        self.workers = [
+            context.Process(target=rollout_worker,
+                            args=(generator_config, discriminator_config, num_threads, task_queue, self.result_queue, rank,
+                                  reward_precision, reward_cache_size),
+                            daemon=True)
+            for rank, task_queue in enumerate(self.task_queues)]
+        for worker in self.workers:
+            worker.start()
+
+        self.next_ticket = 0
+        self.pending = {}
+        self.finished = {}
+
+    def broadcast(self, kind, payload):
+        for task_queue in self.task_queues:
+            task_queue.put((kind, payload))
+
+    def sync(self, sess, rollout=None, discriminator=None):
+        # Push the current weights, call after rollout.update_params() and after each discriminator phase
+        if rollout is not None:
+            self.broadcast('rollout_weights', sess.run(rollout.params))
+        if discriminator is not None:
+            self.broadcast('discriminator_weights', sess.run(discriminator.params))
+
+    def submit(self, samples, rollout_num):
+        """Queues a reward computation and returns a ticket for result()."""
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        chunks = np.array_split(np.asarray(samples), self.num_workers)
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        for part, (task_queue, chunk) in enumerate(zip(self.task_queues, chunks)):
+            task_queue.put(('reward', ((ticket, part), chunk, rollout_num)))
+        self.pending[ticket] = len(chunks)
+        return ticket
+
+    def check_workers(self):
+        for rank, worker in enumerate(self.workers):
+            if worker.exitcode is not None:
+                raise RuntimeError(f'Rollout worker {rank} exited with code {worker.exitcode}')
+
+    def result(self, ticket):
+        """Blocks until every chunk of the ticket is back, returns the batch_size x seq_length reward matrix."""
+        deadline = time.monotonic() + self.timeout
+        while len(self.finished.get(ticket, {})) < self.pending[ticket]:
+            try:
+                kind, key, payload = self.result_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                self.check_workers()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Rollout ticket {ticket} not done within {self.timeout} s')
+                continue
+            if kind == 'error':
+                raise RuntimeError(f'Rollout worker {key} failed:\n{payload}')
+            done_ticket, part = key
+            self.finished.setdefault(done_ticket, {})[part] = payload
+        parts = self.finished.pop(ticket)
+        del self.pending[ticket]
+        return np.concatenate([parts[part] for part in sorted(parts)], 0)
+
+    def close(self):
+        # Workers finish their queued tasks first. Their results are drained while waiting, a child does not exit
+        # before what it put on result_queue is flushed
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        deadline = time.monotonic() + self.timeout
+        while any(worker.is_alive() for worker in self.workers) and time.monotonic() < deadline:
+            try:
+                self.result_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        self.pending = {}
+        self.finished = {}
@@ -0,0 +1,32 @@
+'''
+Token sampling shared by Generator, ROLLOUT and TARGET_LSTM.
+Samples straight from the logits, so no softmax or log is materialised in the generation loops.
+'''
+import tensorflow as tf
+
+
+def sample_from_logits(logits, temperature=1.0, top_k=0, top_p=1.0):
+    """
+    Draws one token per row of logits (batch x vocab), returns an int32 [batch] tensor.
+    temperature: logits are divided by it, below 1.0 sharpens and above 1.0 flattens the distribution
+    top_k: when set, only the top_k most likely tokens of each row can be drawn
+    top_p: when below 1.0, only the smallest set of most likely tokens whose probability reaches top_p can be drawn
+    """
+    if temperature != 1.0:
+        logits = logits / temperature
+    if top_k:
+        kth_largest = tf.nn.top_k(logits, k=top_k).values[:, -1:]
+        logits = tf.where(logits < kth_largest, tf.fill(tf.shape(logits), float('-inf')), logits)
+    if top_p < 1.0:
+        sorted_logits = tf.nn.top_k(logits, k=tf.shape(logits)[1]).values
+        # Probability mass of the strictly more likely tokens, the first token is always kept
+        mass_before = tf.cumsum(tf.nn.softmax(sorted_logits), axis=1, exclusive=True)
+        kept_logits = tf.where(mass_before < top_p, sorted_logits, tf.fill(tf.shape(sorted_logits), float('inf')))
+        threshold = tf.reduce_min(kept_logits, axis=1, keepdims=True)
+        logits = tf.where(logits < threshold, tf.fill(tf.shape(logits), float('-inf')), logits)
+    return tf.cast(tf.reshape(tf.multinomial(logits, 1), [-1]), tf.int32)
+
+
+def token_prob(logits, token):
+    """Probability of token (batch) under softmax(logits), without building the full softmax."""
+    return tf.exp(-tf.nn.sparse_softmax_cross_entropy_with_logits(labels=token, logits=logits))
@@ -1,11 +1,21 @@
+import argparse
+import hashlib
+import json
+import os
 import numpy as np
 import tensorflow as tf
 import random
 from data_loader import Discriminator_Data_Loader, Generator_Data_Loader
+from token_store import file_digest, load_tokens
 from generator import Generator
 from discriminator import Discriminator
 from target_lstm import TARGET_LSTM
 from rollout import ROLLOUT
+from reward_scorer import RewardScorer
+from rollout_workers import RolloutWorkerPool
+from profiler import Profiler
+from pipeline import Pipeline
+from parallel_pretrain import DataParallelPretrainer
 import pickle
 import time
 from tqdm import tqdm
@@ -23,6 +33,8 @@ START_TOKEN = 0
 PRE_EPOCH_NUM = 10
 SEED = 88
 BATCH_SIZE = 64
+# Output layer for training: 'full', 'sampled' or 'adaptive' (see Generator)
+GEN_SOFTMAX = 'full'
 
 # Discriminator Hyper Parameters
 dis_embedding_dim = 64
@@ -36,22 +48,71 @@ dis_l2_reg_lambda = 0.2
 TOTAL_BATCH = 200
 positive_file = 'instapic/real_data_200.txt'
 negative_file = 'data/generator_sample.txt'
+# Also write every negative set to negative_file, for debugging only
+DUMP_NEGATIVE_SAMPLES = False
+# Feed generator pretraining and discriminator training through tf.data pipelines instead of feed_dict
+USE_TF_DATA = False
 # eval_file = 'data/eval_file.txt'
 generated_num = 1000
+# Pretrained generator and discriminator checkpoints, one directory per pretraining configuration (see pretrain_key)
+PRETRAIN_DIR = 'data/pretrained'
+# Adversarial iterations to capture Chrome traces of (one file per sess.run) into TRACE_DIR, phase timings are always logged
+TRACE_ITERATIONS = []
+TRACE_DIR = 'data/traces'
+# Number of local processes computing rollout rewards, 0 computes them inline. The workers score with the same
+# REWARD_PRECISION and REWARD_CACHE_SIZE, ADAPTIVE_ROLLOUT needs 0
+ROLLOUT_WORKERS = 0
+# Stop sampling a prefix once its reward confidence interval is within ROLLOUT_TOLERANCE
+ADAPTIVE_ROLLOUT = False
+ROLLOUT_TOLERANCE = 0.01
+# Score rollouts with an inference-only copy of the discriminator in this precision ('float32', 'bfloat16', 'float16'
+# or 'int8', see reward_scorer), None scores them with the training discriminator
+REWARD_PRECISION = None
+# Remember the rewards of up to REWARD_CACHE_SIZE complete sequences until the discriminator trains again, 0 disables.
+# Opt-in: cached scoring copies the completions to the host instead of scoring them in the rollout graph, so it only
+# pays off when many completions repeat
+REWARD_CACHE_SIZE = 0
+# Generate the next negative set while the discriminator trains on the previous one, at most PIPELINE_QUEUE_SIZE sets ahead
+PIPELINE_DISCRIMINATOR = False
+PIPELINE_QUEUE_SIZE = 1
+# Pretrain the generator data-parallel, one replica per host ('localhost' entries are local processes, e.g.
+# ['localhost'] * 4 or ['localhost', 'localhost', 'node2', 'node2'], see parallel_pretrain), averaging parameters
+# every PRETRAIN_SYNC_EVERY steps. Empty pretrains in this process.
+PRETRAIN_HOSTS = []
+PRETRAIN_SYNC_EVERY = 10
+# Memory budget for the activations of one generation run, and the bounds on its rows
+GEN_MEMORY_BYTES = 256 * 2 ** 20
+GEN_MIN_ROWS = 1024
+GEN_MAX_ROWS = 8192
 
 # Generate data samples - will use Generator model
-def generate_samples(sess, trainable_model, batch_size, generated_num, output_file):
+# Returns exactly generated_num samples as an int array, output_file is optional
+# Samples are drawn batch_rows at a time (independent of the training batch size), by default as many
+# rows as fit in GEN_MEMORY_BYTES
+def generate_samples(sess, trainable_model, generated_num, output_file=None, batch_rows=None):
+    batch_rows = batch_rows or generation_rows(trainable_model)
     generated_samples = []
-    for _ in range(int(generated_num / batch_size)):
-        generated_samples.extend(trainable_model.generate(sess))
+    f = open(output_file, 'w') if output_file is not None else None
+    for start in range(0, generated_num, batch_rows):
+        samples = trainable_model.generate(sess, min(batch_rows, generated_num - start))
+        generated_samples.append(samples)
+        if f is not None:
+            np.savetxt(f, samples, fmt='%d', delimiter=' ')
+    if f is not None:
+        f.close()
 
-    with open(output_file, 'w') as f:
-        for sample in generated_samples:
-            buffer = ' '.join([str(x) for x in sample]) + '\n'
-            f.write(buffer)
+    return np.concatenate(generated_samples, 0)
+
+# Rows per generation run that keep the per-step activations (logits, softmax and sampling
+# buffers over the vocabulary plus the LSTM state) within memory_bytes
+def generation_rows(trainable_model, memory_bytes=None):
+    memory_bytes = memory_bytes or GEN_MEMORY_BYTES
+    row_bytes = 4 * (4 * trainable_model.emb_num + 8 * trainable_model.hidden_dim + trainable_model.emb_dim)
+    return int(np.clip(memory_bytes // row_bytes, GEN_MIN_ROWS, GEN_MAX_ROWS))
 
 # target_loss means the oracle negative log-likelihood tested with the oracle model "target_lstm"
 # For more details, please see the Section 4 in https://arxiv.org/abs/1609.05473
+# The oracle is never built on a tf.data batch, so it is always fed
 def target_loss(sess, target_lstm, data_loader):
     nll = []
     data_loader.reset_pointer()
@@ -66,16 +127,107 @@ def target_loss(sess, target_lstm, data_loader):
 # Pre-train the generator using MLE for one epoch
 def pre_train_epoch(sess, trainable_model, data_loader):
     supervised_g_losses = []
-    data_loader.reset_pointer()
+    if USE_TF_DATA:
+        data_loader.init_epoch(sess)
+    else:
+        data_loader.reset_pointer()
 
     for _ in range(data_loader.num_batch):
-        batch = data_loader.next_batch()
+        batch = None if USE_TF_DATA else data_loader.next_batch()
         _, g_loss = trainable_model.pretrain_step(sess, batch)
         supervised_g_losses.append(g_loss)
 
     return np.mean(supervised_g_losses)
 
+# Train the discriminator for num_epochs on the examples currently held by data_loader
+def train_discriminator(sess, discriminator, data_loader, num_epochs):
+    for _ in range(num_epochs):
+        if USE_TF_DATA:
+            data_loader.init_epoch(sess)
+        else:
+            data_loader.reset_pointer()
+
+        for it in range(data_loader.num_batch):
+            feed = {discriminator.dropout_keep_prob: dis_dropout_keep_prob}
+            if not USE_TF_DATA:
+                x_batch, y_batch = data_loader.next_batch()
+                feed[discriminator.input_x] = x_batch
+                feed[discriminator.input_y] = y_batch
+            _ = sess.run(discriminator.train_op, feed)
+
+# rounds x (generated_num fresh negative samples, 3 discriminator epochs on them and the positive samples)
+# With a pipeline (see discriminator_pipeline) the sampling of each round overlaps the training of the previous one
+def discriminator_phase(sess, generator, discriminator, dis_data_loader, positive_samples, rounds, profiler, pipeline=None, progress=False):
+    if pipeline is not None:
+        with profiler.phase('discriminator_pipeline'):
+            pipeline.run(rounds, progress)
+        return
+    for _ in tqdm(range(rounds), disable=not progress):
+        with profiler.phase('generate_samples'):
+            negative_samples = generate_samples(sess, generator, generated_num, negative_file if DUMP_NEGATIVE_SAMPLES else None)
+        with profiler.phase('load_train_arrays'):
+            dis_data_loader.load_train_arrays(positive_samples, negative_samples)
+        with profiler.phase('train_discriminator'):
+            train_discriminator(sess, discriminator, dis_data_loader, 3)
+
+# The generator does not change during a discriminator phase, so sampling ahead gives the same negative sets
+# The stages keep their phases, generate_samples is timed in the producer thread
+def discriminator_pipeline(sess, generator, discriminator, dis_data_loader, positive_samples, profiler):
+    def produce():
+        with profiler.phase('generate_samples'):
+            return generate_samples(sess, generator, generated_num, negative_file if DUMP_NEGATIVE_SAMPLES else None)
+
+    def consume(negative_samples):
+        with profiler.phase('load_train_arrays'):
+            dis_data_loader.load_train_arrays(positive_samples, negative_samples)
+        with profiler.phase('train_discriminator'):
+            train_discriminator(sess, discriminator, dis_data_loader, 3)
+
+    return Pipeline(produce, consume, PIPELINE_QUEUE_SIZE)
+
+# Identifies a pretraining run: everything that shapes the pretrained weights, plus the contents of the positive data
+def pretrain_key(generator_config, discriminator_config):
+    settings = dict(generator=generator_config, discriminator=discriminator_config, seed=SEED, pre_epoch_num=PRE_EPOCH_NUM,
+                    generated_num=generated_num, dis_dropout_keep_prob=dis_dropout_keep_prob,
+                    positive_file=file_digest(positive_file).hex())
+    if PRETRAIN_HOSTS:
+        settings.update(pretrain_workers=len(PRETRAIN_HOSTS), pretrain_sync_every=PRETRAIN_SYNC_EVERY)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16], settings
+
+def pretrain(sess, generator, discriminator, gen_data_loader, dis_data_loader, positive_samples, log, profiler, dis_pipeline=None, pretrainer=None):
+    #  pre-train generator
+    print('Start pre-training...')
+    log.write('Pre-training...\n')
+    for epoch in range(PRE_EPOCH_NUM):
+        start = time.time()
+        with profiler.phase('generator_epoch'):
+            if pretrainer is None:
+                loss = pre_train_epoch(sess, generator, gen_data_loader)
+            else:
+                loss = pretrainer.train_epoch(sess, generator)
+        print("Epoch ",epoch, " Loss: ", loss)
+        print("Per epoch time consumed: ", time.time()-start)
+
+        # if epoch % 5 == 0:
+        #     generate_samples(sess, generator, generated_num, eval_file)
+        #     likelihood_data_loader.create_batches(eval_file)
+        #     test_loss = target_loss(sess, target_lstm, likelihood_data_loader)
+        #     print(f'Pre-train epoch: {epoch}, Test_loss: {test_loss}')
+        #     buffer = "Epoch:\t"+ str(epoch) + "\tNeg-Log Likelihood:\t" + str(test_loss) + "\n"
+        #     log.write(buffer)
+
+    print('Start pre-training discriminator...')
+    # Train 3 epoch on the generated data and do this for 50 times
+    discriminator_phase(sess, generator, discriminator, dis_data_loader, positive_samples, 50, profiler, dis_pipeline, progress=True)
+
 def main():
+    parser = argparse.ArgumentParser(description='SeqGAN training')
+    parser.add_argument('--force-pretrain', action='store_true',
+                        help='pretrain again even when a checkpoint for this configuration exists')
+    args = parser.parse_args()
+    if ROLLOUT_WORKERS > 0 and ADAPTIVE_ROLLOUT:
+        raise ValueError('ADAPTIVE_ROLLOUT is computed in this process only, set ROLLOUT_WORKERS = 0 to use it')
+
     random.seed(SEED)
     np.random.seed(SEED)
     assert START_TOKEN == 0
@@ -86,102 +238,150 @@ def main():
     vocab_size = 19851
     dis_data_loader = Discriminator_Data_Loader(BATCH_SIZE)
 
-    generator = Generator(vocab_size, BATCH_SIZE, EMB_DIM, HIDDEN_DIM, SEQ_LENGTH, START_TOKEN)
+    generator_config = dict(emb_num=vocab_size, batch_size=BATCH_SIZE, emb_dim=EMB_DIM, hidden_dim=HIDDEN_DIM, seq_len=SEQ_LENGTH, start_token=START_TOKEN, softmax=GEN_SOFTMAX)
+    if USE_TF_DATA:
+        gen_input_x = gen_data_loader.create_dataset(positive_file, SEQ_LENGTH)
+        dis_input_x, dis_input_y = dis_data_loader.create_dataset(SEQ_LENGTH, 2)
+    else:
+        gen_input_x = dis_input_x = dis_input_y = None
+    generator = Generator(**generator_config, input_x=gen_input_x)
     # target_params = pickle.load(open('data/target_params_py3.pkl', 'rb'))
     # The oracle model - synthetic data
     # target_lstm = TARGET_LSTM(vocab_size, BATCH_SIZE, EMB_DIM, HIDDEN_DIM, SEQ_LENGTH, START_TOKEN, target_params)
 
-    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim, filter_sizes=dis_filter_sizes, num_filters=dis_num_filters, l2_reg_lambda=dis_l2_reg_lambda)
+    discriminator_config = dict(seq_len=20, num_classes=2, vocab_size=vocab_size, emb_size=dis_embedding_dim, filter_sizes=dis_filter_sizes, num_filters=dis_num_filters, l2_reg_lambda=dis_l2_reg_lambda)
+    discriminator = Discriminator(**discriminator_config, input_x=dis_input_x, input_y=dis_input_y)
 
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
-    sess = tf.Session(config=config)
+    session = tf.Session(config=config)
+    # Every sess.run goes through the profiler, so the iterations in TRACE_ITERATIONS get traced
+    profiler = Profiler(TRACE_DIR, TRACE_ITERATIONS)
+    sess = profiler.session(session)
     sess.run(tf.global_variables_initializer())
 
     # First, use the oracle model to provide the positive examples, which are sampled from the oracle data distribution
-    # generate_samples(sess, target_lstm, BATCH_SIZE, generated_num, positive_file)
-    gen_data_loader.create_batches(positive_file)
+    # generate_samples(sess, target_lstm, generated_num, positive_file)
+    if not USE_TF_DATA:
+        gen_data_loader.create_batches(positive_file)
+    # Parsed once, the discriminator reuses it for every negative set
+    positive_samples = load_tokens(positive_file, SEQ_LENGTH)
+    dis_pipeline = discriminator_pipeline(sess, generator, discriminator, dis_data_loader, positive_samples, profiler) if PIPELINE_DISCRIMINATOR else None
 
     log = open('data/experiment-log.txt', 'w')
-    #  pre-train generator
-    print('Start pre-training...')
-    log.write('Pre-training...\n')
-    for epoch in range(PRE_EPOCH_NUM):
-        start = time.time()
-        loss = pre_train_epoch(sess, generator, gen_data_loader)
-        print("Epoch ",epoch, " Loss: ", loss)
-        print("Per epoch time consumed: ", time.time()-start)
+    # Everything built so far (generator, discriminator and their optimizer state) is what pretraining produces
+    pretrain_saver = tf.train.Saver()
+    key, settings = pretrain_key(generator_config, discriminator_config)
+    pretrain_path = os.path.join(PRETRAIN_DIR, key, 'pretrained')
+    if not args.force_pretrain and tf.train.checkpoint_exists(pretrain_path):
+        print(f'Loading pretrained models from {pretrain_path}')
+        log.write(f'Pre-trained models loaded from {pretrain_path}\n')
+        pretrain_saver.restore(session, pretrain_path)
+    else:
+        pretrainer = None
+        if PRETRAIN_HOSTS:
+            pretrainer = DataParallelPretrainer(generator_config, positive_file, PRETRAIN_HOSTS, PRETRAIN_SYNC_EVERY)
+        try:
+            with profiler.phase('pretrain'):
+                pretrain(sess, generator, discriminator, gen_data_loader, dis_data_loader, positive_samples, log, profiler, dis_pipeline, pretrainer)
+        finally:
+            if pretrainer is not None:
+                pretrainer.close()
+        profiler.write(log, 'pretrain')
+        os.makedirs(os.path.dirname(pretrain_path), exist_ok=True)
+        pretrain_saver.save(session, pretrain_path, write_meta_graph=False)
+        with open(os.path.join(os.path.dirname(pretrain_path), 'settings.json'), 'w') as f:
+            json.dump(settings, f, indent=2, sort_keys=True)
 
-        # if epoch % 5 == 0:
-        #     generate_samples(sess, generator, BATCH_SIZE, generated_num, eval_file)
-        #     likelihood_data_loader.create_batches(eval_file)
-        #     test_loss = target_loss(sess, target_lstm, likelihood_data_loader)
-        #     print(f'Pre-train epoch: {epoch}, Test_loss: {test_loss}')
-        #     buffer = "Epoch:\t"+ str(epoch) + "\tNeg-Log Likelihood:\t" + str(test_loss) + "\n"
-        #     log.write(buffer)
+    rollout = ROLLOUT(generator, 0.8, reward_cache_size=REWARD_CACHE_SIZE)
+    sess.run(tf.variables_initializer(rollout.params))
 
-    print('Start pre-training discriminator...')
-    # Train 3 epoch on the generated data and do this for 50 times
-    for _ in tqdm(range(50)):
-        generate_samples(sess, generator, BATCH_SIZE, generated_num, negative_file)
-        dis_data_loader.load_train_data(positive_file, negative_file)
-        for _ in range(3):
-            dis_data_loader.reset_pointer()
-            for it in range(dis_data_loader.num_batch):
-                x_batch, y_batch = dis_data_loader.next_batch()
-                feed = {
-                    discriminator.input_x: x_batch,
-                    discriminator.input_y: y_batch,
-                    discriminator.dropout_keep_prob: dis_dropout_keep_prob
-                }
-                _ = sess.run(discriminator.train_op, feed)
-
-    rollout = ROLLOUT(generator, 0.8)
+    # Rewards come from reward_model, the discriminator itself or its reduced-precision snapshot
+    reward_model = discriminator
+    if REWARD_PRECISION is not None:
+        reward_model = RewardScorer(discriminator, REWARD_PRECISION)
+        sess.run(tf.variables_initializer(reward_model.params))
+        reward_model.refresh(sess)
+
+    rollout_pool = None
+    if ROLLOUT_WORKERS > 0:
+        rollout_pool = RolloutWorkerPool(ROLLOUT_WORKERS, generator_config, discriminator_config, REWARD_PRECISION, REWARD_CACHE_SIZE)
+        rollout_pool.sync(sess, rollout, discriminator)
+        next_samples = generator.generate(sess)
+        next_ticket = rollout_pool.submit(next_samples, 16)
 
     print('#########################################################################')
     print('Start Adversarial Training...')
     log.write('Adversarial training...\n')
     for total_batch in tqdm(range(TOTAL_BATCH)):
-        # Train the generator for one step
-        for it in range(1):
-            samples = generator.generate(sess)
-            rewards = rollout.get_reward(sess, samples, 16, discriminator)
-            feed = {generator.x: samples, generator.rewards: rewards}
-            _ = sess.run(generator.g_updates, feed_dict=feed)
-
-        # Test
-        if total_batch % 5 == 0 or total_batch == TOTAL_BATCH - 1:
-            # generate_samples(sess, generator, BATCH_SIZE, generated_num, eval_file)
-            # likelihood_data_loader.create_batches(eval_file)
-            # test_loss = target_loss(sess, target_lstm, likelihood_data_loader)
-            buffer = "Epoch:\t" + str(total_batch) + "\tReward:\t" + str(rewards) + "\n"
-            print(f'Total Batch: {total_batch}, Reward {rewards}')
-            log.write(buffer)
-
-        # Update roll-out parameters
-        rollout.update_params()
-
-        # Train the discriminator
-        for _ in range(5):
-            generate_samples(sess, generator, BATCH_SIZE, generated_num, negative_file)
-            dis_data_loader.load_train_data(positive_file, negative_file)
-
-            for _ in range(3):
-                dis_data_loader.reset_pointer()
-                for it in range(dis_data_loader.num_batch):
-                    x_batch, y_batch = dis_data_loader.next_batch()
-                    feed = {
-                        discriminator.input_x: x_batch,
-                        discriminator.input_y: y_batch,
-                        discriminator.dropout_keep_prob: dis_dropout_keep_prob
-                    }
-                    _ = sess.run(discriminator.train_op, feed)
+        profiler.start_iteration(total_batch)
+        with profiler.phase('adversarial'):
+            # Train the generator for one step
+            for it in range(1):
+                if rollout_pool is None:
+                    with profiler.phase('generate'):
+                        samples = generator.generate(sess)
+                    with profiler.phase('rollout_reward'):
+                        if ADAPTIVE_ROLLOUT:
+                            rewards, rollout_count = rollout.get_reward_adaptive(sess, samples, reward_model, max_rollout_num=16, tolerance=ROLLOUT_TOLERANCE)
+                            log.write(f"Epoch:\t{total_batch}\tRollouts:\t{rollout_count.sum()} of {rollout_count.size * 16}\n")
+                        else:
+                            rewards = rollout.get_reward_batched(sess, samples, 16, reward_model)
+                else:
+                    # The workers computed these rewards during the previous iteration. Queue the next batch
+                    # now so it overlaps with this update and the discriminator phase, at the cost of its
+                    # samples and weights being one iteration stale.
+                    samples = next_samples
+                    with profiler.phase('rollout_reward'):
+                        rewards = rollout_pool.result(next_ticket)
+                    # Nothing would collect a batch queued in the last iteration
+                    if total_batch < TOTAL_BATCH - 1:
+                        with profiler.phase('generate'):
+                            next_samples = generator.generate(sess)
+                        next_ticket = rollout_pool.submit(next_samples, 16)
+                feed = {generator.x: samples, generator.rewards: rewards}
+                with profiler.phase('g_update'):
+                    _ = sess.run(generator.g_updates, feed_dict=feed)
+
+            # Test
+            if total_batch % 5 == 0 or total_batch == TOTAL_BATCH - 1:
+                # generate_samples(sess, generator, generated_num, eval_file)
+                # likelihood_data_loader.create_batches(eval_file)
+                # test_loss = target_loss(sess, target_lstm, likelihood_data_loader)
+                buffer = "Epoch:\t" + str(total_batch) + "\tReward:\t" + str(rewards) + "\n"
+                print(f'Total Batch: {total_batch}, Reward {rewards}')
+                log.write(buffer)
+                if rollout.reward_cache is not None:
+                    cache = rollout.reward_cache
+                    log.write(f"Epoch:\t{total_batch}\tReward cache hit rate:\t{cache.hit_rate():.3f}\tScored:\t{cache.scored}\n")
+                profiler.write(log, f'adversarial {total_batch}')
+                if dis_pipeline is not None:
+                    log.write(f"Epoch:\t{total_batch}\tDiscriminator pipeline:\t{json.dumps(dis_pipeline.summary())}\n")
+
+            # Update roll-out parameters
+            with profiler.phase('rollout_update'):
+                rollout.update_params(sess)
+                if rollout_pool is not None:
+                    rollout_pool.sync(sess, rollout=rollout)
+
+            # Train the discriminator
+            discriminator_phase(sess, generator, discriminator, dis_data_loader, positive_samples, 5, profiler, dis_pipeline)
+
+            with profiler.phase('reward_model_sync'):
+                if reward_model is not discriminator:
+                    reward_model.refresh(sess)
+                if rollout_pool is not None:
+                    rollout_pool.sync(sess, discriminator=discriminator)
+
+    if rollout_pool is not None:
+        rollout_pool.close()
 
     # Final generation
     print("Writing final results to test file")
     test_file = "data/final.txt"
-    generate_samples(sess, generator, BATCH_SIZE, generated_num, test_file)
+    generate_samples(sess, generator, generated_num, test_file)
     print("Finished")
+    profiler.write(log, 'final')
 
     log.close()
 
@@ -0,0 +1,23 @@
+from bench_seqgan import find_regressions
+
+
+def report(scales):
+    return dict(scales={scale: dict(results={name: dict(samples_per_sec=rate) for name, rate in results.items()})
+                        for scale, results in scales.items()})
+
+
+def test_find_regressions_reports_drops_beyond_threshold():
+    baseline = report({'small': {'pretrain_step': 100.0, 'g_step': 100.0, 'removed': 100.0}, 'paper': {'d_step': 50.0}})
+    # A 10% threshold, pretrain_step just over it, g_step just under it
+    current = report({'small': {'pretrain_step': 89.9, 'g_step': 90.1, 'added': 1.0}, 'paper': {'d_step': 40.0},
+                      'large': {'d_step': 1.0}})
+    assert find_regressions(current, baseline, 0.1) == [('small/pretrain_step', 100.0, 89.9), ('paper/d_step', 50.0, 40.0)]
+
+
+def test_find_regressions_skips_benchmarks_missing_from_either_side():
+    baseline = report({'small': {'removed': 100.0}})
+    # Only in the baseline, or new in the report (also under a new scale), nothing to compare against
+    current = report({'small': {'added': 1.0}, 'large': {'removed': 1.0}})
+    assert find_regressions(current, baseline, 0.1) == []
+    # Faster than the baseline is never a regression
+    assert find_regressions(report({'small': {'removed': 200.0}}), baseline, 0.0) == []
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from data_loader import Discriminator_Data_Loader, Generator_Data_Loader
+
+
+def write_text(path, rows):
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write(' '.join(str(token) for token in row) + '\n')
+
+
+def test_in_memory_arrays_give_same_batches_as_files(tmp_path):
+    rng = np.random.RandomState(0)
+    positive = rng.randint(0, 100, [23, 20])
+    negative = rng.randint(0, 100, [17, 20])
+    write_text(tmp_path / 'pos.txt', positive)
+    write_text(tmp_path / 'neg.txt', negative)
+
+    from_files = Discriminator_Data_Loader(8)
+    np.random.seed(1)
+    from_files.load_train_data(str(tmp_path / 'pos.txt'), str(tmp_path / 'neg.txt'))
+    from_arrays = Discriminator_Data_Loader(8)
+    np.random.seed(1)
+    from_arrays.load_train_arrays(positive, negative)
+
+    # 40 examples, 5 whole batches
+    assert from_files.num_batch == from_arrays.num_batch == 5
+    for _ in range(from_files.num_batch + 1):
+        (x_files, y_files), (x_arrays, y_arrays) = from_files.next_batch(), from_arrays.next_batch()
+        np.testing.assert_array_equal(x_files, x_arrays)
+        np.testing.assert_array_equal(y_files, y_arrays)
+    # Positive rows are labelled [0, 1], negative ones [1, 0]
+    positive_rows = {tuple(row) for row in positive}
+    for row, label in zip(from_arrays.sentences, from_arrays.labels):
+        assert list(label) == ([0, 1] if tuple(row) in positive_rows else [1, 0])
+
+
+def test_dataset_epoch_yields_same_rows_as_next_batch(tmp_path):
+    rows = np.random.RandomState(0).randint(0, 70000, [24, 20])
+    write_text(tmp_path / 'data.txt', list(rows) + [[1, 2, 3]])
+
+    loader = Generator_Data_Loader(6)
+    loader.create_batches(str(tmp_path / 'data.txt'))
+    fed = [loader.next_batch() for _ in range(loader.num_batch)]
+
+    tf.reset_default_graph()
+    dataset_loader = Generator_Data_Loader(6)
+    batch = dataset_loader.create_dataset(str(tmp_path / 'data.txt'), 20)
+    with tf.Session() as sess:
+        dataset_loader.init_epoch(sess)
+        batches = [sess.run(batch) for _ in range(dataset_loader.num_batch)]
+        # One epoch is exactly num_batch batches
+        with pytest.raises(tf.errors.OutOfRangeError):
+            sess.run(batch)
+
+    assert dataset_loader.num_batch == loader.num_batch == 4
+    assert sorted(map(tuple, np.concatenate(batches))) == sorted(map(tuple, np.concatenate(fed)))
@@ -0,0 +1,31 @@
+import numpy as np
+import tensorflow as tf
+from discriminator import Discriminator, bucket_filter_sizes
+
+
+def test_bucket_filter_sizes_keeps_order_and_bounds_padding():
+    filter_sizes = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 15, 20]
+    num_filters = [100, 200, 200, 200, 200, 100, 100, 100, 100, 100, 160, 160]
+    buckets = bucket_filter_sizes(filter_sizes, num_filters, 20, 0.25)
+    assert sum(buckets, []) == list(range(len(filter_sizes)))
+    assert len(buckets) < len(filter_sizes)
+    assert bucket_filter_sizes(filter_sizes, num_filters, 20, 0.0) == [[k] for k in range(len(filter_sizes))]
+
+
+def test_fused_conv_matches_per_width_conv():
+    tf.reset_default_graph()
+    filter_sizes, num_filters = [1, 2, 3, 4, 5, 10, 20], [3, 4, 4, 4, 4, 2, 2]
+    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=30, emb_size=8, filter_sizes=filter_sizes,
+                                  num_filters=num_filters, max_pad_overhead=1.0)
+    assert len(discriminator.conv_buckets) < len(filter_sizes)
+    input_x = tf.placeholder(tf.int32, [None, 20])
+    with tf.variable_scope('discriminator', reuse=True):
+        discriminator.fused_conv = False
+        per_width = discriminator.build_scores(input_x, 1.0)
+        discriminator.fused_conv = True
+        fused = discriminator.build_scores(input_x, 1.0)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    feed = {input_x: np.random.RandomState(0).randint(0, 30, [16, 20])}
+    np.testing.assert_allclose(*sess.run([per_width, fused], feed), rtol=1e-5, atol=1e-5)
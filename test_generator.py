@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from generator import Generator
+from rollout import ROLLOUT
+from target_lstm import TARGET_LSTM
+
+
+def one_hot_losses(model, rewards=None, floor=True):
+    # The losses as written before the sparse version: one_hot * log(softmax), clipped to 1e-20 for the Generator,
+    # from the logits of the same recurrence
+    x_t = tf.nn.embedding_lookup(model.g_emb, model.start_token)
+    h_t = model.h0
+    g_predictions = []
+    for i in range(model.seq_len):
+        h_t = model.g_recurrent_unit(x_t, h_t)
+        g_predictions.append(tf.nn.softmax(model.g_output_unit(h_t)))
+        x_t = model.processed_x[i]
+    g_pred = tf.reshape(tf.stack(g_predictions, 1), [-1, model.emb_num])
+    if floor:
+        g_pred = tf.clip_by_value(g_pred, 1e-20, 1.0)
+    token_log_prob = tf.reduce_sum(tf.one_hot(tf.reshape(model.x, [-1]), model.emb_num, 1.0, 0.0) * tf.log(g_pred), 1)
+    pretrain_loss = -tf.reduce_sum(token_log_prob) / (model.seq_len * model.batch_size)
+    g_loss = None if rewards is None else -tf.reduce_sum(token_log_prob * tf.reshape(rewards, [-1]))
+    return pretrain_loss, g_loss, token_log_prob
+
+
+def assert_losses_and_gradients_match(sess, feed, pairs, params):
+    for new, old in pairs:
+        new_value, old_value = sess.run([new, old], feed)
+        np.testing.assert_allclose(new_value, old_value, rtol=1e-4)
+        # Dense gradients, the embedding's are IndexedSlices
+        new_grads = [tf.convert_to_tensor(grad) for grad in tf.gradients(new, params)]
+        old_grads = [tf.convert_to_tensor(grad) for grad in tf.gradients(old, params)]
+        for new_grad, old_grad in zip(*sess.run([new_grads, old_grads], feed)):
+            np.testing.assert_allclose(new_grad, old_grad, rtol=1e-3, atol=1e-5 * np.abs(old_grad).max())
+
+
+def test_generator_sparse_losses_match_one_hot_formulation():
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    generator = Generator(30, 4, 8, 8, 6, 0)
+    old_pretrain_loss, old_g_loss, old_log_prob = one_hot_losses(generator, generator.rewards)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    rng = np.random.RandomState(0)
+    feed = {generator.x: rng.randint(0, 30, [4, 6]), generator.rewards: rng.rand(4, 6)}
+    pairs = [(generator.pretrain_loss, old_pretrain_loss), (generator.g_loss, old_g_loss)]
+    assert_losses_and_gradients_match(sess, feed, pairs, generator.g_params)
+
+    # Sharp outputs push some target probabilities below the 1e-20 clip, both versions floor them alike
+    sess.run(generator.Wo.assign(generator.Wo * 2000.0))
+    clipped = sess.run(old_log_prob, feed)
+    assert np.isclose(clipped, np.log(1e-20)).any() and clipped.min() >= np.log(1e-20) - 1e-3
+    assert_losses_and_gradients_match(sess, feed, pairs, generator.g_params)
+
+
+def test_target_lstm_sparse_loss_matches_one_hot_formulation():
+    tf.reset_default_graph()
+    rng = np.random.RandomState(0)
+    emb_num, emb_dim, hidden_dim = 30, 8, 8
+    params = [rng.normal(size=shape).astype(np.float32) for shape in
+              ([emb_num, emb_dim], [emb_dim + hidden_dim, 4 * hidden_dim], [4 * hidden_dim], [hidden_dim, emb_num], [emb_num])]
+    target_lstm = TARGET_LSTM(emb_num, 4, emb_dim, hidden_dim, 6, 0, params)
+    # The oracle's loss was never clipped
+    old_pretrain_loss, _, old_log_prob = one_hot_losses(target_lstm, floor=False)
+    old_out_loss = -tf.reduce_sum(tf.reshape(old_log_prob, [-1, 6]), 1)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    feed = {target_lstm.x: rng.randint(0, emb_num, [4, 6])}
+    pairs = [(target_lstm.pretrain_loss, old_pretrain_loss), (target_lstm.out_loss, old_out_loss)]
+    assert_losses_and_gradients_match(sess, feed, pairs, target_lstm.g_params)
+
+
+def test_adaptive_target_log_prob_matches_full_distribution():
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    # Head of 20 tokens, tail clusters [20, 50) and [50, 100)
+    generator = Generator(100, 4, 8, 16, 6, 0, softmax='adaptive', cutoffs=(20, 50))
+    hidden_state = tf.constant(np.random.RandomState(0).normal(size=[12, 16]).astype(np.float32))
+    # Tokens of every cluster, cluster boundaries included
+    labels = tf.constant([0, 19, 20, 21, 49, 50, 51, 99, 5, 30, 70, 19])
+    full = generator.adaptive_log_prob(hidden_state, generator.output_params)
+    target = generator.adaptive_target_log_prob(hidden_state, labels, generator.output_params)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    full_value, target_value, labels_value = sess.run([full, target, labels])
+
+    assert full_value.shape == (12, 100)
+    np.testing.assert_allclose(np.exp(full_value).sum(1), 1.0, rtol=1e-5)
+    np.testing.assert_allclose(target_value, full_value[np.arange(12), labels_value], rtol=1e-6, atol=1e-6)
+
+
+def test_adaptive_cutoffs_are_clamped_to_vocabulary():
+    tf.reset_default_graph()
+    assert Generator(30, 4, 8, 8, 6, 0, softmax='adaptive', cutoffs=(20, 50)).cutoffs == [20, 30]
+    # Every cutoff beyond the vocabulary, the head is the whole softmax
+    generator = Generator(30, 4, 8, 8, 6, 0, softmax='adaptive', cutoffs=(2000, 10000))
+    assert generator.cutoffs == [30]
+    assert len(generator.output_params) == 2
+    log_prob = generator.adaptive_log_prob(tf.ones([3, 8]), generator.output_params)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    np.testing.assert_allclose(np.exp(sess.run(log_prob)).sum(1), 1.0, rtol=1e-5)
+
+
+@pytest.mark.parametrize('softmax', ['sampled', 'adaptive'])
+def test_reduced_softmax_modes_train_and_roll_out(softmax):
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    generator = Generator(100, 4, 8, 16, 6, 0, softmax=softmax, num_sampled=10, cutoffs=(20, 50))
+    rollout = ROLLOUT(generator, 0.8)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    rng = np.random.RandomState(0)
+    x = rng.randint(0, 100, [4, 6])
+
+    losses = [generator.pretrain_step(sess, x)[1] for _ in range(20)]
+    assert np.isfinite(losses).all() and losses[-1] < losses[0]
+    sess.run(generator.g_updates, {generator.x: x, generator.rewards: rng.rand(4, 6)})
+
+    before = sess.run(rollout.params)
+    rollout.update_params(sess)
+    after = sess.run(rollout.params)
+    assert any(not np.allclose(old, new) for old, new in zip(before, after))
+    samples = sess.run(rollout.gen_x, {rollout.x: x, rollout.given_num: 3})
+    assert samples.shape == (4, 6) and ((0 <= samples) & (samples < 100)).all()
+    np.testing.assert_array_equal(samples[:, :3], x[:, :3])
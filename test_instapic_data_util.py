@@ -0,0 +1,43 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+from instapic_data_util import UNK_ID, get_tfidf_words, top_k_tfidf
+
+
+def test_top_k_tfidf_orders_by_weight_then_token_id():
+    tfidf = sparse.csr_matrix(np.array([[0.0, 0.5, 0.2, 0.5, 0.9, 0.2],
+                                        [0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                                        [0.3, 0.0, 0.0, 0.0, 0.0, 0.1]]))
+    top_ids = top_k_tfidf(tfidf, 4)
+    assert top_ids[0].tolist() == [4, 1, 3, 2]
+    assert top_ids[1].tolist() == []
+    assert top_ids[2].tolist() == [0, 5]
+
+
+def test_get_tfidf_words_matches_dense_weights():
+    rng = np.random.RandomState(0)
+    vocab = ['_pad', '_go', '_eos', '_unk'] + [f'w{i}' for i in range(200)]
+    rev_vocab = {token: i for i, token in enumerate(vocab)}
+
+    def split(num_users):
+        return {f'u{u}': {f'p{p}': [f'w{i}' if i < 200 else 'oov' for i in rng.randint(0, 210, rng.randint(1, 150))]
+                          for p in range(rng.randint(1, 4))} for u in range(num_users)}
+
+    splits = [split(40), split(10), split(10)]
+    results = get_tfidf_words(*splits, vocab, rev_vocab, chunk_size=7)
+
+    def dense(all_tokens):
+        counts = np.zeros([len(all_tokens), len(vocab)])
+        for i, posts in enumerate(all_tokens.values()):
+            for tokens in posts.values():
+                for token in tokens:
+                    counts[i, rev_vocab.get(token, UNK_ID)] += 1
+        return counts
+
+    transformer = TfidfTransformer().fit(dense(splits[0]))
+    for all_tokens, user_tokens in zip(splits, results):
+        weights = transformer.transform(dense(all_tokens)).toarray()
+        for i, user_id in enumerate(all_tokens):
+            # The 100 largest weights in decreasing order, minus the unknown token
+            expected = [token_id for token_id in np.argsort(-weights[i], kind='stable')[:100] if weights[i, token_id] > 0]
+            assert user_tokens[user_id] == [vocab[token_id] for token_id in expected if token_id != UNK_ID]
@@ -0,0 +1,50 @@
+import json
+import pytest
+from instapic_stream import first_users, iter_posts
+
+
+def write_dump(path):
+    dump = {
+        'u1': {'p1': {'caption': 'sunny day ☀ #beach', 'tags': ['beach', 'sun'], 'm_id': 1},
+               'p2': {'caption': 'escaped "quotes" and \\ backslash', 'tags': [], 'm_id': 12345}},
+        'u2': {},
+        'ué': {'p3': {'caption': '\U0001f600 emoji', 'tags': ['x'], 'm_id': 3.5, 'nested': {'a': [1, 2, {'b': None}]}}},
+    }
+    with open(path, 'w') as f:
+        json.dump(dump, f, indent=1)
+    return dump
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_iter_posts_matches_json_load(tmp_path, chunk_size):
+    dump = write_dump(tmp_path / 'dump.json')
+    expected = [(user_id, post_id, post) for user_id, posts in dump.items() for post_id, post in posts.items()]
+    assert list(iter_posts(tmp_path / 'dump.json', chunk_size)) == expected
+
+
+def test_iter_posts_rejects_truncated_file(tmp_path):
+    write_dump(tmp_path / 'dump.json')
+    text = (tmp_path / 'dump.json').read_text()
+    (tmp_path / 'truncated.json').write_text(text[:len(text) // 2])
+    with pytest.raises(ValueError):
+        list(iter_posts(tmp_path / 'truncated.json', 7))
+
+
+def test_first_users(tmp_path):
+    write_dump(tmp_path / 'dump.json')
+    assert [post_id for _, post_id, _ in first_users(iter_posts(tmp_path / 'dump.json'), 1)] == ['p1', 'p2']
+
+
+def test_iter_posts_marks_empty_users(tmp_path):
+    write_dump(tmp_path / 'dump.json')
+    records = list(iter_posts(tmp_path / 'dump.json', 7, empty_users=True))
+    assert [(user_id, post_id) for user_id, post_id, _ in records] == [('u1', 'p1'), ('u1', 'p2'), ('u2', None), ('ué', 'p3')]
+    assert records[2] == ('u2', None, None)
+
+
+def test_first_users_counts_empty_users(tmp_path):
+    # Like taking the first users of the loaded dict, an empty first user is one of them
+    dump = {'u0': {}, 'u1': {'p1': {'caption': 'a'}}, 'u2': {'p2': {'caption': 'b'}}}
+    (tmp_path / 'dump.json').write_text(json.dumps(dump))
+    assert [post_id for _, post_id, _ in first_users(iter_posts(tmp_path / 'dump.json', empty_users=True), 2)] == ['p1']
+    assert [post_id for _, post_id, _ in first_users(iter_posts(tmp_path / 'dump.json', empty_users=True), 1)] == []
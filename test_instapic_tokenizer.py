@@ -0,0 +1,29 @@
+import random
+from collections import Counter
+from instapic_data_util import tokenize
+from instapic_tokenizer import ParallelTokenizer, tokenize_fast
+
+PIECES = list("aZz09 #@_-.!?,\"'\n\\uUf") + ['\\u12ab', '\\U0001f600', '\U0001f600', '☀', '\U0001f680', 'İ',
+                                            'K', '@@byeongchang', 'é', '\t', '—', 'ab', '--', '_x']
+
+
+def random_sentences(num_sentences, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(PIECES) for _ in range(rng.randint(0, 25))) for _ in range(num_sentences)]
+
+
+def test_tokenize_fast_matches_tokenize():
+    for sentence in random_sentences(20000) + [['a#b', 'C\U0001f600'], 'Hi @John.Doe! #tbt \\u00e9 so_happy - New-York ❤❤']:
+        assert tokenize_fast(sentence) == tokenize(sentence), repr(sentence)
+
+
+def test_parallel_tokenizer_keeps_order_and_merges_counts():
+    sentences = random_sentences(2500, seed=1)
+    posts = [(str(i // 10), str(i), dict(caption=sentence)) for i, sentence in enumerate(sentences)]
+    tokenizer = ParallelTokenizer(processes=2, chunk_size=100, max_pending=3)
+    counter = Counter()
+    results = list(tokenizer.tokenize_posts(iter(posts), 'caption', counter))
+    tokenizer.close()
+    expected = [tokenize(sentence) for sentence in sentences]
+    assert results == [(user_id, post_id, tokens) for (user_id, post_id, _), tokens in zip(posts, expected)]
+    assert counter == Counter(token for tokens in expected for token in tokens)
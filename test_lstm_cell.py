@@ -0,0 +1,57 @@
+import numpy as np
+import tensorflow as tf
+from lstm_cell import convert_checkpoint, fuse_lstm_params, lstm_unit, split_lstm_params
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def test_fused_cell_matches_separate_gates():
+    rng = np.random.RandomState(0)
+    emb_dim, hidden_dim, batch_size = 3, 5, 4
+    W_i, U_i, b_i, W_f, U_f, b_f, W_o, U_o, b_o, W_c, U_c, b_c = params = [
+        rng.normal(size=shape).astype(np.float32)
+        for _ in range(4) for shape in ([emb_dim, hidden_dim], [hidden_dim, hidden_dim], [hidden_dim])]
+    x, h, c = [rng.normal(size=[batch_size, dim]).astype(np.float32) for dim in (emb_dim, hidden_dim, hidden_dim)]
+
+    i = sigmoid(x @ W_i + h @ U_i + b_i)
+    f = sigmoid(x @ W_f + h @ U_f + b_f)
+    o = sigmoid(x @ W_o + h @ U_o + b_o)
+    c_expected = f * c + i * np.tanh(x @ W_c + h @ U_c + b_c)
+    h_expected = o * np.tanh(c_expected)
+
+    tf.reset_default_graph()
+    W, b = fuse_lstm_params(*params)
+    h_t, c_t = tf.Session().run(lstm_unit(tf.constant(W), tf.constant(b))(tf.constant(x), (tf.constant(h), tf.constant(c))))
+    np.testing.assert_allclose(h_t, h_expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(c_t, c_expected, rtol=1e-5, atol=1e-5)
+    for split, param in zip(split_lstm_params(W, b, emb_dim), params):
+        np.testing.assert_array_equal(split, param)
+
+
+def test_convert_checkpoint_fuses_gate_variables(tmp_path):
+    rng = np.random.RandomState(0)
+    emb_dim, hidden_dim, vocab = 3, 5, 7
+    legacy = [rng.normal(size=[vocab, emb_dim])]
+    legacy += [rng.normal(size=shape) for _ in range(4) for shape in ([emb_dim, hidden_dim], [hidden_dim, hidden_dim], [hidden_dim])]
+    legacy += [rng.normal(size=[hidden_dim, vocab]), rng.normal(size=[vocab])]
+
+    with tf.Graph().as_default():
+        lr = tf.Variable(0.01)
+        with tf.variable_scope('generator'):
+            variables = [tf.Variable(value) for value in legacy]
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, str(tmp_path / 'legacy'))
+
+    convert_checkpoint(str(tmp_path / 'legacy'), str(tmp_path / 'fused'))
+    reader = tf.train.load_checkpoint(str(tmp_path / 'fused'))
+    W, b = fuse_lstm_params(*legacy[1:13])
+    np.testing.assert_array_equal(reader.get_tensor('generator/Variable'), legacy[0])
+    np.testing.assert_array_equal(reader.get_tensor('generator/Variable_1'), W)
+    np.testing.assert_array_equal(reader.get_tensor('generator/Variable_2'), b)
+    np.testing.assert_array_equal(reader.get_tensor('generator/Variable_3'), legacy[13])
+    np.testing.assert_array_equal(reader.get_tensor('generator/Variable_4'), legacy[14])
+    assert not reader.has_tensor('generator/Variable_5')
+    assert reader.get_tensor('Variable') == np.float32(0.01)
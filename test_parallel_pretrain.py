@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from generator import Generator
+from parallel_pretrain import DataParallelPretrainer, shard
+
+GENERATOR_CONFIG = dict(emb_num=10, batch_size=4, emb_dim=8, hidden_dim=8, seq_len=6, start_token=0)
+
+
+def write_data(path, num_rows):
+    rng = np.random.RandomState(0)
+    with open(path, 'w') as f:
+        for row in rng.randint(0, GENERATOR_CONFIG['emb_num'], [num_rows, GENERATOR_CONFIG['seq_len']]):
+            f.write(' '.join(str(token) for token in row) + '\n')
+
+
+def test_shards_are_disjoint_and_cover_every_row():
+    rows = np.arange(11)
+    shards = [shard(rows, rank, 3) for rank in range(3)]
+    assert sorted(np.concatenate(shards)) == list(rows)
+    assert [len(rows) for rows in shards] == [4, 4, 3]
+
+
+def test_two_local_workers_train_and_load_averaged_params(tmp_path):
+    data_file = str(tmp_path / 'data.txt')
+    # 18 rows, so the shards of the two workers have 9 rows, 2 batches each
+    write_data(data_file, 18)
+    tf.reset_default_graph()
+    generator = Generator(**GENERATOR_CONFIG)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    initial = sess.run(generator.g_params)
+
+    pretrainer = DataParallelPretrainer(GENERATOR_CONFIG, data_file, ['localhost'] * 2, sync_every=1, timeout=120)
+    # Keep the workers' replies of every round
+    replies = []
+    receive_all = pretrainer.receive_all
+    pretrainer.receive_all = lambda: replies.append(receive_all()) or replies[-1]
+    try:
+        assert pretrainer.server.getsockname()[0] == '127.0.0.1'
+        assert pretrainer.shard_rows == [9, 9]
+        assert pretrainer.steps_per_epoch == 2
+        loss = pretrainer.train_epoch(sess, generator)
+        trained = sess.run(generator.g_params)
+    finally:
+        pretrainer.close()
+        sess.close()
+
+    assert np.isfinite(loss) and loss > 0
+    # One round per step, the main generator ends with the average of the workers' last parameters
+    assert len(replies) == 2
+    (params_0, _), (params_1, _) = replies[-1]
+    for value, start, worker_0, worker_1 in zip(trained, initial, params_0, params_1):
+        np.testing.assert_allclose(value, (worker_0 + worker_1) / 2, rtol=1e-6)
+    assert any(not np.allclose(value, start) for value, start in zip(trained, initial))
+    # The workers trained on different shards, so they ended apart
+    assert any(not np.allclose(worker_0, worker_1) for worker_0, worker_1 in zip(params_0, params_1))
+
+
+def test_dead_worker_raises_instead_of_hanging(tmp_path):
+    # The worker fails to load a missing data file after connecting
+    with pytest.raises(RuntimeError, match='Pretraining worker 0'):
+        DataParallelPretrainer(GENERATOR_CONFIG, str(tmp_path / 'missing.txt'), ['localhost'], timeout=120)
@@ -0,0 +1,50 @@
+import time
+import pytest
+from pipeline import Pipeline
+
+
+def test_items_consumed_in_order_with_bounded_lead():
+    produced = []
+    consumed = []
+
+    def produce():
+        produced.append(len(produced))
+        return produced[-1]
+
+    def consume(item):
+        time.sleep(0.01)
+        consumed.append(item)
+        # At most one item in the queue and one held by the producer waiting to put it
+        assert len(produced) - len(consumed) <= 2
+
+    pipeline = Pipeline(produce, consume, queue_size=1)
+    pipeline.run(5)
+    assert consumed == [0, 1, 2, 3, 4]
+    summary = pipeline.summary()
+    assert summary['items'] == 5
+    assert summary['consume_seconds'] >= 0.05
+    # The consumer is the slow side, so the producer waited on the full queue
+    assert summary['producer_wait_seconds'] > summary['consumer_wait_seconds']
+
+
+def test_producer_error_reaches_consumer():
+    def produce():
+        raise RuntimeError('sampling failed')
+
+    with pytest.raises(RuntimeError, match='sampling failed'):
+        Pipeline(produce, lambda item: None).run(3)
+
+
+def test_consumer_error_stops_producer():
+    produced = []
+
+    def produce():
+        produced.append(len(produced))
+        return produced[-1]
+
+    def consume(item):
+        raise ValueError('training failed')
+
+    with pytest.raises(ValueError, match='training failed'):
+        Pipeline(produce, consume, queue_size=1).run(100)
+    assert len(produced) < 100
@@ -0,0 +1,52 @@
+import json
+import threading
+import tensorflow as tf
+from profiler import Profiler
+
+
+def test_phases_and_traced_iterations(tmp_path):
+    profiler = Profiler(str(tmp_path), trace_iterations=[1])
+    with tf.Graph().as_default():
+        x = tf.constant(2.0) * 3.0
+        sess = profiler.session(tf.Session())
+        for iteration in range(3):
+            profiler.start_iteration(iteration)
+            with profiler.phase('adversarial'):
+                with profiler.phase('generate'):
+                    assert sess.run(x) == 6.0
+                    assert sess.run(x) == 6.0
+
+    summary = profiler.summary()
+    assert list(summary) == ['adversarial/generate', 'adversarial']
+    assert summary['adversarial']['calls'] == 3
+    assert summary['adversarial/generate']['p50'] <= summary['adversarial/generate']['max']
+    # Only iteration 1 is traced, one Chrome trace per sess.run
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['iteration-1-run-0.json', 'iteration-1-run-1.json']
+    assert 'traceEvents' in json.loads((tmp_path / 'iteration-1-run-0.json').read_text())
+
+
+def test_phases_and_traces_from_other_threads(tmp_path):
+    profiler = Profiler(str(tmp_path), trace_iterations=[0])
+    profiler.start_iteration(0)
+    with tf.Graph().as_default():
+        x = tf.constant(2.0) * 3.0
+        sess = profiler.session(tf.Session())
+
+        def work():
+            with profiler.phase('produce'):
+                for _ in range(5):
+                    sess.run(x)
+
+        with profiler.phase('pipeline'):
+            threads = [threading.Thread(target=work) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    # Phases of other threads nest under the open phases of the main thread
+    summary = profiler.summary()
+    assert list(summary) == ['pipeline/produce', 'pipeline']
+    assert summary['pipeline/produce']['calls'] == 4
+    # Every traced run got its own file
+    assert len(list(tmp_path.iterdir())) == 20
@@ -0,0 +1,48 @@
+import numpy as np
+import tensorflow as tf
+from discriminator import Discriminator
+from reward_scorer import PRECISIONS, RewardScorer
+
+
+def test_scorers_follow_discriminator_after_refresh():
+    tf.reset_default_graph()
+    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=30, emb_size=8, filter_sizes=[1, 2, 3, 10, 20],
+                                  num_filters=[3, 4, 4, 2, 2])
+    scorers = {precision: RewardScorer(discriminator, precision) for precision in PRECISIONS}
+    input_x = tf.placeholder(tf.int32, [None, 20])
+    expected = discriminator.build_reward(input_x)
+    rewards = {precision: scorer.build_reward(input_x) for precision, scorer in scorers.items()}
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    feed = {input_x: np.random.RandomState(0).randint(0, 30, [16, 20])}
+    # Shift the discriminator away from the weights the scorers were initialised with
+    sess.run(discriminator.W_out.assign(discriminator.W_out * 3.0))
+    for scorer in scorers.values():
+        scorer.refresh(sess)
+
+    tolerance = {'float32': 1e-5, 'float16': 1e-2, 'bfloat16': 5e-2, 'int8': 5e-2}
+    for precision, reward in rewards.items():
+        np.testing.assert_allclose(*sess.run([reward, expected], feed), atol=tolerance[precision])
+
+
+def test_scorer_applies_every_highway_layer():
+    tf.reset_default_graph()
+    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=30, emb_size=8, filter_sizes=[1, 2, 3],
+                                  num_filters=[3, 4, 4], highway_layers=2)
+    # Checkpoint names are those of the layers built by linear_function
+    assert [var.name for var in discriminator.highway_params[1]] == [
+        'discriminator/Highway/highway_lin_1/Matrix:0', 'discriminator/Highway/highway_lin_1/Bias:0',
+        'discriminator/Highway/highway_gate_1/Matrix:0', 'discriminator/Highway/highway_gate_1/Bias:0']
+    scorer = RewardScorer(discriminator, 'float32')
+    input_x = tf.placeholder(tf.int32, [None, 20])
+    expected = discriminator.build_reward(input_x)
+    reward = scorer.build_reward(input_x)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    # Make the second layer matter before refreshing
+    sess.run(discriminator.highway_params[1][0].assign(discriminator.highway_params[1][0] * 3.0))
+    scorer.refresh(sess)
+    feed = {input_x: np.random.RandomState(0).randint(0, 30, [16, 20])}
+    np.testing.assert_allclose(*sess.run([reward, expected], feed), atol=1e-5)
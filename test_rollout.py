@@ -0,0 +1,152 @@
+import numpy as np
+import tensorflow as tf
+from discriminator import Discriminator
+from generator import Generator
+from rollout import ROLLOUT, RewardCache
+
+
+def build_rollout(update_rate=0.8):
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    generator = Generator(50, 4, 8, 8, 20, 0)
+    rollout = ROLLOUT(generator, update_rate)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    return sess, generator, rollout
+
+
+def build_reward_rollout():
+    # A rollout whose completions are deterministic: every sampled token is 7, while the prefixes are the input's
+    sess, generator, rollout = build_rollout()
+    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=50, emb_size=8, filter_sizes=[2, 3], num_filters=[4, 4])
+    sess.run(tf.global_variables_initializer())
+    Wo, bo = rollout.output_params
+    Wo.load(np.zeros([8, 50]), sess)
+    bo.load(np.where(np.arange(50) == 7, 1e4, 0.0), sess)
+    input_x = np.random.RandomState(0).randint(0, 50, [4, 20])
+    return sess, rollout, discriminator, input_x
+
+
+def host_reward(sess, discriminator, rows):
+    return sess.run(discriminator.ypred_for_auc, {discriminator.input_x: rows, discriminator.dropout_keep_prob: 1.0})[:, 1]
+
+
+def test_batched_rewards_match_per_given_num_loop():
+    sess, rollout, discriminator, input_x = build_reward_rollout()
+    expected = rollout.get_reward(sess, input_x, 2, discriminator)
+    # Small chunks, so the prefix states are reused across several runs
+    rewards = rollout.get_reward_batched(sess, input_x, 2, discriminator, max_rows=16)
+    assert rewards.shape == (4, 20)
+    np.testing.assert_allclose(rewards, expected, rtol=1e-5)
+    # The completions differ per given_num, so the rewards do too
+    assert np.std(rewards) > 0
+
+
+def test_in_graph_rewards_match_host_side_sum():
+    sess, rollout, discriminator, input_x = build_reward_rollout()
+    given_num = np.repeat(np.arange(1, 20, dtype=np.int32), 2 * 4)
+    src = np.tile(np.arange(4, dtype=np.int32), 19 * 2)
+    total, total_sq, last = rollout.score_rows(sess, input_x, src, given_num, discriminator, 32)
+
+    completions = sess.run(rollout.batch_gen_x, {rollout.batch_x: input_x, rollout.batch_src: src, rollout.batch_given_num: given_num})
+    # Each completion keeps its sample's prefix
+    for row, sample, n in zip(completions, src, given_num):
+        np.testing.assert_array_equal(row[:n], input_x[sample, :n])
+        assert (row[n:] == 7).all()
+    ypred = host_reward(sess, discriminator, completions)
+    expected = np.zeros([4, 19])
+    expected_sq = np.zeros([4, 19])
+    np.add.at(expected, (src, given_num - 1), ypred)
+    np.add.at(expected_sq, (src, given_num - 1), ypred ** 2)
+    np.testing.assert_allclose(total, expected, rtol=1e-5)
+    np.testing.assert_allclose(total_sq, expected_sq, rtol=1e-5)
+    np.testing.assert_allclose(last, host_reward(sess, discriminator, input_x), rtol=1e-5)
+
+
+def test_update_params_keeps_graph_size_constant():
+    sess, _, rollout = build_rollout()
+    num_ops = len(tf.get_default_graph().get_operations())
+    for _ in range(10):
+        rollout.update_params(sess)
+    assert len(tf.get_default_graph().get_operations()) == num_ops
+
+
+def test_update_params_blends_towards_generator():
+    sess, generator, rollout = build_rollout(update_rate=0.8)
+    old_W_lstm = sess.run(rollout.W_lstm)
+    sess.run(generator.W_lstm.assign(generator.W_lstm + 1.0))
+    sess.run(generator.g_emb.assign(generator.g_emb + 1.0))
+    rollout.update_params(sess)
+
+    new_W_lstm, generator_W_lstm = sess.run([rollout.W_lstm, generator.W_lstm])
+    np.testing.assert_allclose(new_W_lstm, 0.8 * old_W_lstm + 0.2 * generator_W_lstm, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(*sess.run([rollout.g_emb, generator.g_emb]))
+
+
+def test_reward_cache_evicts_least_recently_used_and_invalidates():
+    cache = RewardCache(2)
+    cache.sync(0)
+    cache.insert([b'a', b'b'], [0.1, 0.2])
+    assert cache.lookup([b'a'])[0] == 0.1
+    cache.insert([b'c'], [0.3])
+    rewards = cache.lookup([b'a', b'b', b'c'])
+    assert rewards[0] == 0.1 and np.isnan(rewards[1]) and rewards[2] == 0.3
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.sync(1)
+    assert np.isnan(cache.lookup([b'a'])).all()
+    assert cache.invalidations == 1
+
+
+class ConstantReward(object):
+    # Reward model scoring every sequence 0.5, so every prefix has zero variance
+    def build_reward(self, input_x):
+        return tf.fill([tf.shape(input_x)[0]], 0.5)
+
+
+def build_adaptive_rollout():
+    sess, generator, rollout = build_rollout()
+    discriminator = Discriminator(seq_len=20, num_classes=2, vocab_size=50, emb_size=8, filter_sizes=[2, 3], num_filters=[4, 4])
+    sess.run(tf.global_variables_initializer())
+    # Sharper discriminator scores, so the rollouts of a prefix disagree more
+    sess.run(discriminator.W_out.assign(discriminator.W_out * 5.0))
+    input_x = np.random.RandomState(0).randint(0, 50, [4, 20])
+    return sess, rollout, discriminator, input_x
+
+
+def test_adaptive_zero_variance_stops_at_min_rollout_num():
+    sess, rollout, _, input_x = build_adaptive_rollout()
+    rewards, count = rollout.get_reward_adaptive(sess, input_x, ConstantReward(), max_rollout_num=16, min_rollout_num=4)
+    assert (count == 4).all()
+    np.testing.assert_allclose(rewards, 0.5)
+
+
+def test_adaptive_zero_tolerance_spends_max_rollout_num():
+    sess, rollout, discriminator, input_x = build_adaptive_rollout()
+    _, count = rollout.get_reward_adaptive(sess, input_x, discriminator, max_rollout_num=10, min_rollout_num=4, tolerance=0.0,
+                                           rollouts_per_round=4)
+    # 4 + 4 + 2, the last round is cut at max_rollout_num
+    assert (count == 10).all()
+
+
+def test_adaptive_rewards_are_means_over_spent_rollouts():
+    sess, rollout, discriminator, input_x = build_adaptive_rollout()
+    # Record every scored row and its reward sum
+    spent = np.zeros([4, 19])
+    total = np.zeros([4, 19])
+    score_rows = rollout.score_rows
+
+    def recording_score_rows(sess, input_x, src, given_num, discriminator, max_rows):
+        result = score_rows(sess, input_x, src, given_num, discriminator, max_rows)
+        np.add.at(spent, (src, given_num - 1), 1)
+        total[:] += result[0]
+        return result
+
+    rollout.score_rows = recording_score_rows
+    rewards, count = rollout.get_reward_adaptive(sess, input_x, discriminator, max_rollout_num=16, min_rollout_num=2,
+                                                 tolerance=0.01, rollouts_per_round=2)
+    np.testing.assert_array_equal(count, spent)
+    np.testing.assert_allclose(rewards[:, :-1], total / spent, rtol=1e-6)
+    # The last token reward is the complete sequences' score
+    np.testing.assert_allclose(rewards[:, -1], host_reward(sess, discriminator, input_x), rtol=1e-5)
+    # Some prefixes stopped early, others needed more rollouts
+    assert count.min() < count.max()
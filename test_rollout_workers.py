@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from discriminator import Discriminator
+from generator import Generator
+from rollout import ROLLOUT
+from rollout_workers import RolloutWorkerPool
+
+GENERATOR_CONFIG = dict(emb_num=30, batch_size=5, emb_dim=8, hidden_dim=8, seq_len=10, start_token=0)
+DISCRIMINATOR_CONFIG = dict(seq_len=10, num_classes=2, vocab_size=30, emb_size=8, filter_sizes=[2, 3], num_filters=[4, 4])
+
+
+def test_pool_matches_in_process_rewards_after_sync():
+    tf.reset_default_graph()
+    generator = Generator(**GENERATOR_CONFIG)
+    discriminator = Discriminator(**DISCRIMINATOR_CONFIG)
+    rollout = ROLLOUT(generator, 0.8)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    # Deterministic completions (every sampled token is 7), so the workers and this process complete alike
+    Wo, bo = rollout.output_params
+    Wo.load(np.zeros([8, 30]), sess)
+    bo.load(np.where(np.arange(30) == 7, 1e4, 0.0), sess)
+    samples = np.random.RandomState(0).randint(0, 30, [5, 10])
+    expected = rollout.get_reward_batched(sess, samples, 2, discriminator)
+
+    # The workers start from their own random weights, sync replaces them with these
+    pool = RolloutWorkerPool(2, GENERATOR_CONFIG, DISCRIMINATOR_CONFIG, timeout=120)
+    try:
+        pool.sync(sess, rollout, discriminator)
+        # 5 rows over 2 workers, chunks of 3 and 2 rows
+        first = pool.submit(samples, 2)
+        second = pool.submit(samples[::-1], 2)
+        np.testing.assert_allclose(pool.result(second), expected[::-1], rtol=1e-5)
+        np.testing.assert_allclose(pool.result(first), expected, rtol=1e-5)
+    finally:
+        pool.close()
+        sess.close()
+
+
+def test_failed_worker_raises_instead_of_hanging():
+    # Building the discriminator fails in the workers
+    pool = RolloutWorkerPool(1, GENERATOR_CONFIG, dict(DISCRIMINATOR_CONFIG, num_filters=[4]), timeout=120)
+    try:
+        ticket = pool.submit(np.zeros([2, 10], dtype=np.int32), 1)
+        with pytest.raises(RuntimeError, match='Rollout worker 0 failed'):
+            pool.result(ticket)
+    finally:
+        pool.close()
+
+
+def test_dead_worker_raises_instead_of_hanging():
+    pool = RolloutWorkerPool(2, GENERATOR_CONFIG, DISCRIMINATOR_CONFIG, timeout=120)
+    try:
+        pool.workers[1].terminate()
+        ticket = pool.submit(np.zeros([4, 10], dtype=np.int32), 1)
+        with pytest.raises(RuntimeError, match='Rollout worker 1 exited'):
+            pool.result(ticket)
+    finally:
+        pool.close()
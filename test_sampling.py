@@ -0,0 +1,34 @@
+import numpy as np
+import tensorflow as tf
+from sampling import sample_from_logits
+
+# Probabilities 0.4, 0.3, 0.2, 0.1 in a shuffled order, the top 2 are tokens 3 and 0
+PROBS = np.array([0.3, 0.1, 0.2, 0.4])
+
+
+def draw(num_draws=2000, **kwargs):
+    with tf.Graph().as_default():
+        logits = tf.constant(np.log(np.tile(PROBS, [num_draws, 1])), tf.float32)
+        tf.set_random_seed(0)
+        with tf.Session() as sess:
+            return sess.run(sample_from_logits(logits, **kwargs))
+
+
+def test_top_k_draws_only_the_k_most_likely():
+    tokens = draw(top_k=2)
+    assert set(tokens) == {0, 3}
+    # Renormalised over the kept tokens, 0.4 / 0.7
+    assert abs(np.mean(tokens == 3) - 4 / 7) < 0.05
+
+
+def test_top_p_draws_only_the_smallest_set_reaching_p():
+    # 0.4 + 0.3 reaches 0.6, token 2 is not needed
+    assert set(draw(top_p=0.6)) == {0, 3}
+    # 0.4 alone is below 0.45, so the next token is kept too and nothing else
+    assert set(draw(top_p=0.45)) == {0, 3}
+    assert set(draw(top_p=0.35)) == {3}
+    assert set(draw(top_p=0.8)) == {0, 2, 3}
+
+
+def test_no_filtering_draws_every_token():
+    assert set(draw()) == {0, 1, 2, 3}
@@ -0,0 +1,86 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import tensorflow as tf
+import seqGAN
+from generator import Generator
+from seqGAN import generate_samples, generation_rows
+
+
+def build_generator():
+    tf.reset_default_graph()
+    generator = Generator(30, 4, 8, 8, 6, 0)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    return sess, generator
+
+
+def test_generate_samples_returns_exactly_generated_num_rows(tmp_path):
+    sess, generator = build_generator()
+    run_rows = []
+    generate = generator.generate
+    generator.generate = lambda sess, num_samples: run_rows.append(num_samples) or generate(sess, num_samples)
+
+    samples = generate_samples(sess, generator, 1000, str(tmp_path / 'samples.txt'), batch_rows=64)
+    assert samples.shape == (1000, 6)
+    # 15 full runs and the 40 rows left, independent of the training batch size
+    assert run_rows == [64] * 15 + [40]
+    # The file streams the same rows, one per line
+    np.testing.assert_array_equal(np.loadtxt(tmp_path / 'samples.txt', dtype=np.int64, ndmin=2), samples)
+
+    run_rows.clear()
+    assert generate_samples(sess, generator, 128, batch_rows=64).shape == (128, 6)
+    assert generate_samples(sess, generator, 3, batch_rows=64).shape == (3, 6)
+    assert run_rows == [64, 64, 3]
+
+
+def test_generation_rows_fit_the_memory_budget(monkeypatch):
+    monkeypatch.setattr(seqGAN, 'GEN_MEMORY_BYTES', 2 ** 23)
+    model = SimpleNamespace(emb_num=100, hidden_dim=32, emb_dim=32)
+    row_bytes = 4 * (4 * 100 + 8 * 32 + 32)
+    assert seqGAN.GEN_MIN_ROWS < 2 ** 23 // row_bytes < seqGAN.GEN_MAX_ROWS
+    assert generation_rows(model) == 2 ** 23 // row_bytes
+    # Clamped to the bounds for very large and very small rows
+    assert generation_rows(SimpleNamespace(emb_num=10 ** 6, hidden_dim=32, emb_dim=32)) == seqGAN.GEN_MIN_ROWS
+    assert generation_rows(model, memory_bytes=2 ** 40) == seqGAN.GEN_MAX_ROWS
+
+
+def test_pretrain_key_follows_settings_and_data_contents(tmp_path, monkeypatch):
+    data_file = tmp_path / 'real.txt'
+    data_file.write_text('1 2 3\n4 5 6\n')
+    monkeypatch.setattr(seqGAN, 'positive_file', str(data_file))
+    generator_config = dict(emb_num=30, batch_size=4, emb_dim=8, hidden_dim=8, seq_len=3, start_token=0)
+    discriminator_config = dict(seq_len=3, num_classes=2, vocab_size=30, emb_size=8, filter_sizes=[1, 2], num_filters=[4, 4])
+    key = lambda: seqGAN.pretrain_key(generator_config, discriminator_config)[0]
+    base = key()
+    assert key() == base
+
+    # Touched only, the contents are the same
+    os.utime(data_file, ns=(0, os.stat(data_file).st_mtime_ns + 10 ** 9))
+    assert key() == base
+
+    changed = []
+    data_file.write_text('1 2 3\n4 5 7\n')
+    changed.append(key())
+    data_file.write_text('1 2 3\n4 5 6\n')
+    assert key() == base
+
+    monkeypatch.setattr(seqGAN, 'SEED', seqGAN.SEED + 1)
+    changed.append(key())
+    monkeypatch.undo()
+    monkeypatch.setattr(seqGAN, 'positive_file', str(data_file))
+
+    generator_config['hidden_dim'] = 16
+    changed.append(key())
+    generator_config['hidden_dim'] = 8
+    discriminator_config['num_filters'] = [4, 8]
+    changed.append(key())
+    discriminator_config['num_filters'] = [4, 4]
+    assert key() == base
+
+    monkeypatch.setattr(seqGAN, 'PRETRAIN_HOSTS', ['localhost'] * 2)
+    changed.append(key())
+    monkeypatch.setattr(seqGAN, 'PRETRAIN_HOSTS', ['localhost'] * 3)
+    changed.append(key())
+
+    assert len(set(changed + [base])) == len(changed) + 1
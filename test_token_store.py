@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import token_store
+from token_store import load_tokens, read_header, store_path
+
+
+def write_text(path, rows):
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write(' '.join(str(token) for token in row) + '\n')
+
+
+def test_round_trip_skips_other_lengths(tmp_path):
+    text_file = str(tmp_path / 'data.txt')
+    rows = np.random.RandomState(0).randint(0, 5000, [7, 4])
+    write_text(text_file, list(rows[:3]) + [[1, 2, 3]] + list(rows[3:]))
+    tokens = load_tokens(text_file, 4)
+    assert tokens.dtype == np.uint16
+    np.testing.assert_array_equal(tokens, rows)
+    # A store is memory-mapped, not parsed again
+    assert isinstance(load_tokens(text_file, 4), np.memmap)
+
+
+def test_large_vocabulary_uses_uint32(tmp_path):
+    text_file = str(tmp_path / 'data.txt')
+    write_text(text_file, [[0, 2 ** 16], [70000, 5]])
+    tokens = load_tokens(text_file, 2)
+    assert tokens.dtype == np.uint32
+    np.testing.assert_array_equal(tokens, [[0, 2 ** 16], [70000, 5]])
+
+
+def test_rebuilds_on_change_but_not_on_touch(tmp_path, monkeypatch):
+    text_file = str(tmp_path / 'data.txt')
+    write_text(text_file, [[1, 2], [3, 4]])
+    mapped = load_tokens(text_file, 2)
+
+    # Same size, other contents
+    write_text(text_file, [[5, 6], [7, 8]])
+    os.utime(text_file, ns=(0, os.stat(text_file).st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(load_tokens(text_file, 2), [[5, 6], [7, 8]])
+    # The store was replaced, not rewritten under the existing memory map
+    np.testing.assert_array_equal(mapped, [[1, 2], [3, 4]])
+
+    # Touched only, the store is kept and records the new mtime
+    os.utime(text_file, ns=(0, os.stat(text_file).st_mtime_ns + 10 ** 9))
+    def convert_text(*args):
+        raise AssertionError('store rebuilt')
+    monkeypatch.setattr(token_store, 'convert_text', convert_text)
+    np.testing.assert_array_equal(load_tokens(text_file, 2), [[5, 6], [7, 8]])
+    assert read_header(store_path(text_file))['source_mtime'] == os.stat(text_file).st_mtime_ns
+    # No temporary files are left behind
+    assert sorted(os.listdir(tmp_path)) == ['data.txt', 'data.txt.tokens']
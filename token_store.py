@@ -0,0 +1,141 @@
+'''
+Binary token store for token corpora.
+A store is a fixed size header followed by num_rows x seq_len tokens in uint16 (uint32 when the vocabulary does not fit), so it can be memory-mapped without any parsing.
+The header records the size, mtime and SHA-1 of the text file it was built from, load_tokens rebuilds the store when the source changes.
+
+Usage: python token_store.py data/real_data_oracle.txt instapic/real_data_500.txt
+'''
+import hashlib
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import numpy as np
+
+MAGIC = b'SEQGANTK'
+VERSION = 1
+# magic, version, dtype code, seq_len, num_rows, source size, source mtime (ns), source SHA-1
+HEADER_FORMAT = '<8sHHIQQQ20s'
+HEADER_SIZE = 64
+DTYPES = {1: np.uint16, 2: np.uint32}
+
+
+def load_token_file(data_file, seq_len=None):
+    # Parses a file of whitespace separated token ids, one sequence per line.
+    # With seq_len set, lines of any other length are skipped.
+    sequences = []
+    with open(data_file, 'r') as f:
+        for line in f:
+            line_list = [int(x) for x in line.strip().split()]
+            if seq_len is None or len(line_list) == seq_len:
+                sequences.append(line_list)
+    return np.array(sequences)
+
+
+def store_path(text_file):
+    return text_file + '.tokens'
+
+
+def file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.digest()
+
+
+def read_header(store_file):
+    with open(store_file, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        return None
+    magic, version, dtype_code, seq_len, num_rows, source_size, source_mtime, source_digest = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION or dtype_code not in DTYPES:
+        return None
+    return dict(dtype=DTYPES[dtype_code], dtype_code=dtype_code, seq_len=seq_len, num_rows=num_rows,
+                source_size=source_size, source_mtime=source_mtime, source_digest=source_digest)
+
+
+def write_header(f, dtype_code, seq_len, num_rows, source_size, source_mtime, source_digest):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, dtype_code, seq_len, num_rows, source_size, source_mtime, source_digest)
+    f.write(header.ljust(HEADER_SIZE, b'\0'))
+
+
+def write_store(store_file, write):
+    # Written to a file of its own next to the target and renamed over it, so readers (and memory maps) never see a
+    # half written store and processes building the same store at once do not write into each other's file
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(store_file)), prefix=os.path.basename(store_file), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp_file, 0o644)
+        os.replace(tmp_file, store_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def convert_text(text_file, store_file=None, seq_len=20):
+    """Parses text_file (whitespace separated token ids, one sequence per line) into a store, lines of any other length than seq_len are skipped."""
+    store_file = store_file or store_path(text_file)
+    stat = os.stat(text_file)
+    tokens = load_token_file(text_file, seq_len).reshape([-1, seq_len])
+    dtype_code = 1 if tokens.size == 0 or tokens.max() < 2 ** 16 else 2
+
+    def write(f):
+        write_header(f, dtype_code, seq_len, len(tokens), stat.st_size, stat.st_mtime_ns, file_digest(text_file))
+        f.write(tokens.astype(DTYPES[dtype_code]).tobytes())
+
+    write_store(store_file, write)
+    return store_file
+
+
+def open_store(store_file):
+    header = read_header(store_file)
+    if header is None:
+        raise ValueError(f"Not a token store: {store_file}")
+    if header['num_rows'] == 0:
+        return np.zeros([0, header['seq_len']], dtype=header['dtype'])
+    return np.memmap(store_file, dtype=header['dtype'], mode='r', offset=HEADER_SIZE,
+                     shape=(header['num_rows'], header['seq_len']))
+
+
+def is_current(store_file, text_file, seq_len):
+    if not os.path.exists(store_file):
+        return False
+    header = read_header(store_file)
+    if header is None or header['seq_len'] != seq_len:
+        return False
+    stat = os.stat(text_file)
+    if header['source_size'] != stat.st_size:
+        return False
+    if header['source_mtime'] == stat.st_mtime_ns:
+        return True
+    # Touched but maybe not changed, compare the contents and refresh the recorded mtime. The tokens are copied into a
+    # new store rather than patched in place, the old one may be memory-mapped
+    if header['source_digest'] != file_digest(text_file):
+        return False
+
+    def write(f):
+        write_header(f, header['dtype_code'], header['seq_len'], header['num_rows'], stat.st_size, stat.st_mtime_ns, header['source_digest'])
+        with open(store_file, 'rb') as old:
+            old.seek(HEADER_SIZE)
+            shutil.copyfileobj(old, f)
+
+    write_store(store_file, write)
+    return True
+
+
+def load_tokens(text_file, seq_len=20):
+    """Memory-mapped num_rows x seq_len tokens of text_file, (re)building the store next to it when needed."""
+    store_file = store_path(text_file)
+    if not is_current(store_file, text_file, seq_len):
+        convert_text(text_file, store_file, seq_len)
+    return open_store(store_file)
+
+
+if __name__ == '__main__':
+    for text_file in sys.argv[1:]:
+        tokens = load_tokens(text_file)
+        print(f'{text_file} -> {store_path(text_file)}: {tokens.shape[0]} rows of {tokens.dtype}')